@@ -3,15 +3,36 @@ import logging
 import tempfile
 import time
 import threading
+import multiprocessing
 import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify, send_from_directory
+import json
+import math
+import uuid
+import hashlib
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import urllib.parse
 
 # Import our modules
 from downloader import YoutubeDownloader
-from cache_manager import CacheManager
-from models import db, Download, Statistics
+from rate_limiter import create_rate_limiter, RateLimited
+from packager import stream_archive, archive_name, is_item_file, PACKAGING_MODES, ARCHIVE_TYPES
+from file_server import FileServer, content_disposition
+from cache_manager import CacheManager, DiskCache
+from output_cache import OutputCache
+from janitor import Janitor
+from workspace import Workspaces
+from playlist_manifest import PlaylistManifest
+from job_queue import JobScheduler, QueueFullError
+from process_executor import ProcessDownloadExecutor
+from progress_store import create_progress_store
+from progress_reporter import ProgressReporter
+from models import db, Download, DownloadPopularity, Statistics, upgrade_schema
+from retention import prune_downloads, EXPORT_FORMATS
+from stats_buffer import CounterBuffer
+from event_writer import DownloadEventWriter
+from yt_dlp.utils import DownloadCancelled
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, 
@@ -40,19 +61,227 @@ db.init_app(app)
 # Create database tables if they don't exist
 with app.app_context():
     db.create_all()
+    upgrade_schema()
     logger.debug("Database tables created")
 
+def flush_statistics(batch):
+    with app.app_context():
+        Statistics.flush_counts(batch)
+
+# Visit and download counts are added up in memory and written with one
+# atomic increment per day every STATS_FLUSH_INTERVAL seconds, or once
+# STATS_FLUSH_THRESHOLD increments are pending
+stats_counter = CounterBuffer(
+    flush_statistics,
+    interval=float(os.environ.get("STATS_FLUSH_INTERVAL", 5)),
+    threshold=int(os.environ.get("STATS_FLUSH_THRESHOLD", 100))
+)
+Statistics.counter_buffer = stats_counter
+
+def write_download_events(inserts, updates):
+    with app.app_context():
+        return Download.write_events(inserts, updates)
+
+# Download history records are written in the background, in batches of up
+# to DOWNLOAD_EVENTS_BATCH jobs every DOWNLOAD_EVENTS_INTERVAL seconds, so
+# requests and jobs never wait for the database
+history_writer = DownloadEventWriter(
+    write_download_events,
+    interval=float(os.environ.get("DOWNLOAD_EVENTS_INTERVAL", 1)),
+    batch_size=int(os.environ.get("DOWNLOAD_EVENTS_BATCH", 500)),
+    max_pending=int(os.environ.get("DOWNLOAD_EVENTS_MAX_PENDING", 10000))
+)
+
+# Download records older than DOWNLOAD_HISTORY_DAYS are compacted into daily
+# aggregates by 'flask prune-downloads' (run it from cron), after being
+# archived to DOWNLOAD_ARCHIVE_DIR if that is set
+DOWNLOAD_HISTORY_DAYS = int(os.environ.get("DOWNLOAD_HISTORY_DAYS", 90))
+DOWNLOAD_ARCHIVE_DIR = os.environ.get("DOWNLOAD_ARCHIVE_DIR")
+
+def record_download_status(download_id, status, **fields):
+    """Queue a status change (and non-empty fields) for a download's history record"""
+    history_writer.update(download_id, status=status, **{k: v for k, v in fields.items() if v})
+
+# Requests to YouTube go through a token bucket shared by all workers on this
+# host (RATE_LIMIT_PER_SECOND requests per second, bursts of RATE_LIMIT_BURST)
+RATE_LIMITER_OPTIONS = {
+    'rate': float(os.environ.get("RATE_LIMIT_PER_SECOND", 0.5)),
+    'burst': int(os.environ.get("RATE_LIMIT_BURST", 3)),
+    'path': os.environ.get(
+        "RATE_LIMIT_STATE_PATH",
+        os.path.join(tempfile.gettempdir(), "youtube_downloader_ratelimit")
+    ),
+}
+
+# Playlist items are downloaded PLAYLIST_CONCURRENCY at a time, in a work
+# directory under PLAYLIST_WORK_DIR that lets an interrupted job resume
+DOWNLOADER_OPTIONS = {
+    'playlist_concurrency': int(os.environ.get("PLAYLIST_CONCURRENCY", 3)),
+    'playlist_work_dir': os.environ.get("PLAYLIST_WORK_DIR"),
+}
+
 # Initialize the downloader and cache manager
-downloader = YoutubeDownloader()
-cache_manager = CacheManager(max_size=50)  # Store info for up to 50 videos
+downloader = YoutubeDownloader(
+    rate_limiter=create_rate_limiter(**RATE_LIMITER_OPTIONS),
+    **DOWNLOADER_OPTIONS
+)
+# Video info is cached in memory (up to 50 videos per worker) in front of a
+# persistent on-disk tier shared by all workers and kept across restarts
+METADATA_CACHE_PATH = os.environ.get(
+    "METADATA_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "youtube_downloader_metadata.db")
+)
+metadata_disk_cache = None
+if METADATA_CACHE_PATH:
+    try:
+        metadata_disk_cache = DiskCache(
+            METADATA_CACHE_PATH,
+            max_bytes=int(os.environ.get("METADATA_CACHE_MAX_MB", 256)) * 1024 * 1024
+        )
+    except Exception as e:
+        logger.error(f"Could not open metadata disk cache, using memory only: {str(e)}")
+cache_manager = CacheManager(max_size=50, persistent=metadata_disk_cache)
+
+# Playlists change more often than single videos, so keep them for less time
+PLAYLIST_INFO_TTL = 600
+
+# How long a /video_info request waits for an identical in-flight extraction
+VIDEO_INFO_TIMEOUT = int(os.environ.get("VIDEO_INFO_TIMEOUT", 60))
+
+# Raw yt-dlp info from /video_info, handed to the download job so it doesn't
+# extract the same video again. Memory only and short-lived, since the stream
+# URLs in it expire after a few hours
+RAW_INFO_TTL = int(os.environ.get("RAW_INFO_TTL", 1800))
+raw_info_cache = CacheManager(max_size=20, expiry_time=RAW_INFO_TTL)
+
+# The admin dashboard's numbers are recomputed at most this often
+ADMIN_SNAPSHOT_TTL = int(os.environ.get("ADMIN_SNAPSHOT_TTL", 30))
+admin_snapshot_cache = CacheManager(max_size=1, expiry_time=ADMIN_SNAPSHOT_TTL)
+
+# Finished single-video downloads are kept in an output cache shared by all
+# workers, so repeat requests for the same video and format skip the download
+OUTPUT_CACHE_DIR = os.environ.get(
+    "OUTPUT_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "youtube_downloader_outputs")
+)
+output_cache = None
+if OUTPUT_CACHE_DIR:
+    try:
+        output_cache = OutputCache(
+            OUTPUT_CACHE_DIR,
+            max_bytes=int(os.environ.get("OUTPUT_CACHE_MAX_MB", 2048)) * 1024 * 1024,
+            lease_ttl=int(os.environ.get("OUTPUT_CACHE_LEASE_TTL", 3600))
+        )
+    except Exception as e:
+        logger.error(f"Could not open output cache, downloading every request: {str(e)}")
+# Completion fields stored with a cached file and reported again on a hit
+OUTPUT_METADATA_FIELDS = ('quality_downgraded', 'quality_message', 'requested_quality', 'actual_quality')
+# Requests for an output that is already being downloaded attach to that job
+# and report these fields of its progress
+FOLLOWED_FIELDS = ('status', 'progress', 'speed', 'eta')
 
 # Create a temporary directory for downloads
 TEMP_DIR = tempfile.mkdtemp()
 logger.debug(f"Created temporary directory at {TEMP_DIR}")
+# Each job downloads into its own directory in TEMP_DIR
+workspaces = Workspaces(TEMP_DIR)
 
-# Track download progress
-download_progress = {}
-downloads_lock = threading.Lock()
+# Track download progress. The memory backend is per-process; the mmap and
+# sqlite backends are shared by every gunicorn worker on the host, so status
+# and file requests can land on any worker.
+PROGRESS_BACKEND = os.environ.get("PROGRESS_BACKEND", "memory")
+progress_store = create_progress_store(
+    PROGRESS_BACKEND,
+    os.environ.get(
+        "PROGRESS_STORE_PATH",
+        os.path.join(tempfile.gettempdir(), f"youtube_downloader_progress.{PROGRESS_BACKEND}")
+    )
+)
+
+# Bounded worker pool for download jobs (one queue per job type)
+scheduler = JobScheduler(
+    concurrency={
+        'video': int(os.environ.get("MAX_VIDEO_JOBS", 2)),
+        'audio': int(os.environ.get("MAX_AUDIO_JOBS", 2)),
+        'playlist': int(os.environ.get("MAX_PLAYLIST_JOBS", 1)),
+    },
+    max_queue_size=int(os.environ.get("MAX_QUEUED_JOBS", 50))
+)
+
+# Statuses after which a download's progress no longer changes
+TERMINAL_STATUSES = ('complete', 'error', 'cancelled')
+ERROR_MESSAGE_LENGTH = 500  # Progress entries keep this much of an error; the log has all of it
+
+# Progress streaming and batched polling limits
+SSE_KEEPALIVE = 15  # Seconds between keepalive comments on an idle stream
+SSE_QUEUED_REFRESH = 2  # Seconds between queue position checks for queued jobs
+SSE_MAX_DURATION = int(os.environ.get("SSE_MAX_DURATION", 300))
+# Each open stream holds a request thread (8 per gthread worker), so only this
+# many are served at once; further clients are refused and fall back to polling
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", 4))
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+MAX_BATCH_STATUS_IDS = 50
+
+# Playlist archives are streamed from /get_file while the items download,
+# instead of being zipped on disk once the whole playlist is done
+STREAM_PLAYLIST_ZIPS = os.environ.get("STREAM_PLAYLIST_ZIPS", "1") == "1"
+STREAM_ITEMS_FILE = '.items'  # Finished item names, in order, inside the items directory
+# Default playlist packaging: a 'zip' or 'tar' archive, or 'links' (one link per item)
+PLAYLIST_PACKAGING = os.environ.get("PLAYLIST_PACKAGING", "zip")
+PLAYLIST_LINKS_RETENTION = 1800  # Seconds items stay available in 'links' mode after the job
+# A streamed archive holds a request thread until the whole playlist is done,
+# so only this many are served at once, next to the progress streams
+ARCHIVE_MAX_STREAMS = int(os.environ.get("ARCHIVE_MAX_STREAMS", 2))
+ARCHIVE_STREAM_RETRY = 30  # Retry-After, in seconds, for refused archive streams
+archive_slots = threading.BoundedSemaphore(ARCHIVE_MAX_STREAMS)
+
+# One janitor thread removes downloads when they expire (sooner if free space
+# in TEMP_DIR drops below JANITOR_LOW_FREE_MB, until JANITOR_HIGH_FREE_MB is
+# free again), sweeps leftovers of failed jobs and expires old progress entries
+DOWNLOAD_RETENTION = int(os.environ.get("DOWNLOAD_RETENTION", 3600))  # Unfetched downloads
+FETCHED_RETENTION = 300  # Seconds a download stays available after it was fetched
+FAILED_RETENTION = 600  # Seconds failed and cancelled downloads keep their status
+TEMP_MAX_AGE = int(os.environ.get("TEMP_MAX_AGE", 6 * 3600))
+PLAYLIST_WORK_MAX_AGE = int(os.environ.get("PLAYLIST_WORK_MAX_AGE", 24 * 3600))
+PROGRESS_ENTRY_TTL = int(os.environ.get("PROGRESS_ENTRY_TTL", 6 * 3600))
+janitor = Janitor(
+    TEMP_DIR,
+    low_free_bytes=int(os.environ.get("JANITOR_LOW_FREE_MB", 1024)) * 1024 * 1024,
+    high_free_bytes=int(os.environ.get("JANITOR_HIGH_FREE_MB", 2048)) * 1024 * 1024,
+    interval=int(os.environ.get("JANITOR_INTERVAL", 60))
+)
+janitor.watch_directory(workspaces.jobs_root, TEMP_MAX_AGE)
+janitor.watch_directory(workspaces.files_root, TEMP_MAX_AGE)
+# Interrupted playlist jobs can be resumed until their work directory expires
+janitor.watch_directory(downloader.playlist_work_root, PLAYLIST_WORK_MAX_AGE, skip=PlaylistManifest.is_locked)
+janitor.expire_progress(progress_store, PROGRESS_ENTRY_TTL)
+
+# Finished files are served with Range support; behind nginx or Apache they
+# can be handed off with FILE_OFFLOAD=x-accel-redirect or x-sendfile
+file_server = FileServer(
+    offload=os.environ.get("FILE_OFFLOAD"),
+    offload_root=os.environ.get("FILE_OFFLOAD_ROOT", tempfile.gettempdir()),
+    offload_prefix=os.environ.get("FILE_OFFLOAD_PREFIX", "/protected-downloads/")
+)
+
+# How often a job may write progress to the store
+REPORTER_OPTIONS = {
+    'min_interval': float(os.environ.get("PROGRESS_MIN_INTERVAL", 0.5)),
+    'min_percent': float(os.environ.get("PROGRESS_MIN_PERCENT", 1.0)),
+}
+
+# Optionally run downloads in worker processes so yt-dlp's Python-side work
+# doesn't compete with request handling for the GIL
+# (worker processes that re-import this module as part of spawning skip this)
+process_executor = None
+if os.environ.get("DOWNLOAD_EXECUTOR", "thread") == "process" and multiprocessing.parent_process() is None:
+    process_executor = ProcessDownloadExecutor(
+        max_workers=int(os.environ.get("DOWNLOAD_PROCESSES", os.cpu_count() or 2)),
+        reporter_options=REPORTER_OPTIONS,
+        rate_limiter_options=RATE_LIMITER_OPTIONS,
+        downloader_options=DOWNLOADER_OPTIONS
+    )
+    logger.debug("Downloads will run in a process pool")
 
 @app.route('/')
 def index():
@@ -77,16 +306,32 @@ def get_video_info():
         return jsonify({'error': 'Please enter a valid YouTube URL'}), 400
     
     try:
-        # Check if this URL is in cache
-        video_info = cache_manager.get_cache(url)
-        
-        if not video_info:
-            # Not in cache, get the info
-            video_info = downloader.get_video_info(url)
-            cache_manager.add_to_cache(url, video_info)
+        # Check if this video is in cache; URL variants share one entry, and
+        # concurrent misses for the same video share a single extraction
+        cache_key = downloader.canonical_key(url)
+        video_info = cache_manager.get_or_load(
+            cache_key,
+            lambda: downloader.get_video_info(
+                url,
+                info_sink=lambda raw_info: raw_info_cache.add_to_cache(
+                    downloader.canonical_key(url, playlist=False), raw_info
+                )
+            ),
+            ttl=lambda info: PLAYLIST_INFO_TTL if info.get('is_playlist') else None,
+            timeout=VIDEO_INFO_TIMEOUT
+        )
         
         return jsonify(video_info)
     
+    except RateLimited as e:
+        # Cache misses only; tell the client when to try again instead of
+        # holding this worker thread
+        retry_after = max(int(math.ceil(e.retry_after)), 1)
+        response = jsonify({'error': str(e), 'retry_after': retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+    
     except Exception as e:
         logger.error(f"Error getting video info: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -98,23 +343,80 @@ def download_video():
     format_id = request.form.get('format', 'best')
     download_type = request.form.get('type', 'video')
     playlist = request.form.get('playlist', 'false') == 'true'
-    video_title = request.form.get('title', 'Unknown Video')
+    video_title = request.form.get('title') or 'Unknown Video'
+    packaging = request.form.get('packaging') or PLAYLIST_PACKAGING
     
     if not url:
         flash('Please enter a valid YouTube URL', 'danger')
         return redirect(url_for('index'))
     
+    job_type = 'playlist' if playlist else download_type
+    
+    if playlist and packaging not in PACKAGING_MODES:
+        return jsonify({'error': f"Unknown packaging '{packaging}'"}), 400
+    
+    # Popular videos are usually already in the output cache
+    output_key = None
+    cached_output = None
+    if output_cache and not playlist:
+        output_key = downloader.output_key(url, download_type, format_id)
+        if output_key:
+            try:
+                cached_output = output_cache.acquire(output_key)
+            except Exception as e:
+                logger.error(f"Error reading output cache: {str(e)}")
+    
+    # or being downloaded for someone else right now
+    followed_job = None
+    if output_key and not cached_output:
+        followed_job = attach_to_job(output_key)
+    
+    if not cached_output and not followed_job:
+        try:
+            # Reject early with queue information if we are already at capacity
+            scheduler.check_capacity(job_type)
+        except QueueFullError as e:
+            return queue_full_response(e)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
     try:
-        # Generate a unique ID for this download
-        download_id = str(int(time.time() * 1000))
-        with downloads_lock:
-            download_progress[download_id] = {
-                'progress': 0,
-                'status': 'starting',
-                'filename': None,
-                'db_id': None,  # Will store database record ID
-                'start_time': time.time()  # Track when download started
-            }
+        # Generate a unique ID for this download (it also names the job's workspace)
+        download_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        entry = {
+            'progress': 0,
+            'status': 'queued',
+            'filename': None,
+            'start_time': time.time()  # Track when download started
+        }
+        if playlist and STREAM_PLAYLIST_ZIPS:
+            suffix = '_audio' if download_type == 'audio' else ''
+            entry['stream'] = True
+            entry['packaging'] = packaging
+            entry['archive_name'] = None
+            if packaging in ARCHIVE_TYPES:
+                entry['archive_name'] = archive_name(f"{secure_filename(video_title) or 'playlist'}{suffix}", packaging)
+            entry['items_ready'] = 0
+        if output_key:
+            entry['output_key'] = output_key
+        if cached_output:
+            # Nothing to download, the file is ready to be fetched
+            entry.update(cached_output['metadata'])
+            entry.update(
+                status='complete',
+                progress=100,
+                filename=cached_output['path'],
+                output_lease=cached_output['lease']
+            )
+        if followed_job:
+            entry['follows'] = followed_job
+        progress_store.set(download_id, entry)
+        if output_key and not cached_output and not followed_job:
+            # Later requests for the same output attach to this job, unless
+            # another request registered the same output since we checked
+            followed_job = register_job(download_id, output_key)
+            if followed_job:
+                progress_store.update(download_id, follows=followed_job)
         
         # Record download in database
         try:
@@ -128,19 +430,23 @@ def download_video():
                 else:
                     ip_address = "0.0.0.0"  # Fallback
             
-            # Create download record
-            download_record = Download.add_download(
+            # Popularity is counted per canonical video, not per title or URL variant
+            video_key = downloader.canonical_key(url, playlist=playlist)
+            
+            # Queue the download record; it is keyed by download_id from now on
+            history_writer.insert(
+                download_id,
                 url=url,
+                video_id=None if video_key.startswith('url:') else video_key[:64],
                 video_title=video_title,
                 format_type=download_type,
                 quality=format_id,
-                status="started",
-                ip_address=ip_address
+                file_size=cached_output['size'] if cached_output else None,
+                download_time=0 if cached_output else None,
+                status="completed" if cached_output else "started",
+                ip_address=ip_address,
+                created_at=datetime.datetime.utcnow()
             )
-            
-            # Store database ID in progress tracker
-            with downloads_lock:
-                download_progress[download_id]['db_id'] = download_record.id
                 
             # Record download in statistics
             Statistics.record_download(download_type)
@@ -149,65 +455,232 @@ def download_video():
             logger.error(f"Error recording download in database: {str(db_error)}")
             # Continue with download even if database recording fails
         
-        # Start download in background thread
-        download_thread = threading.Thread(
-            target=process_download,
-            args=(download_id, url, format_id, download_type, playlist)
-        )
-        download_thread.daemon = True
-        download_thread.start()
+        if cached_output:
+            logger.info(f"Download {download_id} served from the output cache")
+            return jsonify({
+                'download_id': download_id,
+                'message': 'Download ready',
+                'queue_position': 0
+            })
+        if followed_job:
+            logger.info(f"Download {download_id} attached to in-flight job {followed_job}")
+            return jsonify({
+                'download_id': download_id,
+                'message': 'Download started',
+                'queue_position': scheduler.position(followed_job) or 0
+            })
+        
+        # Hand the job to the worker pool
+        try:
+            position = scheduler.submit(
+                download_id,
+                job_type,
+                process_download,
+                args=(download_id, url, format_id, download_type, playlist)
+            )
+        except QueueFullError as e:
+            # Lost a race for the last queue slot
+            if output_key:
+                release_inflight_job(download_id, output_key)
+            progress_store.delete(download_id)
+            record_download_status(download_id, "rejected")
+            return queue_full_response(e)
         
         return jsonify({
             'download_id': download_id,
-            'message': 'Download started'
+            'message': 'Download queued' if position > 1 else 'Download started',
+            'queue_position': position
         })
     
     except Exception as e:
         logger.error(f"Error starting download: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def queue_full_response(error):
+    """Build the 429 response returned when the job queue is full"""
+    response = jsonify({
+        'error': 'The server is busy, please try again shortly',
+        'queue_position': error.position,
+        'eta': error.eta
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(error.eta, 1))
+    return response
+
+def is_cancel_requested(download_id):
+    """Check whether a job was cancelled, either locally or through another worker"""
+    if scheduler.is_cancelled(download_id):
+        return True
+    entry = progress_store.get(download_id)
+    return bool(entry and entry.get('cancel_requested'))
+
+def inflight_key(output_key):
+    """Progress store key of the record pointing at the job producing output_key"""
+    return 'inflight:' + hashlib.sha1(output_key.encode('utf-8')).hexdigest()[:24]
+
+def attach_to_job(output_key):
+    """Join the job that is already producing output_key, instead of starting another
+
+    Returns the job's download ID, or None if there is no such job. The
+    record counts the clients attached to the job, so cancelling one of them
+    doesn't stop the download for the others.
+    """
+    key = inflight_key(output_key)
+    record = progress_store.get(key)
+    if not record:
+        return None
+    job = progress_store.get(record['download_id'])
+    if job is None or job['status'] in ('error', 'cancelled'):
+        return None
+    if progress_store.increment(key, 'clients') is None:
+        return None  # The job ended in the meantime
+    return record['download_id']
+
+def register_job(download_id, output_key):
+    """Record download_id as the job producing output_key
+
+    The record is created atomically, so of several requests for the same
+    output only one starts a job. Returns None once registered, or the
+    download ID of the job to attach to if another request got there first.
+    """
+    if progress_store.add(inflight_key(output_key), {'download_id': download_id, 'clients': 1}):
+        return None
+    return attach_to_job(output_key)
+
+def leave_job(job_id, output_key):
+    """Detach one client from a job; return how many are left, or None if it isn't tracked"""
+    key = inflight_key(output_key)
+    record = progress_store.get(key)
+    if not record or record['download_id'] != job_id:
+        return None
+    return progress_store.increment(key, 'clients', -1)
+
+def release_inflight_job(download_id, output_key):
+    """Stop attaching new requests for output_key to this job"""
+    key = inflight_key(output_key)
+    record = progress_store.get(key)
+    if record and record['download_id'] == download_id:
+        progress_store.delete(key)
+
+def resolve_attached(download_id, entry):
+    """Return an attached download's entry brought up to date with its job
+
+    While the job runs, the entry shows the job's progress. Once it's done,
+    the attached download takes its own lease on the cached file, so the file
+    stays around until every client has fetched it.
+    """
+    if not entry.get('follows') or entry['status'] in TERMINAL_STATUSES:
+        return entry
+    job = progress_store.get(entry['follows'])
+    if job is not None and job['status'] not in TERMINAL_STATUSES:
+        return dict(entry, **{field: job[field] for field in FOLLOWED_FIELDS if field in job})
+    
+    cached_output = None
+    try:
+        cached_output = output_cache.acquire(entry['output_key'])
+    except Exception as e:
+        logger.error(f"Error reading output cache: {str(e)}")
+    if cached_output:
+        fields = dict(cached_output['metadata'])
+        fields.update(
+            status='complete',
+            progress=100,
+            filename=cached_output['path'],
+            output_lease=cached_output['lease']
+        )
+    else:
+        fields = {
+            'status': 'error',
+            'error': (job or {}).get('error') or 'The download this request was waiting for did not finish'
+        }
+    progress_store.update(download_id, **fields)
+    schedule_download_cleanup(download_id, DOWNLOAD_RETENTION if cached_output else FAILED_RETENTION)
+    
+    # Update database record
+    record_download_status(
+        download_id,
+        "completed" if cached_output else "failed",
+        file_size=cached_output['size'] if cached_output else None
+    )
+    return dict(entry, **fields)
+
+def make_item_hook(download_id):
+    """Record finished playlist items so /get_file can stream them"""
+    items = []
+    
+    def item_hook(filepath):
+        if filepath in items:
+            return  # Reported again by a retry
+        items.append(filepath)
+        items_dir = os.path.dirname(filepath)
+        # The item list lives next to the items; the store only carries the count.
+        # A resumed work directory may still hold the list of an earlier job
+        with open(os.path.join(items_dir, STREAM_ITEMS_FILE), 'a' if len(items) > 1 else 'w') as items_file:
+            items_file.write(os.path.basename(filepath) + '\n')
+        progress_store.update(download_id, items_dir=items_dir, items_ready=len(items))
+    
+    return item_hook
+
 def process_download(download_id, url, format_id, download_type, playlist):
-    """Process the download in a background thread"""
+    """Process the download on a scheduler worker thread"""
+    keep_workspace = False
     try:
-        with downloads_lock:
-            download_progress[download_id]['status'] = 'downloading'
+        if is_cancel_requested(download_id):
+            raise DownloadCancelled(f"Download {download_id} was cancelled")
+        progress_store.update(download_id, status='downloading')
+        workspace = workspaces.create(download_id)
         
-        # Define progress callback function
-        def progress_hook(d):
-            if d['status'] == 'downloading':
-                try:
-                    total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                    downloaded = d.get('downloaded_bytes', 0)
-                    
-                    if total > 0:
-                        percent = downloaded / total * 100
-                    else:
-                        percent = 0
-                    
-                    with downloads_lock:
-                        download_progress[download_id]['progress'] = percent
-                except Exception as e:
-                    logger.error(f"Error updating progress: {str(e)}")
-            
-            elif d['status'] == 'finished':
-                with downloads_lock:
-                    download_progress[download_id]['status'] = 'processing'
+        # Coalesce yt-dlp's per-chunk callbacks into occasional store writes
+        progress_hook = ProgressReporter(
+            lambda fields: progress_store.update(download_id, **fields),
+            should_stop=lambda: is_cancel_requested(download_id),
+            **REPORTER_OPTIONS
+        )
+        
+        # Streamed playlist archives get their items as they finish
+        item_hook = None
+        if playlist and (progress_store.get(download_id) or {}).get('stream'):
+            item_hook = make_item_hook(download_id)
+        
+        # Reuse the info /video_info already extracted for this video, if we still have it
+        info = None
+        if not playlist:
+            info = raw_info_cache.get_cache(downloader.canonical_key(url, playlist=False))
         
         # Perform the download
-        if download_type == 'audio':
+        if process_executor:
+            # Run yt-dlp in a worker process; progress comes back through the pump thread
+            download_result = process_executor.run(
+                download_id,
+                download_type,
+                url,
+                format_id,
+                workspace,
+                playlist,
+                publish=progress_hook.publish,
+                should_stop=progress_hook.should_stop,
+                info=info,
+                item_hook=item_hook
+            )
+        elif download_type == 'audio':
             download_result = downloader.download_audio(
                 url, 
-                output_path=TEMP_DIR, 
+                format_id=format_id, 
+                output_path=workspace, 
                 progress_hook=progress_hook,
-                playlist=playlist
+                playlist=playlist,
+                info=info,
+                item_hook=item_hook
             )
         else:  # video
             download_result = downloader.download_video(
                 url, 
                 format_id=format_id, 
-                output_path=TEMP_DIR, 
+                output_path=workspace, 
                 progress_hook=progress_hook,
-                playlist=playlist
+                playlist=playlist,
+                info=info,
+                item_hook=item_hook
             )
         
         # Get file path and quality info from result
@@ -216,101 +689,372 @@ def process_download(download_id, url, format_id, download_type, playlist):
         quality_message = download_result.get('quality_message')
         
         # Update download status
-        with downloads_lock:
-            download_progress[download_id]['status'] = 'complete'
-            download_progress[download_id]['filename'] = filename
-            
-            # Add quality downgrade information if applicable
-            if quality_downgraded:
-                download_progress[download_id]['quality_downgraded'] = True
-                download_progress[download_id]['quality_message'] = quality_message
-                download_progress[download_id]['requested_quality'] = download_result.get('requested_quality')
-                download_progress[download_id]['actual_quality'] = download_result.get('actual_quality')
-            
-            # Update database record if we have one
-            db_id = download_progress[download_id].get('db_id')
-            if db_id:
+        completion = {'status': 'complete', 'filename': filename}
+        
+        if item_hook:
+            # The items stay in their directory; /get_file packages them on the fly
+            # (in 'links' mode there is no archive, only the items)
+            items_dir = filename
+            filename = (progress_store.get(download_id) or {}).get('archive_name')
+            completion.update(filename=filename, items_dir=items_dir)
+            file_size = sum(
+                os.path.getsize(os.path.join(items_dir, name))
+                for name in os.listdir(items_dir) if is_item_file(name)
+            )
+            # Items are delivered from where they are, which may be the workspace
+            keep_workspace = workspaces.contains(download_id, items_dir)
+        else:
+            file_size = os.path.getsize(filename) if os.path.exists(filename) else None
+        
+        # Add quality downgrade information if applicable
+        if quality_downgraded:
+            completion['quality_downgraded'] = True
+            completion['quality_message'] = quality_message
+            completion['requested_quality'] = download_result.get('requested_quality')
+            completion['actual_quality'] = download_result.get('actual_quality')
+        
+        # Only the exact output file leaves the workspace, in a single rename:
+        # into the output cache, for later requests for the same video and
+        # format, or into a directory of its own
+        if not item_hook:
+            output_key = (progress_store.get(download_id) or {}).get('output_key')
+            if output_key and output_cache and os.path.exists(filename):
                 try:
-                    # Get file size if available
-                    file_size = os.path.getsize(filename) if os.path.exists(filename) else None
-                    
-                    # Calculate download time (estimate)
-                    start_time = download_progress[download_id].get('start_time', time.time() - 30)
-                    download_time = time.time() - start_time
-                    
-                    # Update record in database
-                    Download.update_status(
-                        download_id=db_id,
-                        status="completed",
-                        file_size=file_size,
-                        download_time=download_time
-                    )
-                except Exception as db_error:
-                    logger.error(f"Error updating download record: {str(db_error)}")
+                    cached_output = output_cache.store(output_key, filename, metadata={
+                        field: completion[field] for field in OUTPUT_METADATA_FIELDS if field in completion
+                    })
+                    completion.update(filename=cached_output['path'], output_lease=cached_output['lease'])
+                except Exception as e:
+                    logger.error(f"Error storing download in output cache: {str(e)}")
+            if not completion.get('output_lease'):
+                completion['filename'] = workspaces.publish(download_id, filename)
+        
+        # Report playlist items that could not be downloaded
+        failed_items = download_result.get('failed_items')
+        if failed_items:
+            completion['playlist_failed'] = len(failed_items)
+            completion['items_message'] = (
+                f"{len(failed_items)} of {download_result.get('playlist_count')} playlist items "
+                f"could not be downloaded and are missing from the archive"
+            )
+        
+        progress_store.update(download_id, **completion)
+        # Removed if nobody fetches it; fetching it shortens this (see get_file)
+        links_only = item_hook and not completion['filename']
+        schedule_download_cleanup(download_id, PLAYLIST_LINKS_RETENTION if links_only else DOWNLOAD_RETENTION)
+        
+        # Update database record
+        entry = progress_store.get(download_id) or {}
+        start_time = entry.get('start_time', time.time() - 30)
+        record_download_status(
+            download_id,
+            "completed",
+            file_size=file_size,
+            download_time=time.time() - start_time
+        )
     
     except Exception as e:
-        logger.error(f"Download error: {str(e)}")
-        with downloads_lock:
-            download_progress[download_id]['status'] = 'error'
-            download_progress[download_id]['error'] = str(e)
-            
-            # Update database record if we have one
-            db_id = download_progress[download_id].get('db_id')
-            if db_id:
-                try:
-                    # Update record in database
-                    Download.update_status(
-                        download_id=db_id,
-                        status="failed"
-                    )
-                except Exception as db_error:
-                    logger.error(f"Error updating download record: {str(db_error)}")
+        cancelled = is_cancel_requested(download_id)
+        if cancelled:
+            logger.info(f"Download {download_id} cancelled")
+            progress_store.update(download_id, status='cancelled')
+        else:
+            logger.error(f"Download error: {str(e)}")
+            progress_store.update(download_id, status='error', error=str(e)[:ERROR_MESSAGE_LENGTH])
+        schedule_download_cleanup(download_id, FAILED_RETENTION)
+        
+        # Update database record
+        record_download_status(download_id, "cancelled" if cancelled else "failed")
+    
+    finally:
+        # Partial and intermediate files go with the workspace
+        if not keep_workspace:
+            workspaces.discard(download_id)
+        
+        # New requests for this output go to the output cache from now on
+        output_key = (progress_store.get(download_id) or {}).get('output_key')
+        if output_key:
+            release_inflight_job(download_id, output_key)
+
+def build_status(download_id, entry):
+    """Build the client-facing status for a progress entry"""
+    status = dict(resolve_attached(download_id, entry))
+    # The job keeps running for other clients, but this one cancelled
+    if status.get('detached'):
+        status['status'] = 'cancelled'
+    # While waiting for a worker, report the live queue position
+    if status['status'] == 'queued':
+        job_id = status.get('follows') or download_id
+        status['queue_position'] = scheduler.position(job_id)
+        status['eta'] = scheduler.eta(job_id)
+    # If download is complete, include file download URL
+    if status['status'] == 'complete' and status['filename']:
+        status['download_url'] = url_for('get_file', download_id=download_id)
+    # A streamed playlist archive can be fetched as soon as the job starts
+    elif status.get('archive_name') and status['status'] in ('downloading', 'processing'):
+        status['download_url'] = url_for('get_file', download_id=download_id)
+    # Without an archive, each finished item gets its own link
+    if status.get('packaging') == 'links' and status.get('items_ready'):
+        status['item_urls'] = [
+            {'name': name, 'url': url_for('get_item', download_id=download_id, index=index)}
+            for index, name in enumerate(read_stream_items(entry))
+        ]
+    return status
 
 @app.route('/download_status/<download_id>', methods=['GET'])
 def check_download_status(download_id):
     """Check the status of a download"""
-    with downloads_lock:
-        if download_id in download_progress:
-            status = download_progress[download_id].copy()
-            # If download is complete, include file download URL
-            if status['status'] == 'complete' and status['filename']:
-                status['download_url'] = url_for('get_file', download_id=download_id)
-            return jsonify(status)
-        else:
-            return jsonify({'error': 'Download not found'}), 404
+    entry = progress_store.get(download_id)
+    if entry is None:
+        return jsonify({'error': 'Download not found'}), 404
+    return jsonify(build_status(download_id, entry))
+
+@app.route('/download_status', methods=['GET'])
+def check_download_statuses():
+    """Check the status of several downloads at once (?ids=a,b,c)"""
+    ids = [download_id for download_id in request.args.get('ids', '').split(',') if download_id]
+    if not ids:
+        return jsonify({'error': 'No download IDs given'}), 400
+    if len(ids) > MAX_BATCH_STATUS_IDS:
+        return jsonify({'error': f'At most {MAX_BATCH_STATUS_IDS} downloads per request'}), 400
+    
+    statuses = {}
+    for download_id in ids:
+        entry = progress_store.get(download_id)
+        statuses[download_id] = build_status(download_id, entry) if entry else {'error': 'Download not found'}
+    return jsonify({'downloads': statuses})
+
+@app.route('/download_events/<download_id>', methods=['GET'])
+def download_events(download_id):
+    """Stream status changes of a download as Server-Sent Events"""
+    if progress_store.get(download_id) is None:
+        return jsonify({'error': 'Download not found'}), 404
+    
+    # Refused streams make EventSource give up and the page poll /download_status
+    if not sse_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many progress streams, poll /download_status instead'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_KEEPALIVE)
+        return response
+    
+    def generate():
+        # Ask the browser to reconnect quickly if the stream drops
+        yield 'retry: 2000\n\n'
+        
+        # An attached download changes when the job it follows does
+        watch_id = (progress_store.get(download_id) or {}).get('follows') or download_id
+        version = None
+        last_sent = None
+        last_write = time.monotonic()
+        timeout = 0
+        stream_end = last_write + SSE_MAX_DURATION
+        while time.monotonic() < stream_end:
+            watched = progress_store.wait_for_change(watch_id, version, timeout=timeout)
+            entry = watched if watch_id == download_id else progress_store.get(download_id)
+            if entry is None:
+                yield 'event: gone\ndata: {"error": "Download not found"}\n\n'
+                return
+            if watched is None:
+                # The job's entry was cleaned up; this one has its own result now
+                watch_id = download_id
+                watched = entry
+            
+            version = watched['version']
+            status = build_status(download_id, entry)
+            snapshot = json.dumps(status, sort_keys=True)
+            if snapshot != last_sent:
+                # Only push snapshots that actually changed
+                last_sent = snapshot
+                last_write = time.monotonic()
+                yield f'data: {snapshot}\n\n'
+                if status['status'] in TERMINAL_STATUSES:
+                    return
+            elif time.monotonic() - last_write >= SSE_KEEPALIVE:
+                last_write = time.monotonic()
+                yield ': keepalive\n\n'
+            
+            # Queue positions change without a store write, so re-check them more often
+            timeout = SSE_QUEUED_REFRESH if status['status'] == 'queued' else SSE_KEEPALIVE
+        # Long-lived streams are closed periodically; EventSource reconnects
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    # The server closes the response even if the stream never started
+    response.call_on_close(sse_slots.release)
+    return response
+
+@app.route('/cancel_download/<download_id>', methods=['POST'])
+def cancel_download(download_id):
+    """Cancel a queued or running download"""
+    entry = progress_store.get(download_id)
+    if entry is None:
+        return jsonify({'error': 'Download not found'}), 404
+    if entry.get('detached') or entry['status'] not in ('queued', 'downloading', 'processing'):
+        return jsonify({'error': 'Download is not queued or running'}), 409
+    
+    # Requests attached to a job share it; cancelling one of them only
+    # detaches it while others are still waiting for the file
+    if entry.get('output_key'):
+        job_id = entry.get('follows') or download_id
+        remaining = leave_job(job_id, entry['output_key'])
+        if entry.get('follows') or remaining:
+            if entry.get('follows'):
+                progress_store.update(download_id, status='cancelled')
+                schedule_download_cleanup(download_id, FAILED_RETENTION)
+                record_download_status(download_id, "cancelled")
+            else:
+                progress_store.update(download_id, detached=True)
+            
+            # The last attached client left a job its own requester already gave up on
+            job = progress_store.get(job_id)
+            if remaining == 0 and job and job.get('detached'):
+                cancel_job(job_id, job)
+            return jsonify({'download_id': download_id, 'status': 'cancelled'})
+    
+    return jsonify({'download_id': download_id, 'status': cancel_job(download_id, entry)})
+
+def cancel_job(download_id, entry):
+    """Cancel the job behind a download; return 'cancelled' or 'cancelling'"""
+    result = scheduler.cancel(download_id)
+    if result is None:
+        # The job belongs to another worker process; it picks this flag up
+        # from the shared progress store
+        progress_store.update(download_id, cancel_requested=True)
+        result = 'cancelling'
+    
+    if result == 'cancelling' and process_executor:
+        # Don't wait for the next progress event to reach the worker process
+        process_executor.cancel(download_id)
+    
+    if result == 'cancelled':
+        # Never started, so finish it off here
+        progress_store.update(download_id, status='cancelled')
+        schedule_download_cleanup(download_id, FAILED_RETENTION)
+        if entry.get('output_key'):
+            release_inflight_job(download_id, entry['output_key'])
+        record_download_status(download_id, "cancelled")
+    
+    return result
+
+def read_stream_items(entry):
+    """Return the names of the finished items of a streamed playlist, in order"""
+    if not entry.get('items_ready'):
+        return []
+    with open(os.path.join(entry['items_dir'], STREAM_ITEMS_FILE)) as items_file:
+        return items_file.read().splitlines()[:entry['items_ready']]
+
+def iter_stream_items(download_id):
+    """Yield (name, path) for each item of a streamed playlist as it finishes
+
+    Follows the job through the progress store, so it works from any worker.
+    Raises if the job fails or is cancelled, which aborts the response rather
+    than handing the client a truncated archive that looks complete.
+    """
+    sent = 0
+    while True:
+        entry = progress_store.get(download_id)
+        if entry is None:
+            raise RuntimeError(f"Download {download_id} expired while streaming")
+        
+        if entry.get('items_ready', 0) > sent:
+            names = read_stream_items(entry)
+            for name in names[sent:]:
+                yield name, os.path.join(entry['items_dir'], name)
+            sent = len(names)
+            continue
+        
+        if entry['status'] == 'complete':
+            return
+        if entry['status'] in TERMINAL_STATUSES:
+            raise RuntimeError(f"Download {download_id} ended with status {entry['status']}")
+        progress_store.wait_for_change(download_id, entry['version'], timeout=SSE_KEEPALIVE)
+
+def schedule_download_cleanup(download_id, delay):
+    """(Re)schedule removal of a download's files and progress entry
+
+    Files in the output cache stay there for later requests; only this
+    download's lease on them is released. The deadline is also recorded in
+    the progress entry, so a janitor in another worker process that
+    scheduled an earlier one leaves the files alone.
+    """
+    cleanup_at = time.time() + delay
+    progress_store.update(download_id, cleanup_at=cleanup_at)
+    entry = progress_store.get(download_id) or {}
+    lease = entry.get('output_lease')
+    paths = []
+    if entry.get('status') == 'complete':
+        if entry.get('items_dir'):
+            paths.append(entry['items_dir'])
+        elif entry.get('filename') and not lease:
+            # A published file has a directory of its own
+            output_dir = workspaces.output_dir(download_id)
+            paths.append(output_dir if os.path.dirname(entry['filename']) == output_dir else entry['filename'])
+    
+    def still_due():
+        current = progress_store.get(download_id)
+        return current is None or current.get('cleanup_at', 0) <= cleanup_at
+    
+    def expired():
+        if lease:
+            output_cache.release(lease)
+        progress_store.delete(download_id)
+    
+    janitor.expire(download_id, delay, paths=paths, callback=expired, guard=still_due)
+
+def stream_playlist_archive(download_id, entry):
+    """Stream a playlist archive from /get_file while its items are still downloading"""
+    if not archive_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many archive downloads in progress, please try again shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(ARCHIVE_STREAM_RETRY)
+        return response
+    
+    packaging = entry.get('packaging', 'zip')
+    
+    def generate():
+        yield from stream_archive(packaging, iter_stream_items(download_id))
+        # Same cleanup as for regular files once the archive went out completely
+        schedule_download_cleanup(download_id, FETCHED_RETENTION)
+    
+    _, mimetype = ARCHIVE_TYPES[packaging]
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = content_disposition(entry['archive_name'])
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    # The server closes the response even if the stream never started
+    response.call_on_close(archive_slots.release)
+    return response
 
 @app.route('/get_file/<download_id>', methods=['GET'])
 def get_file(download_id):
     """Download the completed file"""
-    with downloads_lock:
-        if download_id in download_progress and download_progress[download_id]['status'] == 'complete':
-            filename = download_progress[download_id]['filename']
-            if filename and os.path.exists(filename):
-                basename = os.path.basename(filename)
-                
-                # After download is complete, mark for cleanup
-                def cleanup_file():
-                    # Wait a bit to ensure file is fully downloaded
-                    time.sleep(300)  # 5 minutes
-                    try:
-                        if os.path.exists(filename):
-                            os.remove(filename)
-                            logger.debug(f"Removed temporary file: {filename}")
-                        with downloads_lock:
-                            if download_id in download_progress:
-                                del download_progress[download_id]
-                    except Exception as e:
-                        logger.error(f"Error cleaning up file: {str(e)}")
-                
-                cleanup_thread = threading.Thread(target=cleanup_file)
-                cleanup_thread.daemon = True
-                cleanup_thread.start()
-                
-                return send_file(
-                    filename,
-                    as_attachment=True,
-                    download_name=basename
-                )
+    entry = progress_store.get(download_id)
+    if entry:
+        entry = resolve_attached(download_id, entry)
+    if entry and entry.get('archive_name') and entry['status'] in ('downloading', 'processing', 'complete'):
+        return stream_playlist_archive(download_id, entry)
+    
+    if entry and entry['status'] == 'complete' and not entry.get('detached'):
+        filename = entry['filename']
+        if filename and os.path.exists(filename):
+            # Kept a little longer after each request, so Range requests
+            # that resume the download still find the file
+            schedule_download_cleanup(download_id, FETCHED_RETENTION)
+            
+            return file_server.send(request, filename, os.path.basename(filename))
+    
+    return jsonify({'error': 'File not found or download not complete'}), 404
+
+@app.route('/get_file/<download_id>/<int:index>', methods=['GET'])
+def get_item(download_id, index):
+    """Download a single finished item of a playlist packaged as 'links'"""
+    entry = progress_store.get(download_id)
+    if entry and entry.get('stream'):
+        names = read_stream_items(entry)
+        if index < len(names):
+            path = os.path.join(entry['items_dir'], names[index])
+            if os.path.exists(path):
+                return file_server.send(request, path, names[index])
     
     return jsonify({'error': 'File not found or download not complete'}), 404
 
@@ -356,88 +1100,113 @@ def donate():
     """Donation page"""
     return render_template('donate.html')
 
-@app.route('/admin')
-def admin_dashboard():
-    """Admin dashboard with download statistics"""
+@app.route('/admin/metrics')
+def admin_metrics():
+    """Internal counters for caches and the job queue"""
     # This should have proper authentication in production
+    return jsonify({
+        'metadata_cache': cache_manager.stats(),
+        'output_cache': output_cache.stats() if output_cache else None,
+        'janitor': janitor.stats(),
+        'statistics_buffer': stats_counter.stats(),
+        'download_history': history_writer.stats(),
+        'jobs': scheduler.stats()
+    })
+
+def build_admin_snapshot():
+    """Compute the admin dashboard data with a fixed number of queries"""
+    # Write out the counts and history still buffered in this worker
+    stats_counter.flush()
+    history_writer.flush()
+    
+    # Overall totals are summed by the database
+    totals = Statistics.totals()
     
-    # Get overall statistics
+    # Chart data for the last 7 days, from a single range query
     current_date = datetime.datetime.utcnow().date()
-    last_week = current_date - datetime.timedelta(days=7)
-    
-    # Get all stats data
-    all_stats = Statistics.query.all()
-    
-    # Calculate total statistics
-    total_visits = sum(stat.visits for stat in all_stats)
-    total_downloads = sum(stat.downloads for stat in all_stats)
-    video_downloads = sum(stat.video_downloads for stat in all_stats)
-    audio_downloads = sum(stat.audio_downloads for stat in all_stats)
-    
-    # Prepare chart data for last 7 days
-    last_7_days = []
-    for i in range(6, -1, -1):
-        day = current_date - datetime.timedelta(days=i)
-        last_7_days.append(day)
-    
-    # Format dates and get data for chart
-    date_labels = [day.strftime('%b %d') for day in last_7_days]
-    visits_data = []
-    downloads_data = []
-    
-    for day in last_7_days:
-        stat = Statistics.query.filter_by(date=day).first()
-        visits_data.append(stat.visits if stat else 0)
-        downloads_data.append(stat.downloads if stat else 0)
-    
-    # Get popular downloads (using ORM instead of raw SQL)
+    last_7_days = [current_date - datetime.timedelta(days=i) for i in range(6, -1, -1)]
+    daily = Statistics.daily(last_7_days[0], current_date)
+    
+    # Get popular downloads from the rollup maintained as downloads complete
     popular_downloads = []
     try:
-        # Check if we have any completed downloads first
-        if db.session.query(Download.id).filter_by(status='completed').first() is not None:
-            # Use ORM to group and count downloads
-            from sqlalchemy import func
-            popular_downloads_query = (
-                db.session.query(
-                    Download.video_title,
-                    Download.format_type,
-                    Download.quality,
-                    func.count(Download.id).label('count')
-                )
-                .filter(Download.status == 'completed')
-                .group_by(Download.video_title, Download.format_type, Download.quality)
-                .order_by(func.count(Download.id).desc())
-                .limit(10)
-            )
-            popular_downloads = popular_downloads_query.all()
+        popular_downloads = [
+            {
+                'video_title': row.video_title,
+                'format_type': row.format_type,
+                'quality': row.quality,
+                'count': row.downloads
+            }
+            for row in DownloadPopularity.top(10)
+        ]
     except Exception as e:
         logger.error(f"Error getting popular downloads: {str(e)}")
-        popular_downloads = []
     
     # Get recent downloads
     recent_downloads = []
     try:
-        recent_downloads = Download.query.order_by(Download.created_at.desc()).limit(20).all()
+        recent_downloads = [
+            {
+                'video_title': download.video_title,
+                'format_type': download.format_type,
+                'status': download.status,
+                'file_size': download.file_size,
+                'download_time': download.download_time,
+                'created_at': download.created_at
+            }
+            for download in Download.query.order_by(Download.created_at.desc()).limit(20)
+        ]
     except Exception as e:
         logger.error(f"Error getting recent downloads: {str(e)}")
-        recent_downloads = []
-    
-    return render_template(
-        'admin.html',
-        stats={
-            'total_visits': total_visits,
-            'total_downloads': total_downloads,
-            'video_downloads': video_downloads,
-            'audio_downloads': audio_downloads
+    
+    return {
+        'stats': {
+            'total_visits': totals['visits'],
+            'total_downloads': totals['downloads'],
+            'video_downloads': totals['video_downloads'],
+            'audio_downloads': totals['audio_downloads']
         },
-        chart_data={
-            'labels': date_labels,
-            'visits': visits_data,
-            'downloads': downloads_data
+        'chart_data': {
+            'labels': [day.strftime('%b %d') for day in last_7_days],
+            'visits': [daily[day].visits if day in daily else 0 for day in last_7_days],
+            'downloads': [daily[day].downloads if day in daily else 0 for day in last_7_days]
         },
-        popular_downloads=popular_downloads,
-        recent_downloads=recent_downloads
-    )
+        'popular_downloads': popular_downloads,
+        'recent_downloads': recent_downloads
+    }
+
+@app.route('/admin')
+def admin_dashboard():
+    """Admin dashboard with download statistics"""
+    # This should have proper authentication in production
+    
+    # Rendered from a snapshot that is recomputed at most every ADMIN_SNAPSHOT_TTL
+    # seconds, by one request at a time
+    snapshot = admin_snapshot_cache.get_or_load('admin_dashboard', build_admin_snapshot)
+    return render_template('admin.html', **snapshot)
+
+@app.cli.command('rebuild-popularity')
+def rebuild_popularity_command():
+    """Fill in video_id on old download records and rebuild the popularity counters"""
+    updated = Download.backfill_video_ids(downloader.canonical_key)
+    rows = DownloadPopularity.rebuild()
+    click.echo(f"Set video_id on {updated} download records, rebuilt {rows} popularity counters")
+
+@app.cli.command('prune-downloads')
+@click.option('--days', type=int, default=DOWNLOAD_HISTORY_DAYS, show_default=True,
+              help='Compact records older than this many days')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help='Records per transaction')
+@click.option('--export-dir', default=DOWNLOAD_ARCHIVE_DIR, help='Archive the raw records here first')
+@click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS), default='jsonl', show_default=True)
+def prune_downloads_command(days, batch_size, export_dir, export_format):
+    """Compact old download records into daily aggregates and delete them"""
+    # Don't leave records of the period still queued behind
+    history_writer.flush()
+    summary = prune_downloads(days, batch_size=batch_size, export_dir=export_dir, export_format=export_format)
+    click.echo(f"Deleted {summary['deleted']} download records older than {summary['cutoff']:%Y-%m-%d}, "
+               f"{summary['aggregates']} daily aggregates updated")
+    if summary['archive']:
+        click.echo(f"Archived them to {summary['archive']}")
 
 # SEO-optimized metadata for page titles and descriptions
 @app.context_processor
@@ -460,3 +1229,7 @@ def cleanup_temp_files():
 
 import atexit
 atexit.register(cleanup_temp_files)
+atexit.register(stats_counter.close)
+atexit.register(history_writer.close)
+if process_executor:
+    atexit.register(process_executor.shutdown)
@@ -0,0 +1,145 @@
+"""Time the admin download-history queries with and without indexes and the rollup
+
+Fills a SQLite database with synthetic Download records (a long tail of
+videos with a few very popular ones, mixed formats and statuses, spread over
+a year) and times each query the admin pages run: first on the bare table
+the way the dashboard used to run them, then with the model's indexes and
+the DownloadPopularity rollup in place. Run from the repository root:
+
+    python benchmarks/bench_download_queries.py [rows]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, Download, DownloadPopularity
+
+VIDEOS = 200000       # Distinct videos in the synthetic history
+HOT_VIDEOS = 50       # Videos that get a large share of the downloads
+HOT_SHARE = 0.2
+QUALITIES = {
+    'video': ['best', 'bestvideo[height<=1080]+bestaudio/best[height<=1080]', 'bestvideo[height<=720]+bestaudio/best[height<=720]'],
+    'audio': ['bestaudio', 'bestaudio[ext=m4a]/bestaudio', 'bestaudio[ext=mp3]/bestaudio'],
+}
+STATUSES = ['completed'] * 8 + ['failed', 'cancelled']
+INSERT_BATCH = 50000
+REPEATS = 3
+
+def synthetic_rows(count, now):
+    """Yield Download rows as dicts"""
+    rng = random.Random(42)
+    for index in range(count):
+        if rng.random() < HOT_SHARE:
+            video = rng.randrange(HOT_VIDEOS)
+        else:
+            video = rng.randrange(VIDEOS)
+        format_type = 'audio' if rng.random() < 0.4 else 'video'
+        yield {
+            'url': f"https://www.youtube.com/watch?v=vid{video:08d}",
+            'video_id': f"video:vid{video:08d}",
+            'video_title': f"Synthetic video number {video} with a fairly long descriptive title",
+            'format_type': format_type,
+            'quality': rng.choice(QUALITIES[format_type]),
+            'file_size': rng.randrange(1, 500) * 1024 * 1024,
+            'download_time': rng.random() * 120,
+            'status': rng.choice(STATUSES),
+            'created_at': now - timedelta(seconds=rng.randrange(365 * 86400)),
+            'ip_address': f"10.{rng.randrange(256)}.{rng.randrange(256)}.0",
+            'job_id': f"job-{index}",
+        }
+
+def fill(count, now):
+    rows = synthetic_rows(count, now)
+    table = Download.__table__
+    while True:
+        batch = [row for _, row in zip(range(INSERT_BATCH), rows)]
+        if not batch:
+            break
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+
+def timed(run):
+    """Return the best of REPEATS wall times of run(), in milliseconds"""
+    best = None
+    for _ in range(REPEATS):
+        db.session.expire_all()
+        start = time.perf_counter()
+        run()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def popular_by_title():
+    # The query the admin dashboard used to run on the Download table
+    return db.session.query(
+        Download.video_title, Download.format_type, Download.quality,
+        db.func.count(Download.id).label('count')
+    ).filter(Download.status == 'completed').group_by(
+        Download.video_title, Download.format_type, Download.quality
+    ).order_by(db.func.count(Download.id).desc()).limit(10).all()
+
+def recent():
+    return Download.query.order_by(Download.created_at.desc()).limit(20).all()
+
+def completed_last_week(now):
+    def run():
+        return db.session.query(db.func.count(Download.id)).filter(
+            Download.status == 'completed', Download.created_at >= now - timedelta(days=7)
+        ).scalar()
+    return run
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    directory = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    db.init_app(app)
+    now = datetime.utcnow()
+    try:
+        with app.app_context():
+            db.create_all()
+            indexes = [index for index in Download.__table__.indexes if index.name != 'ix_download_job_id']
+            for index in indexes:
+                index.drop(db.engine)
+
+            start = time.perf_counter()
+            fill(rows, now)
+            print(f"{rows} synthetic download records written in {time.perf_counter() - start:.1f} s\n")
+
+            results = [
+                ('popular, GROUP BY title', timed(popular_by_title)),
+                ('recent 20', timed(recent)),
+                ('completed in last 7 days', timed(completed_last_week(now))),
+            ]
+
+            start = time.perf_counter()
+            for index in indexes:
+                index.create(db.engine)
+            index_time = time.perf_counter() - start
+            start = time.perf_counter()
+            counters = DownloadPopularity.rebuild()
+            rebuild_time = time.perf_counter() - start
+
+            after = [
+                ('popular, rollup top 10', timed(lambda: DownloadPopularity.top(10))),
+                ('recent 20', timed(recent)),
+                ('completed in last 7 days', timed(completed_last_week(now))),
+            ]
+
+            print(f"{'Query':28} {'Before ms':>10} {'Query':28} {'After ms':>10} {'Speedup':>8}")
+            for (name, before_ms), (new_name, after_ms) in zip(results, after):
+                print(f"{name:28} {before_ms:10.1f} {new_name:28} {after_ms:10.2f} {before_ms / max(after_ms, 0.001):7.0f}x")
+            print(f"\nBuilding the indexes took {index_time:.1f} s; rebuilding the rollup "
+                  f"({counters} counters) took {rebuild_time:.1f} s, a one-off cost")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
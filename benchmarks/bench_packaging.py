@@ -0,0 +1,86 @@
+"""Compare CPU time and output size of the playlist packaging modes
+
+Builds a directory of synthetic media files (random payload, which is as
+incompressible as real H.264/AAC streams, plus a little repetitive container
+metadata) and packages it with each mode: a deflated ZIP for reference, the
+stored ZIP written to disk, the streamed ZIP and tar archives, and 'links',
+which serves the files as they are. Run from the repository root:
+
+    python benchmarks/bench_packaging.py [files] [megabytes per file]
+"""
+import os
+import sys
+import time
+import shutil
+import zipfile
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packager import stream_archive, write_archive, directory_entries
+
+METADATA_FRACTION = 0.02  # Share of each file that is compressible metadata
+
+def make_media(directory, files, megabytes):
+    """Write synthetic media files and return their total size"""
+    size = megabytes * 1024 * 1024
+    metadata = (b'moov\x00\x00\x00\x6cmvhd' + b'\x00' * 100) * (int(size * METADATA_FRACTION) // 112 + 1)
+    for index in range(files):
+        with open(os.path.join(directory, f"video {index:03d}.mp4"), 'wb') as media:
+            media.write(metadata[:int(size * METADATA_FRACTION)])
+            media.write(os.urandom(size - int(size * METADATA_FRACTION)))
+    return files * size
+
+def zip_deflated(entries, output_dir):
+    path = os.path.join(output_dir, 'deflated.zip')
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for arcname, source in entries:
+            archive.write(source, arcname)
+    return os.path.getsize(path)
+
+def zip_stored(entries, output_dir):
+    path = os.path.join(output_dir, 'stored.zip')
+    write_archive(path, entries, 'zip')
+    return os.path.getsize(path)
+
+def streamed(packaging):
+    def run(entries, output_dir):
+        # Count the bytes a client would receive; nothing touches the disk
+        return sum(len(chunk) for chunk in stream_archive(packaging, entries))
+    return run
+
+def links(entries, output_dir):
+    # Items are served as they are; there is no archive to build
+    return sum(os.path.getsize(source) for _, source in entries)
+
+MODES = [
+    ('zip, deflated (reference)', zip_deflated),
+    ('zip, stored, on disk', zip_stored),
+    ('zip, stored, streamed', streamed('zip')),
+    ('tar, streamed', streamed('tar')),
+    ('links (no archive)', links),
+]
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    megabytes = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    media_dir = tempfile.mkdtemp()
+    output_dir = tempfile.mkdtemp()
+    try:
+        total = make_media(media_dir, files, megabytes)
+        entries = directory_entries(media_dir)
+        print(f"{files} synthetic media files, {total / 1024 / 1024:.0f} MiB in total\n")
+        print(f"{'Mode':28} {'CPU s':>8} {'Wall s':>8} {'Output MiB':>11} {'vs input':>9}")
+
+        for name, run in MODES:
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            size = run(entries, output_dir)
+            cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+            print(f"{name:28} {cpu:8.2f} {wall:8.2f} {size / 1024 / 1024:11.1f} {size / total:9.2%}")
+    finally:
+        shutil.rmtree(media_dir, ignore_errors=True)
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Compare metadata cache hit rates for raw-URL keys and canonical keys
+
+Replays a stream of requests built from the URL variants users actually paste
+(share links with tracking tokens, mobile links, timestamps, shorts, embeds,
+playlist context) through an LRU the size of the app's memory tier, and counts
+how often /video_info would be served from cache with each keying scheme.
+Run from the repository root:
+
+    python benchmarks/cache_key_hit_rate.py [requests]
+"""
+import os
+import sys
+import random
+import string
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import YoutubeDownloader
+
+VIDEO_IDS = ['dQw4w9WgXcQ', 'jNQXAC9IVRw', '9bZkp7q19f0', 'kJQP7kiw5Fk', 'OPf0YbXqDm0', 'fJ9rUzIMcZQ']
+CATALOG_SIZE = 300  # Distinct videos in the simulated traffic
+CACHE_SIZE = 50     # Matches the app's in-memory tier
+PLAYLIST_ID = 'PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI'
+
+# Link shapes seen in real traffic; {id} is the video ID
+VARIANTS = [
+    'https://www.youtube.com/watch?v={id}',
+    'https://youtube.com/watch?v={id}',
+    'https://m.youtube.com/watch?v={id}',
+    'https://youtu.be/{id}',
+    'https://youtu.be/{id}?si={si}',
+    'https://youtu.be/{id}?t={t}',
+    'https://www.youtube.com/watch?v={id}&t={t}s',
+    'https://www.youtube.com/watch?v={id}&pp={si}',
+    'https://www.youtube.com/watch?v={id}&feature=youtu.be',
+    'https://www.youtube.com/watch?feature=share&v={id}',
+    'https://www.youtube.com/shorts/{id}',
+    'https://www.youtube.com/embed/{id}?autoplay=1',
+    'https://music.youtube.com/watch?v={id}&feature=share',
+    'youtu.be/{id}',
+    'www.youtube.com/watch?v={id}',
+    'https://WWW.YouTube.com/watch?v={id}',
+]
+
+PLAYLIST_VARIANTS = [
+    'https://www.youtube.com/playlist?list={list}',
+    'https://m.youtube.com/playlist?list={list}',
+    'https://www.youtube.com/watch?v={id}&list={list}',
+    'https://www.youtube.com/watch?v={id}&list={list}&index=3',
+    'https://youtu.be/{id}?list={list}',
+]
+
+def random_token(rng, length):
+    return ''.join(rng.choices(string.ascii_letters + string.digits + '-_', k=length))
+
+def build_requests(count, seed=1):
+    """Build a request stream where popular videos are requested more often"""
+    rng = random.Random(seed)
+    catalog = VIDEO_IDS + [random_token(rng, 11) for _ in range(CATALOG_SIZE - len(VIDEO_IDS))]
+    weights = [1 / (rank + 1) for rank in range(len(catalog))]  # Zipf-like popularity
+    requests = []
+    for _ in range(count):
+        video_id = rng.choices(catalog, weights)[0]
+        if rng.random() < 0.1:
+            template = rng.choice(PLAYLIST_VARIANTS)
+        else:
+            template = rng.choice(VARIANTS)
+        requests.append(template.format(
+            id=video_id,
+            list=PLAYLIST_ID,
+            si=random_token(rng, 16),  # Share tokens differ per share
+            t=rng.randint(1, 600)
+        ))
+    return requests
+
+def hit_rate(requests, key_func):
+    """Return (hit rate, extractions) for an LRU cache keyed by key_func"""
+    cache = OrderedDict()
+    hits = 0
+    for url in requests:
+        key = key_func(url)
+        if key in cache:
+            hits += 1
+            cache.move_to_end(key)
+        else:
+            cache[key] = True
+            if len(cache) > CACHE_SIZE:
+                cache.popitem(last=False)
+    return hits / len(requests), len(requests) - hits
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    downloader = YoutubeDownloader()
+    requests = build_requests(count)
+
+    raw_rate, raw_misses = hit_rate(requests, lambda url: url)
+    canonical_rate, canonical_misses = hit_rate(requests, downloader.canonical_key)
+
+    print(f"Requests: {count} over {CATALOG_SIZE} videos, LRU size {CACHE_SIZE}")
+    print(f"Raw URL keys:   hit rate {raw_rate:6.2%}, {raw_misses} extractions")
+    print(f"Canonical keys: hit rate {canonical_rate:6.2%}, {canonical_misses} extractions")
+
+    print("\nSample canonicalizations:")
+    for template in VARIANTS[:5] + PLAYLIST_VARIANTS[:3]:
+        url = template.format(id=VIDEO_IDS[0], list=PLAYLIST_ID, si='AbCdEfGhIjKlMnOp', t=42)
+        print(f"  {url:70} -> {downloader.canonical_key(url)}")
+
+if __name__ == '__main__':
+    main()
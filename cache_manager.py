@@ -1,35 +1,238 @@
 import time
+import json
+import zlib
 import logging
 import threading
 from collections import OrderedDict
 
+from sqlite_local import LocalConnections
+
 logger = logging.getLogger(__name__)
 
+class DiskCache:
+    """Persistent, size-bounded cache in a SQLite database
+
+    Shared by every worker process on the host and kept across restarts.
+    Values are stored as zlib-compressed compact JSON with a per-entry expiry
+    time; when the total stored size goes over max_bytes, expired entries and
+    then the least recently used ones are evicted.
+    """
+    
+    ACCESS_RESOLUTION = 60  # Only record a new access time this often (seconds)
+    
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, default_ttl=3600):
+        """Open (or create) the cache database"""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.connections = LocalConnections(self.path)
+        self.stats_lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'expirations': 0, 'evictions': 0, 'writes': 0}
+        
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+            'expires_at REAL NOT NULL, last_access REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)')
+    
+    def _connect(self):
+        return self.connections.get()
+    
+    def _count(self, counter, amount=1):
+        with self.stats_lock:
+            self.counters[counter] += amount
+    
+    @staticmethod
+    def _serialize(value):
+        return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+    
+    @staticmethod
+    def _deserialize(blob):
+        return json.loads(zlib.decompress(blob))
+    
+    def get(self, key):
+        """Return (value, seconds left to live) or None if missing or expired"""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT value, expires_at, last_access FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        now = time.time()
+        
+        if row is None:
+            self._count('misses')
+            return None
+        
+        value, expires_at, last_access = row
+        if expires_at <= now:
+            conn.execute('DELETE FROM cache WHERE key = ? AND expires_at <= ?', (key, now))
+            self._count('expirations')
+            self._count('misses')
+            return None
+        
+        if now - last_access >= self.ACCESS_RESOLUTION:
+            conn.execute('UPDATE cache SET last_access = ? WHERE key = ?', (now, key))
+        
+        self._count('hits')
+        return self._deserialize(value), expires_at - now
+    
+    def set(self, key, value, ttl=None):
+        """Store a value for ttl seconds (default_ttl if not given)"""
+        blob = self._serialize(value)
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, size, expires_at, last_access) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, blob, len(blob), now + (ttl or self.default_ttl), now)
+        )
+        self._count('writes')
+        self._enforce_size(conn, now)
+    
+    def delete(self, key):
+        """Remove an entry; return True if it existed"""
+        return self._connect().execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount > 0
+    
+    def clear(self):
+        """Remove all entries"""
+        self._connect().execute('DELETE FROM cache')
+    
+    def _enforce_size(self, conn, now):
+        """Evict expired, then least recently used entries while over max_bytes"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        expired = conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,)).rowcount
+        if expired:
+            self._count('expirations', expired)
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        
+        # Evict down to 90% of the limit so we don't evict on every write
+        target = self.max_bytes * 0.9
+        if total > target:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                evicted = 0
+                for key, size in conn.execute(
+                        'SELECT key, size FROM cache ORDER BY last_access').fetchall():
+                    if total <= target:
+                        break
+                    conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                    total -= size
+                    evicted += 1
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self._count('evictions', evicted)
+            logger.debug(f"Disk cache evicted {evicted} entries")
+    
+    def stats(self):
+        """Return hit/miss/eviction counters and current size"""
+        with self.stats_lock:
+            stats = dict(self.counters)
+        entries, size = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+        stats.update({'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes})
+        return stats
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into a single execution
+
+    The first caller for a key runs the function; callers that arrive while it
+    is running wait for its result (or exception) instead of running it again.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> in-flight call state
+        self.counters = {'executions': 0, 'collapsed': 0, 'errors': 0, 'timeouts': 0}
+    
+    def do(self, key, func, timeout=None):
+        """Run func for key, or wait up to timeout seconds for the in-flight run"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self.calls[key] = call
+                self.counters['executions'] += 1
+            else:
+                self.counters['collapsed'] += 1
+        
+        if leader:
+            try:
+                call['result'] = func()
+            except Exception as e:
+                call['error'] = e
+                with self.lock:
+                    self.counters['errors'] += 1
+            finally:
+                with self.lock:
+                    self.calls.pop(key, None)
+                call['done'].set()
+        elif not call['done'].wait(timeout):
+            with self.lock:
+                self.counters['timeouts'] += 1
+            raise TimeoutError(f"Timed out waiting for in-flight request: {key}")
+        
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+    
+    def stats(self):
+        """Return execution counters, including how many calls were collapsed"""
+        with self.lock:
+            return dict(self.counters, in_flight=len(self.calls))
+
 class CacheManager:
-    """Cache manager for storing video information to reduce API calls"""
+    """Cache manager for storing video information to reduce API calls
+
+    An in-memory LRU, optionally backed by a persistent DiskCache as a second
+    tier: writes go to both, and memory misses fall back to disk.
+    """
     
-    def __init__(self, max_size=100, expiry_time=3600):  # Default 1 hour expiry
-        """Initialize the cache with maximum size and expiry time"""
+    def __init__(self, max_size=100, expiry_time=3600, persistent=None):  # Default 1 hour expiry
+        """Initialize the cache with maximum size, default expiry time and optional disk tier"""
         self.cache = OrderedDict()  # Use OrderedDict for LRU functionality
         self.max_size = max_size
         self.expiry_time = expiry_time
+        self.persistent = persistent
         self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.single_flight = SingleFlight()
         
         # Start a cleanup thread
         self.cleanup_thread = threading.Thread(target=self._cleanup_expired, daemon=True)
         self.cleanup_thread.start()
     
-    def add_to_cache(self, key, value):
-        """Add an item to the cache with the current timestamp"""
+    def add_to_cache(self, key, value, ttl=None):
+        """Add an item to the cache with the current timestamp and optional TTL"""
+        ttl = ttl or self.expiry_time
+        self._add_to_memory(key, value, ttl)
+        
+        if self.persistent:
+            try:
+                self.persistent.set(key, value, ttl)
+            except Exception as e:
+                logger.error(f"Error writing to disk cache: {str(e)}")
+    
+    def _add_to_memory(self, key, value, ttl):
         with self.lock:
-            # Remove oldest item if cache is full
-            if len(self.cache) >= self.max_size:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            elif len(self.cache) >= self.max_size:
+                # Remove oldest item if cache is full
                 self.cache.popitem(last=False)
+                self.counters['evictions'] += 1
             
             # Add new item with timestamp
             self.cache[key] = {
                 'value': value,
-                'timestamp': time.time()
+                'timestamp': time.time(),
+                'ttl': ttl
             }
             logger.debug(f"Added item to cache: {key}")
     
@@ -41,34 +244,85 @@ class CacheManager:
                 current_time = time.time()
                 
                 # Check if item is expired
-                if current_time - cache_item['timestamp'] > self.expiry_time:
+                if current_time - cache_item['timestamp'] > cache_item['ttl']:
                     # Remove expired item
                     self.cache.pop(key)
                     logger.debug(f"Cache item expired: {key}")
-                    return None
-                
-                # Move item to the end (most recently used)
-                self.cache.move_to_end(key)
-                logger.debug(f"Cache hit: {key}")
-                return cache_item['value']
+                else:
+                    # Move item to the end (most recently used)
+                    self.cache.move_to_end(key)
+                    self.counters['hits'] += 1
+                    logger.debug(f"Cache hit: {key}")
+                    return cache_item['value']
             
-            logger.debug(f"Cache miss: {key}")
-            return None
+            self.counters['misses'] += 1
+        
+        # Fall back to the persistent tier and promote hits into memory
+        if self.persistent:
+            try:
+                stored = self.persistent.get(key)
+            except Exception as e:
+                logger.error(f"Error reading from disk cache: {str(e)}")
+                stored = None
+            if stored is not None:
+                value, ttl_left = stored
+                self._add_to_memory(key, value, ttl_left)
+                logger.debug(f"Disk cache hit: {key}")
+                return value
+        
+        logger.debug(f"Cache miss: {key}")
+        return None
+    
+    def get_or_load(self, key, loader, ttl=None, timeout=None):
+        """Get an item from cache, or load and cache it exactly once
+
+        Concurrent misses for the same key share a single loader() call; the
+        others wait up to timeout seconds for its result or exception. ttl may
+        be a number or a function of the loaded value.
+        """
+        value = self.get_cache(key)
+        if value is not None:
+            return value
+        
+        def load():
+            # A previous leader may have filled the cache since our miss
+            value = self.get_cache(key)
+            if value is None:
+                value = loader()
+                self.add_to_cache(key, value, ttl=ttl(value) if callable(ttl) else ttl)
+            return value
+        
+        return self.single_flight.do(key, load, timeout=timeout)
     
     def clear_cache(self):
         """Clear all items from cache"""
         with self.lock:
             self.cache.clear()
-            logger.debug("Cache cleared")
+        if self.persistent:
+            self.persistent.clear()
+        logger.debug("Cache cleared")
     
     def remove_from_cache(self, key):
         """Remove a specific item from cache"""
         with self.lock:
-            if key in self.cache:
-                self.cache.pop(key)
-                logger.debug(f"Removed item from cache: {key}")
-                return True
-            return False
+            removed = self.cache.pop(key, None) is not None
+        if self.persistent:
+            removed = self.persistent.delete(key) or removed
+        if removed:
+            logger.debug(f"Removed item from cache: {key}")
+        return removed
+    
+    def stats(self):
+        """Return hit/miss/eviction counters for each tier"""
+        with self.lock:
+            stats = {'memory': dict(self.counters, entries=len(self.cache), max_size=self.max_size)}
+        stats['single_flight'] = self.single_flight.stats()
+        if self.persistent:
+            try:
+                stats['disk'] = self.persistent.stats()
+            except Exception as e:
+                logger.error(f"Error reading disk cache stats: {str(e)}")
+        return stats
     
     def _cleanup_expired(self):
         """Periodically clean up expired cache items"""
@@ -81,7 +335,7 @@ class CacheManager:
                 keys_to_remove = []
                 
                 for key, cache_item in self.cache.items():
-                    if current_time - cache_item['timestamp'] > self.expiry_time:
+                    if current_time - cache_item['timestamp'] > cache_item['ttl']:
                         keys_to_remove.append(key)
                 
                 # Remove expired items
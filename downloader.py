@@ -1,10 +1,17 @@
 import os
 import time
+import contextlib
+import hashlib
 import logging
-import random
 import re
 from urllib.parse import urlparse, parse_qs
 import yt_dlp
+from yt_dlp.utils import DownloadCancelled
+from yt_dlp.postprocessor.common import PostProcessor
+from rate_limiter import TokenBucket, RateLimited
+from playlist_executor import PlaylistExecutor
+from playlist_manifest import PlaylistManifest
+from packager import archive_name, write_archive, directory_entries
 import shutil
 import tempfile
 import pytube
@@ -13,15 +20,53 @@ import subprocess
 
 logger = logging.getLogger(__name__)
 
+class ItemFinishedPP(PostProcessor):
+    """Reports each playlist item to item_hook once it is in its final location"""
+    
+    def __init__(self, item_hook):
+        super().__init__()
+        self.item_hook = item_hook
+    
+    def run(self, info):
+        filepath = info.get('filepath')
+        if filepath and os.path.exists(filepath):
+            self.item_hook(filepath)
+        return [], info
+
 class YoutubeDownloader:
     """YouTube video downloader with anti-bot measures and fallback mechanisms"""
     
-    def __init__(self):
-        """Initialize with rate limiting and retry settings"""
+    def __init__(self, rate_limiter=None, playlist_concurrency=3, playlist_work_dir=None):
+        """Initialize with rate limiting and retry settings
+
+        rate_limiter is a TokenBucket (see rate_limiter.py), possibly shared
+        with other processes; by default this instance gets its own bucket
+        allowing one request every RATE_LIMIT_DELAY seconds.
+        playlist_concurrency is the number of items of one playlist that are
+        downloaded at the same time, and playlist_work_dir is where playlist
+        jobs keep their items and manifests so they can be resumed.
+        """
         self.RATE_LIMIT_DELAY = 2  # seconds between requests
         self.RETRY_COUNT = 3  # number of retries
         self.RETRY_DELAY = 5  # seconds between retries
-        self.last_request_time = 0
+        self.PLAYLIST_ITEM_RETRIES = 1  # extra attempts per playlist item
+        self.AUDIO_CODEC = 'mp3'  # audio downloads are converted to this codec
+        self.AUDIO_QUALITY = '192'  # and bitrate (kbps), unless the format asks otherwise
+        # Target (codec, bitrate) of each audio_formats choice. 'best' keeps
+        # the source codec, and a source already in the target codec is only
+        # remuxed (stream copy); anything else is transcoded
+        self.AUDIO_TARGETS = {
+            'bestaudio': ('best', None),
+            'bestaudio[ext=m4a]/bestaudio': ('m4a', '192'),
+            'bestaudio[ext=mp3]/bestaudio': ('mp3', '192'),
+            'bestaudio[abr>=128]/bestaudio': ('mp3', '128'),
+            'bestaudio[abr>=96]/bestaudio': ('mp3', '96'),
+        }
+        self.playlist_concurrency = playlist_concurrency
+        self.playlist_work_root = playlist_work_dir or os.path.join(
+            tempfile.gettempdir(), 'youtube_downloader_playlists'
+        )
+        self.rate_limiter = rate_limiter or TokenBucket(rate=1.0 / self.RATE_LIMIT_DELAY)
         
         # Check if ffmpeg is available
         self.ffmpeg_available = self._check_ffmpeg()
@@ -36,51 +81,126 @@ class YoutubeDownloader:
             logger.warning("ffmpeg is not available, some audio features may be limited")
             return False
     
-    def _rate_limit(self):
-        """Apply rate limiting to avoid detection as bot"""
-        current_time = time.time()
-        elapsed = current_time - self.last_request_time
-        
-        if elapsed < self.RATE_LIMIT_DELAY:
-            # Add a small random delay for further obfuscation
-            delay = self.RATE_LIMIT_DELAY - elapsed + random.uniform(0.1, 1.0)
-            logger.debug(f"Rate limiting applied, sleeping for {delay:.2f} seconds")
-            time.sleep(delay)
-        
-        self.last_request_time = time.time()
+    def _rate_limit(self, block=True):
+        """Apply rate limiting to avoid detection as bot
+
+        With block=False (request threads) nothing sleeps: RateLimited is
+        raised with the time until a token is available. Download jobs run on
+        background workers and wait for their turn instead.
+        """
+        if block:
+            self.rate_limiter.acquire()
+            return
+        
+        wait = self.rate_limiter.try_acquire()
+        if wait > 0:
+            logger.debug(f"Rate limited, next request possible in {wait:.2f} seconds")
+            raise RateLimited(wait)
+    
+    # Hosts that serve YouTube watch, shorts, embed and playlist pages
+    YOUTUBE_HOSTS = (
+        'youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com',
+        'youtube-nocookie.com', 'www.youtube-nocookie.com'
+    )
+    SHORT_HOSTS = ('youtu.be', 'www.youtu.be')
+    # Path prefixes that are followed by a video ID (youtube.com/shorts/<id> etc.)
+    VIDEO_PATH_PREFIXES = ('shorts', 'embed', 'live', 'v', 'e')
+    VIDEO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+    
+    def _parse_url(self, url):
+        """Parse a URL, accepting links pasted without a scheme (youtu.be/...)"""
+        url = url.strip()
+        if '://' not in url:
+            url = 'https://' + url
+        parsed_url = urlparse(url)
+        # Hostnames are case-insensitive and may carry a port
+        return parsed_url, parsed_url.netloc.lower().split(':')[0]
     
     def _extract_video_id(self, url):
         """Extract YouTube video ID from URL"""
-        parsed_url = urlparse(url)
+        parsed_url, netloc = self._parse_url(url)
+        video_id = None
         
         # Handle youtu.be URLs
-        if parsed_url.netloc == 'youtu.be':
-            return parsed_url.path.lstrip('/')
+        if netloc in self.SHORT_HOSTS:
+            video_id = parsed_url.path.strip('/').split('/')[0]
         
-        # Handle regular youtube.com URLs
-        if parsed_url.netloc in ('youtube.com', 'www.youtube.com', 'm.youtube.com'):
+        # Handle regular youtube.com URLs (watch, shorts, embed, live)
+        elif netloc in self.YOUTUBE_HOSTS:
             query = parse_qs(parsed_url.query)
-            return query.get('v', [None])[0]
+            video_id = query.get('v', [None])[0]
+            if not video_id:
+                parts = parsed_url.path.strip('/').split('/')
+                if len(parts) >= 2 and parts[0] in self.VIDEO_PATH_PREFIXES:
+                    video_id = parts[1]
         
+        if video_id and self.VIDEO_ID_PATTERN.match(video_id):
+            return video_id
+        return None
+    
+    def _extract_playlist_id(self, url):
+        """Extract the playlist ID (list parameter) from URL"""
+        parsed_url, netloc = self._parse_url(url)
+        if netloc in self.YOUTUBE_HOSTS or netloc in self.SHORT_HOSTS:
+            query = parse_qs(parsed_url.query)
+            return query.get('list', [None])[0] or None
         return None
     
     def _is_playlist(self, url):
         """Check if the URL is a playlist"""
-        parsed_url = urlparse(url)
-        if parsed_url.netloc in ('youtube.com', 'www.youtube.com'):
-            query = parse_qs(parsed_url.query)
-            return 'list' in query
-        return False
+        return self._extract_playlist_id(url) is not None
     
-    def get_video_info(self, url):
-        """Get information about the video"""
-        self._rate_limit()
+    def canonical_key(self, url, playlist=None):
+        """Return a stable key for the content a URL points to
+
+        URL variants of the same video (youtu.be, m.youtube.com, timestamps,
+        shorts, embeds) all map to 'video:<id>', and playlist URLs map to
+        'playlist:<id>'. playlist=False forces the video key for watch URLs
+        that carry a list parameter; None infers it from the URL the same way
+        get_video_info does. Unrecognized URLs fall back to 'url:<url>'.
+        """
+        if playlist is not False:
+            playlist_id = self._extract_playlist_id(url)
+            if playlist_id:
+                return f"playlist:{playlist_id}"
         
         video_id = self._extract_video_id(url)
-        if not video_id:
-            raise ValueError("Invalid YouTube URL")
+        if video_id:
+            return f"video:{video_id}"
+        return f"url:{url.strip()}"
+    
+    def output_key(self, url, download_type, format_id='best'):
+        """Return the output cache key for a single-video download, or None
+
+        The key covers everything that decides the output file: the video, the
+        download type, the requested format and the postprocessing that will
+        run on it (audio conversion and merging only happen with ffmpeg).
+        URLs that don't point to a known video ID aren't cached.
+        """
+        video_key = self.canonical_key(url, playlist=False)
+        if not video_key.startswith('video:'):
+            return None
+        if download_type == 'audio':
+            codec, quality = self._audio_target(format_id)
+            postprocessing = f"{codec}-{quality or 'copy'}" if self.ffmpeg_available else 'original'
+            return f"{video_key}|audio|{format_id}|{postprocessing}"
+        return f"{video_key}|video|{format_id}|{'ffmpeg' if self.ffmpeg_available else 'no-ffmpeg'}"
+    
+    def get_video_info(self, url, info_sink=None):
+        """Get information about the video
+
+        If info_sink is given, it is called with the sanitized raw yt-dlp info
+        of a single video, so the caller can keep it and pass it back to
+        download_video/download_audio instead of extracting again.
+        Raises RateLimited instead of waiting when requests are coming in
+        faster than the rate limiter allows.
+        """
+        self._rate_limit(block=False)
         
+        video_id = self._extract_video_id(url)
         is_playlist = self._is_playlist(url)
+        if not video_id and not is_playlist:
+            raise ValueError("Invalid YouTube URL")
         
         try:
             ydl_opts = {
@@ -135,6 +255,9 @@ class YoutubeDownloader:
                     return result
                 else:
                     # Handle single video
+                    if info_sink:
+                        info_sink(self._reusable_info(info))
+                    
                     # Process formats into quality groups
                     formats = info.get('formats', [])
                     
@@ -329,13 +452,287 @@ class YoutubeDownloader:
                 logger.error(f"Pytube fallback also failed: {str(fallback_error)}")
                 raise ValueError(f"Could not retrieve video information: {str(e)}")
     
-    def download_video(self, url, format_id='best', output_path=None, progress_hook=None, playlist=False):
-        """Download a YouTube video"""
+    @staticmethod
+    def _reusable_info(info):
+        """Return extracted info that can be processed again with another format
+
+        Extracting runs format selection, which leaves the chosen formats in
+        requested_formats and requested_downloads; process_ie_result() keeps
+        those when the new selection is a single format and would download the
+        old ones. They are dropped here, as yt-dlp does for --load-info-json.
+        """
+        return yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+    
+    def _downloaded_path(self, download_info):
+        """Return the path of the file yt-dlp produced for a single video
+
+        yt-dlp records the final path (after merging and postprocessing) in
+        the requested downloads; nothing is guessed from the title, which
+        could pick up the file of another job.
+        """
+        for download in reversed(download_info.get('requested_downloads') or []):
+            filepath = download.get('filepath')
+            if filepath and os.path.exists(filepath):
+                return filepath
+        filepath = download_info.get('filepath')
+        if filepath and os.path.exists(filepath):
+            return filepath
+        return None
+    
+    def _audio_target(self, format_id):
+        """Return the (codec, bitrate) an audio format choice is converted to"""
+        return self.AUDIO_TARGETS.get(format_id, (self.AUDIO_CODEC, self.AUDIO_QUALITY))
+    
+    def _audio_postprocessor(self, format_id):
+        """Return the FFmpegExtractAudio options for an audio format choice
+
+        yt-dlp copies the audio stream instead of re-encoding it when the
+        source codec already is the target (AAC for m4a, any codec for
+        'best'), and leaves the file alone if it is in the target container.
+        """
+        codec, quality = self._audio_target(format_id)
+        postprocessor = {'key': 'FFmpegExtractAudio', 'preferredcodec': codec}
+        if quality:
+            postprocessor['preferredquality'] = quality
+        return postprocessor
+    
+    def _pytube_audio_stream(self, streams, format_id):
+        """Pick the pytube audio stream that needs the least conversion"""
+        codec, _ = self._audio_target(format_id)
+        audio_streams = streams.filter(only_audio=True)
+        if codec == 'm4a' and len(audio_streams.filter(subtype='mp4')):
+            audio_streams = audio_streams.filter(subtype='mp4')  # AAC, remuxed rather than transcoded
+        return audio_streams.order_by('abr').desc().first()
+    
+    def _convert_pytube_audio(self, file_path, stream, format_id):
+        """Bring a pytube audio download into the requested format, returning its path
+
+        AAC downloads are already in an MP4 container, so when they fit the
+        target only the extension changes; ffmpeg runs only to transcode.
+        """
+        codec, quality = self._audio_target(format_id)
+        source_codec = stream.audio_codec or ''
+        if source_codec.startswith('mp4a'):
+            source_codec = 'aac'
+        base, _ = os.path.splitext(file_path)
+        
+        if codec in ('best', 'm4a') and source_codec == 'aac':
+            m4a_file = f"{base}.m4a"
+            os.replace(file_path, m4a_file)
+            return m4a_file
+        if codec in ('best', source_codec):
+            return file_path
+        if not self.ffmpeg_available:
+            logger.warning(f"ffmpeg not available, keeping {source_codec or 'unknown'} audio instead of {codec}")
+            return file_path
+        
+        extension, encoder = {'m4a': ('m4a', 'aac')}.get(codec, ('mp3', 'libmp3lame'))
+        converted_file = f"{base}.{extension}"
+        try:
+            subprocess.run([
+                'ffmpeg', '-y', '-i', file_path, '-vn',
+                '-ar', '44100', '-ac', '2', '-c:a', encoder, '-b:a', f"{quality or self.AUDIO_QUALITY}k",
+                converted_file
+            ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            os.remove(file_path)  # Remove original
+            return converted_file
+        except Exception as conv_error:
+            logger.warning(f"Error converting to {extension}: {str(conv_error)}")
+            return file_path
+    
+    def _package_playlist(self, playlist_temp_dir, output_path, playlist_title, item_hook, suffix=''):
+        """Finish a playlist download and return the path to hand back
+
+        Without item_hook the items are zipped into output_path and the
+        directory removed. With item_hook every item has already been reported
+        as it finished (for a streamed archive), so the directory is returned.
+        """
+        if item_hook:
+            return playlist_temp_dir
+        
+        playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_title or 'playlist')
+        
+        # Media is already compressed, so the items are stored, not deflated
+        zip_filename = os.path.join(output_path, archive_name(f"{playlist_title}{suffix}", 'zip'))
+        write_archive(zip_filename, directory_entries(playlist_temp_dir), 'zip')
+        
+        # Clean up temporary playlist directory
+        shutil.rmtree(playlist_temp_dir)
+        return zip_filename
+    
+    def _expand_playlist(self, url):
+        """Return (title, entries) for a playlist without resolving its items
+
+        Each entry is a dict with the item's url, id and title. Returns None if
+        the playlist can't be expanded, so callers can fall back to letting
+        yt-dlp walk it.
+        """
+        try:
+            ydl_opts = {
+                'extract_flat': 'in_playlist',
+                'quiet': True,
+                'no_warnings': True,
+                'geo_bypass': True,
+                'nocheckcertificate': True,
+            }
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+            
+            entries = []
+            for entry in info.get('entries') or []:
+                if not entry or not (entry.get('url') or entry.get('id')):
+                    continue
+                entries.append({
+                    'url': entry.get('url') or f"https://www.youtube.com/watch?v={entry['id']}",
+                    'id': entry.get('id'),
+                    'title': entry.get('title')
+                })
+            return info.get('title'), entries
+        
+        except Exception as e:
+            logger.warning(f"Could not expand playlist with yt-dlp: {str(e)}")
+        
+        try:
+            from pytube import Playlist
+            p = Playlist(url)
+            return p.title, [{'url': video_url, 'id': None, 'title': None} for video_url in p.video_urls]
+        except Exception as e:
+            logger.warning(f"Could not expand playlist with pytube: {str(e)}")
+            return None
+    
+    def _playlist_work_dir(self, url, variant):
+        """Return the stable work directory for a playlist downloaded as variant
+
+        The same playlist in the same format always maps to the same
+        directory, which is what lets an interrupted job be resumed.
+        """
+        key = hashlib.sha1(f"{self.canonical_key(url, playlist=True)}|{variant}".encode()).hexdigest()[:20]
+        return os.path.join(self.playlist_work_root, key)
+    
+    def _download_playlist(self, url, download_item, output_path, progress_hook, item_hook, variant, suffix=''):
+        """Download a playlist's items in parallel, resuming an interrupted run
+
+        download_item(item_url, item_dir, progress_hook) downloads a single
+        item with all the usual retries and fallbacks into item_dir, a
+        directory of its own, and returns its result dict. Returns the playlist result, with the items that failed listed in
+        'failed_items', or None if the playlist could not be expanded.
+        
+        Item states are kept in a PlaylistManifest in the playlist's work
+        directory; if a previous job for the same playlist and variant died
+        midway, only its missing items are downloaded and partial files are
+        continued.
+        """
+        manifest = PlaylistManifest.claim(self._playlist_work_dir(url, variant))
+        if manifest and manifest.entries:
+            manifest.resume()
+            playlist_title, entries = manifest.data.get('title'), manifest.entries
+        else:
+            expanded = self._expand_playlist(url)
+            if not expanded or not expanded[1]:
+                if manifest:
+                    manifest.release()
+                return None
+            playlist_title, entries = expanded
+            if manifest:
+                manifest.start(url, playlist_title, entries)
+        
+        if manifest:
+            playlist_dir = manifest.work_dir
+        else:
+            # Another job is using this playlist's work directory, or it holds
+            # finished output that may still be delivered
+            playlist_dir = tempfile.mkdtemp(dir=output_path)
+        logger.info(f"Downloading {len(entries)} playlist items, {self.playlist_concurrency} at a time")
+        
+        def download_entry(entry, hook):
+            # Each item downloads into a directory of its own, so items with the
+            # same title (or their partial files) can't overwrite each other, and
+            # is then moved next to the others under a name led by its position
+            item_dir = os.path.join(playlist_dir, f".item-{entry['position']:04d}")
+            os.makedirs(item_dir, exist_ok=True)
+            filepath = download_item(entry['url'], item_dir, hook)['filepath']
+            target = os.path.join(playlist_dir, f"{entry['position']:03d} - {os.path.basename(filepath)}")
+            os.replace(filepath, target)
+            shutil.rmtree(item_dir, ignore_errors=True)
+            return target
+        
+        executor = PlaylistExecutor(self.playlist_concurrency, self.PLAYLIST_ITEM_RETRIES)
+        try:
+            result = executor.run(
+                [dict(entry, position=index + 1) for index, entry in enumerate(entries)],
+                download_entry,
+                progress_hook=progress_hook,
+                item_hook=item_hook,
+                manifest=manifest
+            )
+        except DownloadCancelled:
+            # Cancelled on purpose, so there is nothing to resume
+            if manifest:
+                manifest.release()
+            shutil.rmtree(playlist_dir, ignore_errors=True)
+            raise
+        except Exception:
+            if manifest:
+                manifest.release()
+            raise
+        
+        if not result['completed']:
+            if manifest:
+                manifest.release()  # Kept, a later job can try the items again
+            else:
+                shutil.rmtree(playlist_dir, ignore_errors=True)
+            raise ValueError("None of the playlist items could be downloaded. They may be unavailable or restricted.")
+        
+        if result['failed']:
+            logger.warning(f"{len(result['failed'])} of {len(entries)} playlist items failed")
+        
+        if manifest:
+            manifest.finish()
+        
+        return {
+            'filepath': self._package_playlist(playlist_dir, output_path, playlist_title, item_hook, suffix),
+            'playlist_count': len(entries),
+            'failed_items': result['failed']
+        }
+    
+    def download_video(self, url, format_id='best', output_path=None, progress_hook=None, playlist=False, info=None, item_hook=None):
+        """Download a YouTube video
+
+        info may be raw info previously extracted for this video (see
+        get_video_info's info_sink); it is then used for format checks and the
+        download itself instead of extracting the metadata again.
+        
+        For playlists, item_hook(filepath) is called as each item finishes and
+        the items are left in a directory (returned as 'filepath') instead of
+        being zipped, so the caller can stream them out while the rest download.
+        """
         self._rate_limit()
         
         if not output_path:
             output_path = tempfile.mkdtemp()
         
+        if playlist:
+            # Expand the playlist once and download its items in parallel
+            result = self._download_playlist(
+                url,
+                lambda item_url, item_dir, hook: self.download_video(
+                    item_url, format_id=format_id, output_path=item_dir, progress_hook=hook
+                ),
+                output_path,
+                progress_hook,
+                item_hook,
+                f"video-{format_id}"
+            )
+            if result:
+                result.update({
+                    'quality_downgraded': False,
+                    'requested_quality': format_id,
+                    'actual_quality': format_id,
+                    'quality_message': None
+                })
+                return result
+            logger.info("Falling back to downloading the playlist sequentially")
+        
         # Generate a sanitized output filename template
         output_template = os.path.join(output_path, '%(title)s.%(ext)s')
         
@@ -350,6 +747,7 @@ class YoutubeDownloader:
             'format': format_id,
             'outtmpl': output_template,
             'noplaylist': not playlist,
+            'continuedl': True,  # Pick up .part files left by an interrupted job
             'quiet': True,
             'no_warnings': True,
             'geo_bypass': True,
@@ -428,17 +826,24 @@ class YoutubeDownloader:
         
         # For playlists, create a ZIP file
         if playlist:
-            # Create a separate temporary directory for playlist items
-            playlist_temp_dir = tempfile.mkdtemp()
-            ydl_opts['outtmpl'] = os.path.join(playlist_temp_dir, '%(title)s.%(ext)s')
+            # Create a separate temporary directory for playlist items, inside
+            # output_path so leftovers of failed jobs are swept with it
+            playlist_temp_dir = tempfile.mkdtemp(dir=output_path)
+            ydl_opts['outtmpl'] = os.path.join(playlist_temp_dir, '%(playlist_index)03d - %(title)s.%(ext)s')
         
         video_file = None
         for attempt in range(self.RETRY_COUNT):
             try:
                 with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    # First extract info without downloading to check available formats
+                    if playlist and item_hook:
+                        # Report each item once yt-dlp has moved it into place
+                        ydl.add_post_processor(ItemFinishedPP(item_hook), when='after_move')
+                    
+                    # Extract info without downloading (unless the caller already
+                    # did) to check available formats
                     if requested_quality in quality_map and not playlist:
-                        info = ydl.extract_info(url, download=False)
+                        if info is None:
+                            info = ydl.extract_info(url, download=False)
                         available_heights = []
                         
                         # Check which resolutions are actually available for this video
@@ -483,8 +888,12 @@ class YoutubeDownloader:
                                     quality_message = f"The requested quality ({requested_quality}) is not available. Using the highest available quality: {highest_available}p"
                                     logger.info(quality_message)
                     
-                    # Now download with potentially adjusted format
-                    download_info = ydl.extract_info(url, download=True)
+                    # Now download with potentially adjusted format, straight from
+                    # the extracted info when we have it (one extraction per job)
+                    if info is not None and not playlist:
+                        download_info = ydl.process_ie_result(self._reusable_info(info), download=True)
+                    else:
+                        download_info = ydl.extract_info(url, download=True)
                     
                     # Check if format was actually downgraded based on downloaded format
                     if not quality_downgraded and 'requested_downloads' in download_info:
@@ -510,45 +919,27 @@ class YoutubeDownloader:
                                     logger.info(quality_message)
                                 
                     if playlist:
-                        # Create a ZIP file for playlist
-                        import zipfile
-                        
-                        # Get playlist title or use 'playlist' as fallback
-                        playlist_title = download_info.get('title', 'playlist')
-                        playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_title)
-                        
-                        zip_filename = os.path.join(output_path, f"{playlist_title}.zip")
-                        with zipfile.ZipFile(zip_filename, 'w') as zipf:
-                            for root, _, files in os.walk(playlist_temp_dir):
-                                for file in files:
-                                    file_path = os.path.join(root, file)
-                                    # Add file to zip (with arcname to avoid folder structure in zip)
-                                    zipf.write(file_path, os.path.basename(file_path))
-                        
-                        # Clean up temporary playlist directory
-                        shutil.rmtree(playlist_temp_dir)
-                        video_file = zip_filename
+                        # Create a ZIP file for playlist, or hand back the items for streaming
+                        video_file = self._package_playlist(
+                            playlist_temp_dir, output_path, download_info.get('title'), item_hook, ''
+                        )
                     else:
-                        # Handle single video download
-                        if 'requested_downloads' in download_info:
-                            video_file = download_info['requested_downloads'][0]['filepath']
-                        else:
-                            # If direct filepath not available, try to find by expected filename
-                            title = download_info.get('title', 'video')
-                            ext = download_info.get('ext', 'mp4')
-                            sanitized_title = re.sub(r'[^\w\-_\. ]', '_', title)
-                            
-                            possible_file = os.path.join(output_path, f"{sanitized_title}.{ext}")
-                            if os.path.exists(possible_file):
-                                video_file = possible_file
+                        # Exact path of the finished file, as recorded by yt-dlp
+                        video_file = self._downloaded_path(download_info)
                 
                 # If we got here, download was successful
                 break
                 
+            except DownloadCancelled:
+                # Cancelled by the caller, don't retry or fall back
+                raise
             except Exception as e:
                 error_msg = str(e).lower()
                 logger.warning(f"Download attempt {attempt+1} failed: {error_msg}")
                 
+                # Stream URLs in reused info may have expired; extract fresh info next time
+                info = None
+                
                 # Check for bot detection or sign-in requirements
                 if "sign in" in error_msg or "not a bot" in error_msg:
                     logger.info("Bot detection triggered, trying alternative approach")
@@ -562,35 +953,20 @@ class YoutubeDownloader:
                         }
                         
                         with yt_dlp.YoutubeDL(fallback_opts) as ydl:
+                            if playlist and item_hook:
+                                # Report each item once yt-dlp has moved it into place
+                                ydl.add_post_processor(ItemFinishedPP(item_hook), when='after_move')
+                            
                             download_info = ydl.extract_info(url, download=True)
                             
                             if playlist:
                                 # Same ZIP handling as above
-                                import zipfile
-                                playlist_title = download_info.get('title', 'playlist')
-                                playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_title)
-                                
-                                zip_filename = os.path.join(output_path, f"{playlist_title}.zip")
-                                with zipfile.ZipFile(zip_filename, 'w') as zipf:
-                                    for root, _, files in os.walk(playlist_temp_dir):
-                                        for file in files:
-                                            file_path = os.path.join(root, file)
-                                            zipf.write(file_path, os.path.basename(file_path))
-                                
-                                shutil.rmtree(playlist_temp_dir)
-                                video_file = zip_filename
+                                video_file = self._package_playlist(
+                                    playlist_temp_dir, output_path, download_info.get('title'), item_hook, ''
+                                )
                             else:
-                                # Handle single video
-                                if 'requested_downloads' in download_info:
-                                    video_file = download_info['requested_downloads'][0]['filepath']
-                                else:
-                                    title = download_info.get('title', 'video')
-                                    ext = download_info.get('ext', 'mp4')
-                                    sanitized_title = re.sub(r'[^\w\-_\. ]', '_', title)
-                                    
-                                    possible_file = os.path.join(output_path, f"{sanitized_title}.{ext}")
-                                    if os.path.exists(possible_file):
-                                        video_file = possible_file
+                                # Exact path of the finished file, as recorded by yt-dlp
+                                video_file = self._downloaded_path(download_info)
                         
                         # If we got here, alternative approach worked
                         break
@@ -614,11 +990,12 @@ class YoutubeDownloader:
                             playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_title)
                             
                             zip_filename = os.path.join(output_path, f"{playlist_title}.zip")
-                            with zipfile.ZipFile(zip_filename, 'w') as zipf:
+                            # Streamed archives get each item as it finishes, nothing to zip here
+                            with (contextlib.nullcontext() if item_hook else zipfile.ZipFile(zip_filename, 'w', compression=zipfile.ZIP_STORED)) as zipf:
                                 # Download each video in playlist
                                 for video_url in p.video_urls:
                                     try:
-                                        v = pytube.YouTube(video_url)
+                                        v = pytube.YouTube(video_url, on_progress_callback=self._pytube_progress_callback(progress_hook))
                                         
                                         # Select stream based on format_id
                                         if '4320p' in format_id or '8K' in format_id:
@@ -642,15 +1019,21 @@ class YoutubeDownloader:
                                         
                                         if stream:
                                             file_path = stream.download(output_path=playlist_temp_dir)
-                                            zipf.write(file_path, os.path.basename(file_path))
-                                            os.remove(file_path)  # Clean up after adding to zip
+                                            if item_hook:
+                                                item_hook(file_path)
+                                            else:
+                                                zipf.write(file_path, os.path.basename(file_path))
+                                                os.remove(file_path)  # Clean up after adding to zip
                                     except Exception as video_error:
                                         logger.warning(f"Error downloading playlist video: {str(video_error)}")
                                         continue
                             
-                            # Clean up temporary playlist directory
-                            shutil.rmtree(playlist_temp_dir)
-                            video_file = zip_filename
+                            if item_hook:
+                                video_file = playlist_temp_dir
+                            else:
+                                # Clean up temporary playlist directory
+                                shutil.rmtree(playlist_temp_dir)
+                                video_file = zip_filename
                         else:
                             # Single video download with pytube
                             v = pytube.YouTube(url, on_progress_callback=self._pytube_progress_callback(progress_hook))
@@ -704,26 +1087,55 @@ class YoutubeDownloader:
             'quality_message': quality_message
         }
     
-    def download_audio(self, url, output_path=None, progress_hook=None, playlist=False):
-        """Download audio from a YouTube video"""
+    def download_audio(self, url, format_id=None, output_path=None, progress_hook=None, playlist=False, info=None, item_hook=None):
+        """Download audio from a YouTube video
+
+        format_id is one of the audio_formats choices returned by
+        get_video_info; it selects the source stream and whether the audio
+        is kept as is, remuxed or transcoded (see AUDIO_TARGETS). Other values
+        get the default MP3 conversion.
+        info may be raw info previously extracted for this video, which is
+        downloaded from directly instead of extracting the metadata again.
+        item_hook works as in download_video.
+        """
         self._rate_limit()
         
         if not output_path:
             output_path = tempfile.mkdtemp()
         
+        if playlist:
+            # Expand the playlist once and download its items in parallel
+            result = self._download_playlist(
+                url,
+                lambda item_url, item_dir, hook: self.download_audio(
+                    item_url, format_id=format_id, output_path=item_dir, progress_hook=hook
+                ),
+                output_path,
+                progress_hook,
+                item_hook,
+                f"audio-{format_id}",
+                '_audio'
+            )
+            if result:
+                result.update({
+                    'quality_downgraded': False,
+                    'requested_quality': 'best',
+                    'actual_quality': 'best',
+                    'quality_message': None
+                })
+                return result
+            logger.info("Falling back to downloading the playlist sequentially")
+        
         # Generate a sanitized output filename template
         output_template = os.path.join(output_path, '%(title)s.%(ext)s')
         
         # Configure options for yt-dlp
         ydl_opts = {
-            'format': 'bestaudio/best',
+            'format': f"{format_id}/best" if format_id in self.AUDIO_TARGETS else 'bestaudio/best',
             'outtmpl': output_template,
             'noplaylist': not playlist,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
+            'continuedl': True,  # Pick up .part files left by an interrupted job
+            'postprocessors': [self._audio_postprocessor(format_id)],
             'quiet': True,
             'no_warnings': True,
             'geo_bypass': True,
@@ -736,9 +1148,10 @@ class YoutubeDownloader:
         
         # For playlists, create a ZIP file
         if playlist:
-            # Create a separate temporary directory for playlist items
-            playlist_temp_dir = tempfile.mkdtemp()
-            ydl_opts['outtmpl'] = os.path.join(playlist_temp_dir, '%(title)s.%(ext)s')
+            # Create a separate temporary directory for playlist items, inside
+            # output_path so leftovers of failed jobs are swept with it
+            playlist_temp_dir = tempfile.mkdtemp(dir=output_path)
+            ydl_opts['outtmpl'] = os.path.join(playlist_temp_dir, '%(playlist_index)03d - %(title)s.%(ext)s')
         
         audio_file = None
         for attempt in range(self.RETRY_COUNT):
@@ -747,52 +1160,41 @@ class YoutubeDownloader:
                 if not self.ffmpeg_available:
                     # If ffmpeg is not available, modify options to skip audio extraction
                     ydl_opts.pop('postprocessors', None)
-                    ydl_opts['format'] = 'bestaudio'
+                    ydl_opts['format'] = format_id if format_id in self.AUDIO_TARGETS else 'bestaudio'
                     logger.warning("ffmpeg not available, downloading audio without conversion")
                 
                 with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    download_info = ydl.extract_info(url, download=True)
+                    if playlist and item_hook:
+                        # Report each item once yt-dlp has moved it into place
+                        ydl.add_post_processor(ItemFinishedPP(item_hook), when='after_move')
+                    
+                    if info is not None and not playlist:
+                        download_info = ydl.process_ie_result(self._reusable_info(info), download=True)
+                    else:
+                        download_info = ydl.extract_info(url, download=True)
                     
                     if playlist:
-                        # Create a ZIP file for playlist
-                        import zipfile
-                        
-                        # Get playlist title or use 'playlist' as fallback
-                        playlist_title = download_info.get('title', 'playlist')
-                        playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_title)
-                        
-                        zip_filename = os.path.join(output_path, f"{playlist_title}_audio.zip")
-                        with zipfile.ZipFile(zip_filename, 'w') as zipf:
-                            for root, _, files in os.walk(playlist_temp_dir):
-                                for file in files:
-                                    file_path = os.path.join(root, file)
-                                    # Add file to zip (with arcname to avoid folder structure in zip)
-                                    zipf.write(file_path, os.path.basename(file_path))
-                        
-                        # Clean up temporary playlist directory
-                        shutil.rmtree(playlist_temp_dir)
-                        audio_file = zip_filename
+                        # Create a ZIP file for playlist, or hand back the items for streaming
+                        audio_file = self._package_playlist(
+                            playlist_temp_dir, output_path, download_info.get('title'), item_hook, '_audio'
+                        )
                     else:
-                        # Handle single audio download
-                        if 'requested_downloads' in download_info:
-                            audio_file = download_info['requested_downloads'][0]['filepath']
-                        else:
-                            # If direct filepath not available, try to find by expected filename
-                            title = download_info.get('title', 'audio')
-                            ext = 'mp3' if self.ffmpeg_available else download_info.get('ext', 'mp3')
-                            sanitized_title = re.sub(r'[^\w\-_\. ]', '_', title)
-                            
-                            possible_file = os.path.join(output_path, f"{sanitized_title}.{ext}")
-                            if os.path.exists(possible_file):
-                                audio_file = possible_file
+                        # Exact path of the finished file, as recorded by yt-dlp
+                        audio_file = self._downloaded_path(download_info)
                 
                 # If we got here, download was successful
                 break
                 
+            except DownloadCancelled:
+                # Cancelled by the caller, don't retry or fall back
+                raise
             except Exception as e:
                 error_msg = str(e).lower()
                 logger.warning(f"Audio download attempt {attempt+1} failed: {error_msg}")
                 
+                # Stream URLs in reused info may have expired; extract fresh info next time
+                info = None
+                
                 # Check for bot detection or sign-in requirements
                 if "sign in" in error_msg or "not a bot" in error_msg:
                     logger.info("Bot detection triggered, trying alternative approach")
@@ -806,35 +1208,20 @@ class YoutubeDownloader:
                         }
                         
                         with yt_dlp.YoutubeDL(fallback_opts) as ydl:
+                            if playlist and item_hook:
+                                # Report each item once yt-dlp has moved it into place
+                                ydl.add_post_processor(ItemFinishedPP(item_hook), when='after_move')
+                            
                             download_info = ydl.extract_info(url, download=True)
                             
                             if playlist:
                                 # Same ZIP handling as above
-                                import zipfile
-                                playlist_title = download_info.get('title', 'playlist')
-                                playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_title)
-                                
-                                zip_filename = os.path.join(output_path, f"{playlist_title}_audio.zip")
-                                with zipfile.ZipFile(zip_filename, 'w') as zipf:
-                                    for root, _, files in os.walk(playlist_temp_dir):
-                                        for file in files:
-                                            file_path = os.path.join(root, file)
-                                            zipf.write(file_path, os.path.basename(file_path))
-                                
-                                shutil.rmtree(playlist_temp_dir)
-                                audio_file = zip_filename
+                                audio_file = self._package_playlist(
+                                    playlist_temp_dir, output_path, download_info.get('title'), item_hook, '_audio'
+                                )
                             else:
-                                # Handle single audio
-                                if 'requested_downloads' in download_info:
-                                    audio_file = download_info['requested_downloads'][0]['filepath']
-                                else:
-                                    title = download_info.get('title', 'audio')
-                                    ext = 'mp3' if self.ffmpeg_available else download_info.get('ext', 'mp3')
-                                    sanitized_title = re.sub(r'[^\w\-_\. ]', '_', title)
-                                    
-                                    possible_file = os.path.join(output_path, f"{sanitized_title}.{ext}")
-                                    if os.path.exists(possible_file):
-                                        audio_file = possible_file
+                                # Exact path of the finished file, as recorded by yt-dlp
+                                audio_file = self._downloaded_path(download_info)
                         
                         # If we got here, alternative approach worked
                         break
@@ -858,66 +1245,49 @@ class YoutubeDownloader:
                             playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_title)
                             
                             zip_filename = os.path.join(output_path, f"{playlist_title}_audio.zip")
-                            with zipfile.ZipFile(zip_filename, 'w') as zipf:
+                            # Streamed archives get each item as it finishes, nothing to zip here
+                            with (contextlib.nullcontext() if item_hook else zipfile.ZipFile(zip_filename, 'w', compression=zipfile.ZIP_STORED)) as zipf:
                                 # Download each video in playlist
                                 for video_url in p.video_urls:
                                     try:
                                         v = pytube.YouTube(video_url, on_progress_callback=self._pytube_progress_callback(progress_hook))
                                         
                                         # Get audio stream
-                                        stream = v.streams.filter(only_audio=True).first()
+                                        stream = self._pytube_audio_stream(v.streams, format_id)
                                         
                                         if stream:
                                             file_path = stream.download(output_path=playlist_temp_dir)
                                             
-                                            # Convert to mp3 if ffmpeg is available
-                                            if self.ffmpeg_available:
-                                                base, _ = os.path.splitext(file_path)
-                                                mp3_file = f"{base}.mp3"
-                                                try:
-                                                    subprocess.run([
-                                                        'ffmpeg', '-i', file_path, '-vn', 
-                                                        '-ar', '44100', '-ac', '2', '-b:a', '192k', 
-                                                        mp3_file
-                                                    ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                                                    os.remove(file_path)  # Remove original
-                                                    file_path = mp3_file
-                                                except Exception as conv_error:
-                                                    logger.warning(f"Error converting to mp3: {str(conv_error)}")
+                                            # Remux or convert to the requested format
+                                            file_path = self._convert_pytube_audio(file_path, stream, format_id)
                                             
-                                            zipf.write(file_path, os.path.basename(file_path))
-                                            os.remove(file_path)  # Clean up after adding to zip
+                                            if item_hook:
+                                                item_hook(file_path)
+                                            else:
+                                                zipf.write(file_path, os.path.basename(file_path))
+                                                os.remove(file_path)  # Clean up after adding to zip
                                     except Exception as video_error:
                                         logger.warning(f"Error downloading playlist audio: {str(video_error)}")
                                         continue
                             
-                            # Clean up temporary playlist directory
-                            shutil.rmtree(playlist_temp_dir)
-                            audio_file = zip_filename
+                            if item_hook:
+                                audio_file = playlist_temp_dir
+                            else:
+                                # Clean up temporary playlist directory
+                                shutil.rmtree(playlist_temp_dir)
+                                audio_file = zip_filename
                         else:
                             # Single video audio download with pytube
                             v = pytube.YouTube(url, on_progress_callback=self._pytube_progress_callback(progress_hook))
                             
                             # Get audio stream
-                            stream = v.streams.filter(only_audio=True).first()
+                            stream = self._pytube_audio_stream(v.streams, format_id)
                             
                             if stream:
                                 audio_file = stream.download(output_path=output_path)
                                 
-                                # Convert to mp3 if ffmpeg is available
-                                if self.ffmpeg_available:
-                                    base, _ = os.path.splitext(audio_file)
-                                    mp3_file = f"{base}.mp3"
-                                    try:
-                                        subprocess.run([
-                                            'ffmpeg', '-i', audio_file, '-vn', 
-                                            '-ar', '44100', '-ac', '2', '-b:a', '192k', 
-                                            mp3_file
-                                        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                                        os.remove(audio_file)  # Remove original
-                                        audio_file = mp3_file
-                                    except Exception as conv_error:
-                                        logger.warning(f"Error converting to mp3: {str(conv_error)}")
+                                # Remux or convert to the requested format
+                                audio_file = self._convert_pytube_audio(audio_file, stream, format_id)
                                 
                         # If we got here, pytube fallback worked
                         if audio_file:
@@ -946,7 +1316,11 @@ class YoutubeDownloader:
         }
     
     def _pytube_progress_callback(self, progress_hook):
-        """Create a progress callback for pytube that mimics yt-dlp's progress hook format"""
+        """Create a progress callback for pytube that mimics yt-dlp's progress hook format
+
+        The events go to the same progress hook (normally a ProgressReporter) as
+        yt-dlp's, so throttling, speed and ETA work the same for both paths.
+        """
         if not progress_hook:
             return None
         
@@ -964,5 +1338,14 @@ class YoutubeDownloader:
                 'total_bytes': total_size[0],
                 'filename': stream.default_filename
             })
+            
+            # pytube has no completion callback of its own
+            if bytes_remaining <= 0:
+                progress_hook({
+                    'status': 'finished',
+                    'downloaded_bytes': total_size[0],
+                    'total_bytes': total_size[0],
+                    'filename': stream.default_filename
+                })
         
         return callback
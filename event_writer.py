@@ -0,0 +1,141 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class DownloadEventWriter:
+    """Queues download history inserts and updates and writes them in batches
+
+    Request handlers and jobs only record an event in memory; a background
+    thread hands everything queued to write(inserts, updates) every interval
+    seconds, or as soon as batch_size jobs have pending events. Events are
+    keyed by job ID and merged while they wait, so a job started and finished
+    between two flushes costs a single INSERT, and updates never need a
+    database ID to be known first.
+
+    write gets a list of rows to insert (each with its 'job_id') and a dict of
+    {job_id: fields} to update, must apply them in one transaction and returns
+    the job IDs whose update found no row. Those are retried update_retries
+    times, since the insert may still be queued in another worker process.
+    When a flush fails, its events are queued again.
+
+    At most max_pending jobs are queued; beyond that, recording an event waits
+    up to put_timeout seconds for the writer to catch up and is then dropped.
+    close() stops the thread and flushes what is left.
+    """
+
+    def __init__(self, write, interval=1.0, batch_size=500, max_pending=10000, update_retries=3, put_timeout=0.1):
+        self._write = write
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.update_retries = update_retries
+        self.put_timeout = put_timeout
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)  # Signals the writer thread
+        self.space = threading.Condition(self.lock)   # Signals producers waiting for room
+        self.flush_lock = threading.Lock()  # One flush at a time
+        self.pending = {}  # job_id -> {'insert': bool, 'fields': dict, 'attempts': int}
+        self.closed = False
+        self.counters = {'events': 0, 'flushes': 0, 'inserted': 0, 'updated': 0, 'dropped': 0, 'errors': 0}
+        self.thread = threading.Thread(target=self._run, name='download-events', daemon=True)
+        self.thread.start()
+
+    def insert(self, job_id, **fields):
+        """Queue the creation of the record for job_id; return False if dropped"""
+        return self._record(job_id, fields, insert=True)
+
+    def update(self, job_id, **fields):
+        """Queue changes to the record for job_id; return False if dropped"""
+        return self._record(job_id, fields, insert=False)
+
+    def _record(self, job_id, fields, insert):
+        with self.lock:
+            if job_id not in self.pending and len(self.pending) >= self.max_pending:
+                self.wakeup.notify()
+                if not self.space.wait_for(lambda: len(self.pending) < self.max_pending, self.put_timeout):
+                    self.counters['dropped'] += 1
+                    logger.error(f"Download event queue is full, dropping event for {job_id}")
+                    return False
+            self._merge(job_id, insert, fields)
+            self.counters['events'] += 1
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.notify()
+        return True
+
+    def _merge(self, job_id, insert, fields, attempts=0):
+        """Merge fields into job_id's queued event (caller holds the lock)"""
+        event = self.pending.setdefault(job_id, {'insert': False, 'fields': {}, 'attempts': attempts})
+        event['insert'] = event['insert'] or insert
+        event['fields'].update(fields)
+
+    def _requeue(self, batch):
+        """Put a batch back in front of anything queued since (caller holds the lock)"""
+        newer = self.pending
+        self.pending = {}
+        for job_id, event in batch.items():
+            self._merge(job_id, event['insert'], event['fields'], event['attempts'])
+        for job_id, event in newer.items():
+            self._merge(job_id, event['insert'], event['fields'])
+
+    def flush(self):
+        """Write out the queued events now; return False if that failed"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                self.space.notify_all()
+            if not batch:
+                return True
+
+            inserts = [dict(event['fields'], job_id=job_id) for job_id, event in batch.items() if event['insert']]
+            updates = {job_id: event['fields'] for job_id, event in batch.items() if not event['insert']}
+            try:
+                unmatched = set(self._write(inserts, updates) or ())
+            except Exception as e:
+                logger.error(f"Error writing download events, will retry: {str(e)}")
+                with self.lock:
+                    self._requeue(batch)
+                    self.counters['errors'] += 1
+                return False
+
+            retry = {}
+            for job_id in unmatched:
+                event = batch[job_id]
+                event['attempts'] += 1
+                if event['attempts'] < self.update_retries:
+                    retry[job_id] = event
+                else:
+                    logger.warning(f"Dropping update for download {job_id}, it has no record")
+            with self.lock:
+                if retry:
+                    self._requeue(retry)
+                self.counters['flushes'] += 1
+                self.counters['inserted'] += len(inserts)
+                self.counters['updated'] += len(updates) - len(unmatched)
+                self.counters['dropped'] += len(unmatched) - len(retry)
+            logger.debug(f"Wrote {len(inserts)} download inserts and {len(updates) - len(unmatched)} updates")
+            return True
+
+    def _run(self):
+        failed = False
+        while True:
+            with self.lock:
+                # After a failed flush, wait out the interval even if the batch is full
+                if not self.closed and (failed or len(self.pending) < self.batch_size):
+                    self.wakeup.wait(self.interval)
+                if self.closed:
+                    return
+            failed = not self.flush()
+
+    def close(self):
+        """Stop the background thread and flush what is left"""
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        self.thread.join(timeout=self.interval)
+        self.flush()
+
+    def stats(self):
+        """Return event/flush counters and the number of queued jobs"""
+        with self.lock:
+            return dict(self.counters, pending=len(self.pending))
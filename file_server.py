@@ -0,0 +1,157 @@
+import os
+import logging
+import mimetypes
+import urllib.parse
+
+from flask import Response
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1024 * 1024  # Read size when the server can't use sendfile
+
+def content_disposition(filename):
+    """Build an attachment Content-Disposition header for any file name"""
+    ascii_name = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'download'
+    quoted_name = urllib.parse.quote(filename)
+    if ascii_name == filename and quoted_name == filename:
+        return f'attachment; filename="{filename}"'
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quoted_name}"
+
+class _RangeFile:
+    """Read-only view of bytes [start, start + length) of an open file
+
+    The underlying file is positioned at start, so a WSGI server that serves
+    wsgi.file_wrapper objects with sendfile (gunicorn uses the current offset
+    and the Content-Length) sends the range straight from the page cache;
+    servers that iterate the wrapper instead get reads bounded to the range.
+    Without a file wrapper, the view itself is the response body.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def __iter__(self):
+        while True:
+            data = self.read(BLOCK_SIZE)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.file.close()
+
+class FileServer:
+    """Serves finished downloads with ETag, Range and If-Range support
+
+    Large files never pass through Python buffers: responses either hand the
+    open file to the WSGI server's file wrapper (zero-copy sendfile under
+    gunicorn) or, with offload set to 'x-accel-redirect' or 'x-sendfile', let
+    the front-end web server send the file itself. X-Accel-Redirect needs an
+    internal nginx location at offload_prefix that maps to offload_root.
+    """
+
+    def __init__(self, offload=None, offload_root=None, offload_prefix='/protected-downloads/'):
+        self.offload = offload or None
+        self.offload_root = os.path.abspath(offload_root) if offload_root else None
+        self.offload_prefix = offload_prefix.rstrip('/') + '/'
+
+    @staticmethod
+    def _etag(stat):
+        """Strong validator built from inode, size and modification time"""
+        return f"{stat.st_ino:x}-{stat.st_size:x}-{int(stat.st_mtime * 1000000):x}"
+
+    def _offload_headers(self, path):
+        """Return the headers that hand the file to the front-end server, if configured"""
+        if self.offload == 'x-sendfile':
+            return {'X-Sendfile': path}
+        if self.offload == 'x-accel-redirect' and self.offload_root:
+            relative = os.path.relpath(os.path.abspath(path), self.offload_root)
+            if not relative.startswith('..'):
+                return {'X-Accel-Redirect': self.offload_prefix + urllib.parse.quote(relative)}
+        return None
+
+    def send(self, request, path, download_name, mimetype=None):
+        """Build the response for a GET/HEAD of path as an attachment named download_name"""
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = self._etag(stat)
+        mimetype = mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+        headers = {
+            'Content-Disposition': content_disposition(download_name),
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': 'private, no-transform',
+        }
+
+        # The front-end server handles Range and conditional requests itself
+        offload_headers = self._offload_headers(path)
+        if offload_headers:
+            headers.update(offload_headers)
+            response = Response(status=200, headers=headers, mimetype=mimetype)
+            response.set_etag(etag)
+            response.last_modified = stat.st_mtime
+            return response
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304, headers={'Accept-Ranges': 'bytes'})
+            response.set_etag(etag)
+            return response
+
+        start, length, status = 0, size, 200
+        byte_range = request.range
+        # Multipart responses aren't supported, so a multi-range request gets the whole file
+        if byte_range is not None and len(byte_range.ranges) == 1 and self._if_range_matches(request, etag, stat):
+            start, stop = byte_range.ranges[0]
+            if start < 0:
+                # A suffix longer than the file asks for all of it
+                start, stop = max(size + start, 0), size
+            else:
+                stop = size if stop is None else min(stop, size)
+            if start >= size:
+                # The range starts past the end of the file
+                response = Response(status=416, headers={'Content-Range': f"bytes */{size}"})
+                response.set_etag(etag)
+                return response
+            length, status = stop - start, 206
+            headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+
+        headers['Content-Length'] = str(length)
+        if request.method == 'HEAD':
+            body = []
+        else:
+            # The WSGI server calls the body's close(), which closes the file,
+            # even if the client goes away before the body is iterated
+            body = _RangeFile(open(path, 'rb'), start, length)
+            file_wrapper = request.environ.get('wsgi.file_wrapper')
+            if file_wrapper:
+                body = file_wrapper(body, BLOCK_SIZE)
+
+        response = Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        logger.debug(f"Serving {path} ({status}, bytes {start}-{start + length - 1} of {size})")
+        return response
+
+    @staticmethod
+    def _if_range_matches(request, etag, stat):
+        """Check If-Range; a stale validator means the whole file is sent"""
+        if_range = request.if_range
+        if if_range.etag is not None:
+            return if_range.etag == etag
+        if if_range.date is not None:
+            return int(stat.st_mtime) <= if_range.date.timestamp()
+        return True
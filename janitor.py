@@ -0,0 +1,272 @@
+import os
+import time
+import heapq
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+def _disk_usage(path):
+    """Return the bytes used by a file or directory tree"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while we were looking
+    return total
+
+def _changed_at(path):
+    """Return when a path was last written or created
+
+    yt-dlp sets a downloaded file's mtime to the video's upload date, so the
+    inode change time (set when the file is created, renamed or touched)
+    counts as well.
+    """
+    stat = os.lstat(path)
+    return max(stat.st_mtime, stat.st_ctime)
+
+def _last_modified(path):
+    """Return the newest change time within a file or directory tree
+
+    A directory's own times don't change while a file inside it grows, so a
+    directory with a download still being written to is never considered old.
+    """
+    newest = _changed_at(path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                try:
+                    newest = max(newest, _changed_at(os.path.join(root, name)))
+                except OSError:
+                    pass
+    return newest
+
+class Janitor:
+    """Removes expired downloads, stale work directories and old progress entries
+
+    One background thread replaces the per-file cleanup threads:
+
+    - expire() schedules a key's paths for removal at a deadline (plus an
+      optional callback, e.g. to drop the progress entry); the deadlines are
+      kept in a heap, and scheduling a key again moves its deadline.
+    - Directories added with watch_directory() are swept every interval for
+      entries that haven't been modified for max_age seconds, which catches
+      the output of jobs that failed or were never fetched.
+    - When free space on the watched filesystem drops below low_free_bytes,
+      scheduled removals are run early, earliest deadline first, until it is
+      back above high_free_bytes.
+    - Progress store entries not updated for progress_ttl seconds are removed.
+    """
+
+    def __init__(self, path, low_free_bytes=1024 * 1024 * 1024, high_free_bytes=2 * 1024 * 1024 * 1024, interval=60):
+        self.path = path  # Free space is measured on the filesystem holding this path
+        self.low_free_bytes = low_free_bytes
+        self.high_free_bytes = max(high_free_bytes, low_free_bytes)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.heap = []  # (deadline, sequence, key)
+        self.tasks = {}  # key -> (sequence, paths, callback, guard)
+        self.sequence = 0
+        self.directories = []  # (directory, max_age, skip)
+        self.progress_store = None
+        self.progress_ttl = None
+        self.counters = {
+            'bytes_reclaimed': 0, 'paths_removed': 0, 'expirations': 0,
+            'early_expirations': 0, 'swept_paths': 0, 'progress_entries_expired': 0, 'errors': 0
+        }
+        self.thread = threading.Thread(target=self._run, name='janitor', daemon=True)
+        self.thread.start()
+
+    def expire(self, key, delay, paths=(), callback=None, guard=None):
+        """Remove paths (files or directories) and call callback() in delay seconds
+
+        Scheduling an already scheduled key replaces its paths, callback and
+        deadline. If guard() returns False when the deadline comes, nothing
+        is done (e.g. because another process has moved the deadline); guards
+        are ignored when space is short.
+        """
+        with self.lock:
+            self.sequence += 1
+            self.tasks[key] = (self.sequence, list(paths), callback, guard)
+            heapq.heappush(self.heap, (time.time() + delay, self.sequence, key))
+            self.wakeup.notify()
+
+    def cancel(self, key):
+        """Forget a scheduled removal; return True if there was one"""
+        with self.lock:
+            return self.tasks.pop(key, None) is not None
+
+    def watch_directory(self, directory, max_age, skip=None):
+        """Sweep directory for entries older than max_age seconds
+
+        skip(path) may return True for entries that must be kept regardless
+        of their age (e.g. work directories a running job has locked).
+        """
+        with self.lock:
+            self.directories.append((directory, max_age, skip))
+
+    def expire_progress(self, progress_store, ttl):
+        """Remove progress store entries that haven't been updated for ttl seconds"""
+        with self.lock:
+            self.progress_store = progress_store
+            self.progress_ttl = ttl
+
+    def _count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def _pop_task(self, due_before=None):
+        """Pop the next live task, if it is due (caller holds the lock)"""
+        while self.heap:
+            deadline, sequence, key = self.heap[0]
+            task = self.tasks.get(key)
+            if task is None or task[0] != sequence:
+                heapq.heappop(self.heap)  # Cancelled or rescheduled
+                continue
+            if due_before is not None and deadline > due_before:
+                return None
+            heapq.heappop(self.heap)
+            del self.tasks[key]
+            return (key,) + task[1:]
+        return None
+
+    def _run_task(self, key, paths, callback, guard, force=False):
+        if guard and not force:
+            try:
+                if not guard():
+                    return
+            except Exception as e:
+                self._count('errors')
+                logger.error(f"Error in cleanup guard for {key}: {str(e)}")
+                return
+        for path in paths:
+            self._remove(path)
+        if callback:
+            try:
+                callback()
+            except Exception as e:
+                self._count('errors')
+                logger.error(f"Error in cleanup callback for {key}: {str(e)}")
+        self._count('expirations')
+
+    def _remove(self, path):
+        """Remove a file or directory tree, counting the bytes reclaimed; return True if removed"""
+        try:
+            if not os.path.lexists(path):
+                return False
+            size = _disk_usage(path)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            self._count('errors')
+            logger.error(f"Error removing {path}: {str(e)}")
+            return False
+        self._count('bytes_reclaimed', size)
+        self._count('paths_removed')
+        logger.debug(f"Removed {path} ({size} bytes)")
+        return True
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.path).free
+
+    def _relieve_pressure(self):
+        """Run scheduled removals early while free space is below the low watermark"""
+        if self.free_bytes() >= self.low_free_bytes:
+            return
+        logger.warning(f"Free space in {self.path} is below {self.low_free_bytes} bytes, expiring downloads early")
+        while self.free_bytes() < self.high_free_bytes:
+            with self.lock:
+                task = self._pop_task()
+            if task is None:
+                logger.warning("Nothing left to expire, free space is still low")
+                return
+            self._run_task(*task, force=True)
+            self._count('early_expirations')
+
+    def _sweep_directories(self):
+        now = time.time()
+        with self.lock:
+            directories = list(self.directories)
+        for directory, max_age, skip in directories:
+            try:
+                names = os.listdir(directory)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if now - _last_modified(path) < max_age or (skip and skip(path)):
+                        continue
+                except OSError:
+                    continue  # Removed while we were looking
+                if self._remove(path):
+                    self._count('swept_paths')
+
+    def _expire_progress_entries(self):
+        with self.lock:
+            store, ttl = self.progress_store, self.progress_ttl
+        if store is None:
+            return
+        cutoff = time.time() - ttl
+        for key in store.keys():
+            entry = store.get(key)
+            if entry and entry.get('updated_at', 0) < cutoff:
+                store.delete(key)
+                self._count('progress_entries_expired')
+
+    def run_once(self):
+        """Run due removals and one round of sweeps"""
+        while True:
+            with self.lock:
+                task = self._pop_task(due_before=time.time())
+            if task is None:
+                break
+            self._run_task(*task)
+        for step in (self._relieve_pressure, self._sweep_directories, self._expire_progress_entries):
+            try:
+                step()
+            except Exception as e:
+                self._count('errors')
+                logger.error(f"Janitor {step.__name__} failed: {str(e)}")
+
+    def _run(self):
+        next_sweep = 0
+        while True:
+            now = time.time()
+            if now >= next_sweep:
+                self.run_once()
+                next_sweep = time.time() + self.interval
+            else:
+                # Only deadlines that are due; sweeps wait for the interval
+                while True:
+                    with self.lock:
+                        task = self._pop_task(due_before=now)
+                    if task is None:
+                        break
+                    self._run_task(*task)
+
+            with self.lock:
+                timeout = next_sweep - time.time()
+                if self.heap:
+                    timeout = min(timeout, self.heap[0][0] - time.time())
+                if timeout > 0:
+                    self.wakeup.wait(timeout)
+
+    def stats(self):
+        """Return reclaim counters, pending removals and free space"""
+        with self.lock:
+            stats = dict(self.counters, pending=len(self.tasks))
+        try:
+            stats['free_bytes'] = self.free_bytes()
+        except OSError:
+            stats['free_bytes'] = None
+        stats.update({'low_free_bytes': self.low_free_bytes, 'high_free_bytes': self.high_free_bytes})
+        return stats
@@ -0,0 +1,191 @@
+import time
+import math
+import heapq
+import logging
+import itertools
+import threading
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be queued because the queue is at its maximum depth"""
+
+    def __init__(self, job_type, position, eta):
+        self.job_type = job_type
+        self.position = position  # Position the job would have had in the queue
+        self.eta = eta            # Estimated seconds until a slot frees up
+        super().__init__(f"The {job_type} queue is full (position {position}, retry in ~{eta}s)")
+
+class JobScheduler:
+    """Bounded worker pool that runs download jobs from per-type priority queues
+
+    Each job type (video, audio, playlist) gets its own fixed number of worker
+    threads, so a burst of requests is queued instead of starting one yt-dlp
+    process per request. Jobs are ordered by priority (lower runs first) and
+    then by submission order.
+    """
+
+    def __init__(self, concurrency=None, max_queue_size=100, default_duration=60):
+        """Initialize the scheduler and start the worker threads
+
+        concurrency maps a job type to the number of jobs of that type that may
+        run at the same time; max_queue_size bounds the total number of waiting
+        jobs across all types.
+        """
+        self.concurrency = concurrency or {'video': 2, 'audio': 2, 'playlist': 1}
+        self.max_queue_size = max_queue_size
+        self.queues = {job_type: [] for job_type in self.concurrency}
+        self.jobs = {}  # job_id -> job record (queued or running)
+        self.avg_duration = {job_type: float(default_duration) for job_type in self.concurrency}
+        self.queued_count = 0
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+        self.workers = []
+        for job_type, count in self.concurrency.items():
+            for index in range(count):
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    args=(job_type,),
+                    name=f"{job_type}-worker-{index}",
+                    daemon=True
+                )
+                worker.start()
+                self.workers.append(worker)
+
+    def _estimate_wait(self, job_type, position):
+        """Estimate the seconds until a job at the given queue position starts"""
+        slots = max(self.concurrency[job_type], 1)
+        return int(math.ceil(position / slots) * self.avg_duration[job_type])
+
+    def check_capacity(self, job_type):
+        """Raise QueueFullError if a job of this type could not be queued right now"""
+        with self.condition:
+            if job_type not in self.queues:
+                raise ValueError(f"Unknown job type: {job_type}")
+            if self.queued_count >= self.max_queue_size:
+                position = len(self.queues[job_type]) + 1
+                raise QueueFullError(job_type, position, self._estimate_wait(job_type, position))
+
+    def submit(self, job_id, job_type, func, args=(), priority=0):
+        """Queue a job and return its 1-based position in its type's queue"""
+        with self.condition:
+            if job_type not in self.queues:
+                raise ValueError(f"Unknown job type: {job_type}")
+
+            queue = self.queues[job_type]
+            if self.queued_count >= self.max_queue_size:
+                position = len(queue) + 1
+                raise QueueFullError(job_type, position, self._estimate_wait(job_type, position))
+
+            job = {
+                'id': job_id,
+                'type': job_type,
+                'func': func,
+                'args': args,
+                'state': 'queued',
+                'cancelled': False,
+                'submitted': time.time()
+            }
+            self.jobs[job_id] = job
+            heapq.heappush(queue, (priority, next(self.counter), job))
+            self.queued_count += 1
+            self.condition.notify_all()
+
+            logger.debug(f"Queued {job_type} job {job_id} (queued jobs: {self.queued_count})")
+            return self._position(job)
+
+    def _position(self, job):
+        """Return the 1-based queue position of a queued job (caller holds the lock)"""
+        entries = sorted(entry for entry in self.queues[job['type']] if not entry[2]['cancelled'])
+        for index, entry in enumerate(entries):
+            if entry[2] is job:
+                return index + 1
+        return 0
+
+    def position(self, job_id):
+        """Return the queue position of a job, or 0 if it is not waiting"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if not job or job['state'] != 'queued':
+                return 0
+            return self._position(job)
+
+    def eta(self, job_id):
+        """Return the estimated seconds until a queued job starts, or 0"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if not job or job['state'] != 'queued':
+                return 0
+            return self._estimate_wait(job['type'], self._position(job))
+
+    def cancel(self, job_id):
+        """Cancel a job
+
+        Returns 'cancelled' if the job was removed from the queue, 'cancelling'
+        if it is running and has been asked to stop, or None if it is unknown.
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if not job:
+                return None
+
+            job['cancelled'] = True
+            if job['state'] == 'queued':
+                # Lazily removed from the heap by the worker loop
+                job['state'] = 'cancelled'
+                self.queued_count -= 1
+                del self.jobs[job_id]
+                logger.debug(f"Cancelled queued job {job_id}")
+                return 'cancelled'
+
+            logger.debug(f"Requested cancellation of running job {job_id}")
+            return 'cancelling'
+
+    def is_cancelled(self, job_id):
+        """Check whether a running job has been asked to stop"""
+        job = self.jobs.get(job_id)
+        return bool(job and job['cancelled'])
+
+    def stats(self):
+        """Return queue depth and running job counts per type"""
+        with self.condition:
+            stats = {}
+            for job_type in self.concurrency:
+                stats[job_type] = {
+                    'queued': sum(1 for entry in self.queues[job_type] if not entry[2]['cancelled']),
+                    'running': sum(1 for job in self.jobs.values()
+                                   if job['type'] == job_type and job['state'] == 'running'),
+                    'concurrency': self.concurrency[job_type],
+                    'avg_duration': round(self.avg_duration[job_type], 1)
+                }
+            return stats
+
+    def _worker_loop(self, job_type):
+        """Run jobs of one type until the process exits"""
+        queue = self.queues[job_type]
+        while True:
+            with self.condition:
+                while True:
+                    # Drop cancelled entries left behind in the heap
+                    while queue and queue[0][2]['cancelled']:
+                        heapq.heappop(queue)
+                    if queue:
+                        break
+                    self.condition.wait()
+
+                _, _, job = heapq.heappop(queue)
+                job['state'] = 'running'
+                self.queued_count -= 1
+
+            start_time = time.time()
+            try:
+                job['func'](*job['args'])
+            except Exception as e:
+                logger.error(f"Unhandled error in {job_type} job {job['id']}: {str(e)}")
+            finally:
+                duration = time.time() - start_time
+                with self.condition:
+                    # Exponential moving average of job duration for ETA estimates
+                    self.avg_duration[job_type] = 0.8 * self.avg_duration[job_type] + 0.2 * duration
+                    self.jobs.pop(job['id'], None)
@@ -1,8 +1,25 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
 
 db = SQLAlchemy()
 
+def upsert(model, key, values, row):
+    """Update model's row matching key with values, or insert key and row if there is none
+
+    values maps columns to SQL expressions (e.g. downloads = downloads + n),
+    so concurrent writers in other processes never overwrite each other's
+    increments. The caller commits.
+    """
+    if model.query.filter_by(**key).update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**key, **row))
+    except IntegrityError:
+        # Another process created the row first
+        model.query.filter_by(**key).update(values, synchronize_session=False)
+
 class Download(db.Model):
     """Model to track download history"""
     id = db.Column(db.Integer, primary_key=True)
@@ -15,48 +32,258 @@ class Download(db.Model):
     status = db.Column(db.String(50))       # completed, failed, etc.
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     ip_address = db.Column(db.String(50))   # To track unique users (anonymized)
+    job_id = db.Column(db.String(64), unique=True, index=True)  # The app's download ID
+    video_id = db.Column(db.String(64))     # canonical_key() of the URL, e.g. 'video:<id>'
+    
+    __table_args__ = (
+        db.Index('ix_download_status_created_at', 'status', 'created_at'),
+        db.Index('ix_download_created_at', 'created_at'),
+    )
     
     def __repr__(self):
         return f'<Download {self.id}: {self.video_title}>'
     
     @staticmethod
-    def add_download(url, video_title, format_type, quality, file_size=None, 
-                    download_time=None, status="started", ip_address=None):
-        """Create a new download record"""
-        download = Download(
-            url=url,
-            video_title=video_title,
-            format_type=format_type,
-            quality=quality,
-            file_size=file_size,
-            download_time=download_time,
-            status=status,
-            ip_address=ip_address
-        )
-        db.session.add(download)
-        db.session.commit()
-        return download
+    def write_events(inserts, updates):
+        """Write queued history events (see DownloadEventWriter) in one transaction
+        
+        inserts is a list of rows, written with multi-row INSERTs; updates maps
+        job IDs to the fields to change. Downloads that become completed are
+        counted in DownloadPopularity in the same transaction. Returns the job
+        IDs of updates that found no record.
+        """
+        table = Download.__table__
+        completed = {}  # (video_id, format_type, quality) -> [count, video_title]
+        
+        def count_completed(row):
+            if row.get('video_id'):
+                key = (row['video_id'], row.get('format_type') or '', row.get('quality') or '')
+                completed.setdefault(key, [0, None])[0] += 1
+                completed[key][1] = row.get('video_title') or completed[key][1]
+        
+        try:
+            if inserts:
+                # executemany needs the same keys in every row
+                columns = set().union(*inserts)
+                db.session.execute(table.insert(), [{c: row.get(c) for c in columns} for row in inserts])
+                for row in inserts:
+                    if row.get('status') == 'completed':
+                        count_completed(row)
+            
+            unmatched = set()
+            if updates:
+                job_ids = list(updates)
+                existing = {}
+                for start in range(0, len(job_ids), 500):
+                    chunk = job_ids[start:start + 500]
+                    for row in db.session.execute(
+                        db.select(
+                            table.c.job_id, table.c.status, table.c.video_id,
+                            table.c.video_title, table.c.format_type, table.c.quality
+                        ).where(table.c.job_id.in_(chunk))
+                    ):
+                        existing[row.job_id] = row._mapping
+                unmatched = set(job_ids) - set(existing)
+                for job_id, row in existing.items():
+                    if updates[job_id].get('status') == 'completed' and row['status'] != 'completed':
+                        count_completed(dict(row, **updates[job_id]))
+                
+                # One executemany per distinct set of changed columns
+                groups = {}
+                for job_id in existing:
+                    fields = updates[job_id]
+                    groups.setdefault(tuple(sorted(fields)), []).append(dict(fields, _job_id=job_id))
+                statement = table.update().where(table.c.job_id == db.bindparam('_job_id'))
+                for rows in groups.values():
+                    db.session.execute(statement, rows)
+            
+            DownloadPopularity.add(completed)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return unmatched
     
     @staticmethod
-    def update_status(download_id, status, file_size=None, download_time=None):
-        """Update an existing download record with completion info"""
-        download = Download.query.get(download_id)
-        if download:
-            download.status = status
-            if file_size:
-                download.file_size = file_size
-            if download_time:
-                download.download_time = download_time
+    def get_popular_downloads(limit=10):
+        """Get most popular downloaded videos, over all formats"""
+        return db.session.query(
+            DownloadPopularity.video_id,
+            db.func.max(DownloadPopularity.video_title).label('video_title'),
+            db.func.sum(DownloadPopularity.downloads).label('count')
+        ).group_by(DownloadPopularity.video_id).order_by(db.desc('count')).limit(limit).all()
+    
+    @staticmethod
+    def backfill_video_ids(canonical_key, batch_size=1000):
+        """Set video_id on records created before it existed; return how many were set
+        
+        canonical_key(url) is YoutubeDownloader.canonical_key. Records are
+        updated in batches of batch_size, each in its own transaction.
+        """
+        table = Download.__table__
+        statement = table.update().where(table.c.id == db.bindparam('_id'))
+        last_id, updated = 0, 0
+        while True:
+            rows = db.session.execute(
+                db.select(table.c.id, table.c.url)
+                .where(table.c.video_id.is_(None), table.c.id > last_id)
+                .order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                return updated
+            last_id = rows[-1].id
+            values = []
+            for row in rows:
+                key = canonical_key(row.url)
+                if not key.startswith('url:'):
+                    values.append({'_id': row.id, 'video_id': key[:64]})
+            if values:
+                db.session.execute(statement, values)
+                updated += len(values)
             db.session.commit()
-            return download
-        return None
+
+class DownloadPopularity(db.Model):
+    """Completed downloads per video, format type and quality
+    
+    Maintained incrementally as downloads complete (see
+    Download.write_events), so the popular downloads lists never scan the
+    Download table. rebuild() recomputes it from scratch, including the
+    downloads compacted into DownloadDailyAggregate.
+    """
+    __tablename__ = 'download_popularity'
+    video_id = db.Column(db.String(64), primary_key=True)
+    format_type = db.Column(db.String(50), primary_key=True)  # '' when unknown
+    quality = db.Column(db.String(50), primary_key=True)      # '' when unknown
+    video_title = db.Column(db.String(255))                   # Latest title seen
+    downloads = db.Column(db.Integer, nullable=False, default=0)
+    last_download_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_download_popularity_downloads', 'downloads'),
+    )
     
     @staticmethod
-    def get_popular_downloads(limit=10):
-        """Get most popular downloaded videos"""
-        return Download.query.filter_by(status="completed").group_by(
-            Download.video_title).order_by(
-            db.func.count(Download.video_title).desc()).limit(limit).all()
+    def add(counts):
+        """Add {(video_id, format_type, quality): (n, video_title)} to the counters
+        
+        Rows are updated or created with upsert(); the caller commits.
+        """
+        now = datetime.utcnow()
+        for (video_id, format_type, quality), (amount, video_title) in counts.items():
+            key = {'video_id': video_id, 'format_type': format_type, 'quality': quality}
+            values = {
+                DownloadPopularity.downloads: DownloadPopularity.downloads + amount,
+                DownloadPopularity.last_download_at: now
+            }
+            if video_title:
+                values[DownloadPopularity.video_title] = video_title
+            upsert(DownloadPopularity, key, values, {
+                'downloads': amount, 'video_title': video_title, 'last_download_at': now
+            })
+    
+    @staticmethod
+    def top(limit=10):
+        """Return the most downloaded video, format type and quality combinations"""
+        return DownloadPopularity.query.order_by(DownloadPopularity.downloads.desc()).limit(limit).all()
+    
+    @staticmethod
+    def rebuild():
+        """Recompute every counter in the database from the completed downloads
+        
+        Counts the Download records and the completed downloads that
+        retention.prune_downloads has compacted into DownloadDailyAggregate.
+        """
+        format_type = db.func.coalesce(Download.format_type, '')
+        quality = db.func.coalesce(Download.quality, '')
+        recent = db.select(
+            Download.video_id.label('video_id'), format_type.label('format_type'), quality.label('quality'),
+            db.func.max(Download.video_title).label('video_title'),
+            db.func.count(Download.id).label('downloads'),
+            db.func.max(Download.created_at).label('last_download_at')
+        ).where(
+            Download.status == 'completed', Download.video_id.isnot(None)
+        ).group_by(Download.video_id, format_type, quality)
+        # Aggregates keep no title, and only the day of the last download
+        compacted = db.select(
+            DownloadDailyAggregate.video_id, DownloadDailyAggregate.format_type, DownloadDailyAggregate.quality,
+            db.null().label('video_title'),
+            db.func.sum(DownloadDailyAggregate.downloads).label('downloads'),
+            db.type_coerce(db.func.max(DownloadDailyAggregate.day), db.DateTime).label('last_download_at')
+        ).where(
+            DownloadDailyAggregate.status == 'completed', DownloadDailyAggregate.video_id != ''
+        ).group_by(DownloadDailyAggregate.video_id, DownloadDailyAggregate.format_type, DownloadDailyAggregate.quality)
+        combined = db.union_all(recent, compacted).subquery()
+        totals = db.select(
+            combined.c.video_id, combined.c.format_type, combined.c.quality, db.func.max(combined.c.video_title),
+            db.func.sum(combined.c.downloads), db.func.max(combined.c.last_download_at)
+        ).group_by(combined.c.video_id, combined.c.format_type, combined.c.quality)
+        table = DownloadPopularity.__table__
+        try:
+            db.session.execute(table.delete())
+            db.session.execute(table.insert().from_select(
+                ['video_id', 'format_type', 'quality', 'video_title', 'downloads', 'last_download_at'], totals
+            ))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return db.session.query(db.func.count()).select_from(table).scalar()
+
+class DownloadDailyAggregate(db.Model):
+    """Download records compacted per day, video, format type, quality and status
+    
+    Filled by retention.prune_downloads from records older than the retention
+    period, which are then deleted; these rows keep the history's totals.
+    """
+    __tablename__ = 'download_daily_aggregate'
+    day = db.Column(db.Date, primary_key=True)
+    video_id = db.Column(db.String(64), primary_key=True)     # '' when unknown
+    format_type = db.Column(db.String(50), primary_key=True)  # '' when unknown
+    quality = db.Column(db.String(50), primary_key=True)      # '' when unknown
+    status = db.Column(db.String(50), primary_key=True)       # '' when unknown
+    downloads = db.Column(db.Integer, nullable=False, default=0)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    total_download_time = db.Column(db.Float, nullable=False, default=0)
+    
+    @staticmethod
+    def add(counts):
+        """Add {(day, video_id, format_type, quality, status): (n, bytes, seconds)} to the aggregates
+        
+        Rows are updated or created with upsert(); the caller commits.
+        """
+        for (day, video_id, format_type, quality, status), (amount, size, seconds) in counts.items():
+            key = {'day': day, 'video_id': video_id, 'format_type': format_type, 'quality': quality, 'status': status}
+            values = {
+                DownloadDailyAggregate.downloads: DownloadDailyAggregate.downloads + amount,
+                DownloadDailyAggregate.total_bytes: DownloadDailyAggregate.total_bytes + size,
+                DownloadDailyAggregate.total_download_time: DownloadDailyAggregate.total_download_time + seconds
+            }
+            upsert(DownloadDailyAggregate, key, values, {
+                'downloads': amount, 'total_bytes': size, 'total_download_time': seconds
+            })
+
+def upgrade_schema():
+    """Add the columns and indexes of existing tables that db.create_all() skips
+    
+    create_all() only creates missing tables, so a database created by an
+    older version lacks columns added to the models since. New columns are
+    added nullable and left empty for existing rows.
+    """
+    inspector = db.inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(db.text(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                        f"{preparer.format_column(column)} {column.type.compile(db.engine.dialect)}"
+                    ))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
 
 class Statistics(db.Model):
     """Model to track website usage statistics"""
@@ -70,41 +297,69 @@ class Statistics(db.Model):
     def __repr__(self):
         return f'<Statistics {self.date}: {self.visits} visits, {self.downloads} downloads>'
     
+    # CounterBuffer (see stats_buffer.py) that batches the record_* increments;
+    # without one every increment is written straight away
+    counter_buffer = None
+    COUNTER_FIELDS = ('visits', 'downloads', 'video_downloads', 'audio_downloads')
+    
     @staticmethod
-    def record_visit():
-        """Increment visit counter for today"""
-        today = datetime.utcnow().date()
-        stats = Statistics.query.filter_by(date=today).first()
+    def add_counts(day, counts):
+        """Add counts ({column: n}) to a day's row, creating it if needed
         
-        if not stats:
-            stats = Statistics(date=today, visits=1)
-            db.session.add(stats)
-        else:
-            stats.visits += 1
-        
-        db.session.commit()
-        return stats
+        The increments happen in the database (visits = visits + n), so
+        concurrent writers in other processes never overwrite each other.
+        The caller commits.
+        """
+        values = {
+            getattr(Statistics, field): db.func.coalesce(getattr(Statistics, field), 0) + amount
+            for field, amount in counts.items()
+        }
+        row = {field: 0 for field in Statistics.COUNTER_FIELDS}
+        row.update(counts)
+        upsert(Statistics, {'date': day}, values, row)
     
     @staticmethod
-    def record_download(format_type):
-        """Increment download counter for today"""
+    def flush_counts(batch):
+        """Write out a CounterBuffer batch of {date: {column: n}} in one transaction"""
+        try:
+            for day, counts in batch.items():
+                Statistics.add_counts(day, counts)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    
+    @staticmethod
+    def totals():
+        """Return the all-time sum of every counter, computed in the database"""
+        row = db.session.query(*[
+            db.func.coalesce(db.func.sum(getattr(Statistics, field)), 0) for field in Statistics.COUNTER_FIELDS
+        ]).one()
+        return dict(zip(Statistics.COUNTER_FIELDS, row))
+    
+    @staticmethod
+    def daily(first_day, last_day):
+        """Return {date: Statistics} for the days in [first_day, last_day] that have a row"""
+        rows = Statistics.query.filter(Statistics.date.between(first_day, last_day)).all()
+        return {row.date: row for row in rows}
+    
+    @staticmethod
+    def _increment(**counts):
         today = datetime.utcnow().date()
-        stats = Statistics.query.filter_by(date=today).first()
-        
-        if not stats:
-            stats = Statistics(
-                date=today, 
-                downloads=1,
-                video_downloads=1 if format_type == 'video' else 0,
-                audio_downloads=1 if format_type == 'audio' else 0
-            )
-            db.session.add(stats)
+        if Statistics.counter_buffer is not None:
+            Statistics.counter_buffer.add(today, **counts)
         else:
-            stats.downloads += 1
-            if format_type == 'video':
-                stats.video_downloads += 1
-            elif format_type == 'audio':
-                stats.audio_downloads += 1
-        
-        db.session.commit()
-        return stats
\ No newline at end of file
+            Statistics.flush_counts({today: counts})
+    
+    @staticmethod
+    def record_visit():
+        """Count a visit for today"""
+        Statistics._increment(visits=1)
+    
+    @staticmethod
+    def record_download(format_type):
+        """Count a download of format_type ('video' or 'audio') for today"""
+        counts = {'downloads': 1}
+        if format_type in ('video', 'audio'):
+            counts[f"{format_type}_downloads"] = 1
+        Statistics._increment(**counts)
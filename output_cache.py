@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+
+from sqlite_local import LocalConnections
+
+logger = logging.getLogger(__name__)
+
+class OutputCache:
+    """Finished download files kept on disk and reused across requests
+
+    Files are keyed by what decides their content (see
+    YoutubeDownloader.output_key) and indexed in a SQLite database, so every
+    worker process on the host shares them and they survive restarts. Each
+    file lives in a directory named after the hash of its key, keeping its
+    original file name for the download.
+
+    A job that is serving a file holds a lease on it; the number of live
+    leases is the entry's reference count, and only entries without live
+    leases are evicted, least recently used first, when the total size goes
+    over max_bytes. Leases expire after lease_ttl seconds so that a crashed
+    worker can't pin a file forever.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 * 1024 * 1024, lease_ttl=3600, index_path=None):
+        """Open (or create) the cache directory and its index"""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lease_ttl = lease_ttl
+        self.index_path = index_path or os.path.join(directory, 'index.db')
+        self.connections = LocalConnections(self.index_path)
+        self.stats_lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'evicted_bytes': 0}
+
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS outputs ('
+            'key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, '
+            'metadata TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS outputs_last_access ON outputs (last_access)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS leases ('
+            'lease_id TEXT PRIMARY KEY, key TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS leases_key ON leases (key)')
+
+    def _connect(self):
+        return self.connections.get()
+
+    def _count(self, counter, amount=1):
+        with self.stats_lock:
+            self.counters[counter] += amount
+
+    def _entry_dir(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _lease(self, conn, key, now):
+        """Take a lease on key (caller is in a transaction) and return its id"""
+        lease_id = uuid.uuid4().hex
+        conn.execute(
+            'INSERT INTO leases (lease_id, key, expires_at) VALUES (?, ?, ?)',
+            (lease_id, key, now + self.lease_ttl)
+        )
+        return lease_id
+
+    @staticmethod
+    def _entry(key, path, size, metadata, lease_id):
+        return {'key': key, 'path': path, 'size': size, 'metadata': json.loads(metadata), 'lease': lease_id}
+
+    def acquire(self, key):
+        """Return the cached file for key with a new lease on it, or None
+
+        The entry is a dict with the file's path and size, the metadata it was
+        stored with and the lease id to pass to release() when done serving.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT path, size, metadata FROM outputs WHERE key = ?', (key,)).fetchone()
+            if row and not os.path.exists(row[0]):
+                # Removed behind our back (temp dir cleanup, manual deletion)
+                conn.execute('DELETE FROM outputs WHERE key = ?', (key,))
+                row = None
+            if row is None:
+                conn.execute('COMMIT')
+                self._count('misses')
+                return None
+
+            conn.execute('UPDATE outputs SET last_access = ? WHERE key = ?', (now, key))
+            lease_id = self._lease(conn, key, now)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._count('hits')
+        logger.debug(f"Output cache hit: {key}")
+        return self._entry(key, row[0], row[1], row[2], lease_id)
+
+    def store(self, key, source_path, metadata=None):
+        """Move a finished download into the cache and return its entry, leased
+
+        If another job stored the same key in the meantime, its file is kept,
+        the new one is deleted and the existing entry is returned instead.
+        """
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = os.path.join(entry_dir, os.path.basename(source_path))
+        metadata = json.dumps(metadata or {})
+
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT path, size, metadata FROM outputs WHERE key = ?', (key,)).fetchone()
+            if row and os.path.exists(row[0]):
+                conn.execute('UPDATE outputs SET last_access = ? WHERE key = ?', (now, key))
+                lease_id = self._lease(conn, key, now)
+                conn.execute('COMMIT')
+                os.remove(source_path)
+                return self._entry(key, row[0], row[1], row[2], lease_id)
+
+            # Same filesystem in the usual setup, so this is a single rename;
+            # otherwise the copy only appears under its final name once complete
+            temp_path = f"{path}.partial"
+            shutil.move(source_path, temp_path)
+            os.replace(temp_path, path)
+            size = os.path.getsize(path)
+            conn.execute(
+                'INSERT OR REPLACE INTO outputs (key, path, size, metadata, created_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, path, size, metadata, now, now)
+            )
+            lease_id = self._lease(conn, key, now)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._count('stores')
+        logger.debug(f"Stored {path} in output cache ({size} bytes)")
+        self._enforce_size(conn)
+        return self._entry(key, path, size, metadata, lease_id)
+
+    def release(self, lease_id):
+        """Drop a lease taken by acquire() or store()"""
+        if lease_id:
+            self._connect().execute('DELETE FROM leases WHERE lease_id = ?', (lease_id,))
+
+    def _enforce_size(self, conn):
+        """Evict unleased entries, least recently used first, while over max_bytes"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM outputs').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Evict down to 90% of the limit so we don't evict on every store
+        target = self.max_bytes * 0.9
+        now = time.time()
+        evicted = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM leases WHERE expires_at <= ?', (now,))
+            for key, path, size in conn.execute(
+                    'SELECT key, path, size FROM outputs '
+                    'WHERE key NOT IN (SELECT key FROM leases) ORDER BY last_access').fetchall():
+                if total <= target:
+                    break
+                conn.execute('DELETE FROM outputs WHERE key = ?', (key,))
+                total -= size
+                evicted.append((path, size))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        # Files go only once they are out of the index, so no one can lease them
+        for path, size in evicted:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            self._count('evictions')
+            self._count('evicted_bytes', size)
+        if evicted:
+            logger.debug(f"Output cache evicted {len(evicted)} files")
+        if total > self.max_bytes:
+            logger.warning(f"Output cache is over its size limit ({total} bytes), the remaining files are in use")
+
+    def stats(self):
+        """Return hit/miss/eviction counters, current size and live leases"""
+        with self.stats_lock:
+            stats = dict(self.counters)
+        conn = self._connect()
+        entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outputs').fetchone()
+        leases = conn.execute('SELECT COUNT(*) FROM leases WHERE expires_at > ?', (time.time(),)).fetchone()[0]
+        stats.update({'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes, 'leases': leases})
+        return stats
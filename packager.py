@@ -0,0 +1,157 @@
+import os
+import logging
+import tarfile
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024  # Bytes read from an item file at a time
+
+# How playlist output can be delivered: a streamed ZIP or tar archive, or no
+# archive at all with a download link per item. Media is already compressed,
+# so neither archive format compresses anything.
+PACKAGING_MODES = ('zip', 'tar', 'links')
+ARCHIVE_TYPES = {
+    'zip': ('.zip', 'application/zip'),
+    'tar': ('.tar', 'application/x-tar'),
+}
+
+class _ChunkSink:
+    """Write-only, unseekable file object that collects bytes until drained
+
+    Because it has no tell()/seek(), zipfile writes each entry's sizes and CRC
+    in a data descriptor after the data instead of seeking back to patch the
+    local header, which is what makes the archive streamable.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Yield and forget the bytes written so far"""
+        chunks, self.chunks = self.chunks, []
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+
+def _unique_name(arcname, used):
+    """Make arcname unique within the archive by adding a counter"""
+    base, ext = os.path.splitext(arcname)
+    candidate, counter = arcname, 1
+    while candidate in used:
+        counter += 1
+        candidate = f"{base} ({counter}){ext}"
+    used.add(candidate)
+    return candidate
+
+def _read_chunks(path, chunk_size):
+    with open(path, 'rb') as source:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE):
+    """Generate a ZIP archive of (arcname, path) entries as a stream of bytes
+
+    entries may be a generator that blocks until the next file is ready, so
+    bytes for finished items go out while later ones are still downloading.
+    Files are stored uncompressed (ZIP_STORED) and read in chunk_size pieces,
+    so memory use stays flat regardless of the archive size and nothing is
+    written to disk.
+    """
+    sink = _ChunkSink()
+    used = set()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for arcname, path in entries:
+            zinfo = zipfile.ZipInfo.from_file(path, _unique_name(arcname, used))
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with archive.open(zinfo, 'w', force_zip64=zinfo.file_size > zipfile.ZIP64_LIMIT) as target:
+                for chunk in _read_chunks(path, chunk_size):
+                    target.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+            logger.debug(f"Streamed {arcname} ({zinfo.file_size} bytes)")
+    # Central directory
+    yield from sink.drain()
+
+def stream_tar(entries, chunk_size=CHUNK_SIZE):
+    """Generate an uncompressed tar archive of (arcname, path) entries
+
+    Same contract as stream_zip. tarfile's own stream mode buffers each
+    member in memory, so headers come from TarInfo and the file data is
+    copied through in chunks with the block padding added by hand.
+    """
+    used = set()
+    written = 0
+    for arcname, path in entries:
+        stat = os.stat(path)
+        info = tarfile.TarInfo(_unique_name(arcname, used))
+        info.size = stat.st_size
+        info.mtime = int(stat.st_mtime)
+        info.mode = 0o644
+        header = info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='surrogateescape')
+        yield header
+        written += len(header)
+
+        copied = 0
+        for chunk in _read_chunks(path, chunk_size):
+            copied += len(chunk)
+            yield chunk
+        if copied != info.size:
+            raise IOError(f"{path} changed size while it was being archived")
+
+        padding = -info.size % tarfile.BLOCKSIZE
+        if padding:
+            yield tarfile.NUL * padding
+        written += info.size + padding
+        logger.debug(f"Streamed {arcname} ({info.size} bytes)")
+
+    # End-of-archive marker, padded to a full record like tarfile does
+    trailer = tarfile.BLOCKSIZE * 2
+    trailer += -(written + trailer) % tarfile.RECORDSIZE
+    yield tarfile.NUL * trailer
+
+def stream_archive(packaging, entries, chunk_size=CHUNK_SIZE):
+    """Stream entries with the given archive packaging ('zip' or 'tar')"""
+    if packaging == 'tar':
+        return stream_tar(entries, chunk_size)
+    if packaging == 'zip':
+        return stream_zip(entries, chunk_size)
+    raise ValueError(f"Packaging '{packaging}' does not produce an archive")
+
+def archive_name(title, packaging):
+    """Return the file name for an archive of the given packaging"""
+    extension, _ = ARCHIVE_TYPES[packaging]
+    return f"{title}{extension}"
+
+def write_archive(path, entries, packaging='zip'):
+    """Write an archive of (arcname, path) entries to a file on disk"""
+    with open(path, 'wb') as target:
+        for chunk in stream_archive(packaging, entries):
+            target.write(chunk)
+    return path
+
+def is_item_file(name):
+    """Check whether a file in an items directory is finished output
+
+    Bookkeeping files (manifests, locks, item lists) are dot-files, and
+    partial downloads keep yt-dlp's .part/.ytdl names until they finish.
+    """
+    return not name.startswith('.') and not name.endswith(('.part', '.ytdl'))
+
+def directory_entries(directory):
+    """Return (arcname, path) entries for the finished files in a directory, sorted by name"""
+    return [
+        (name, os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if is_item_file(name) and os.path.isfile(os.path.join(directory, name))
+    ]
@@ -0,0 +1,195 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from yt_dlp.utils import DownloadCancelled
+
+logger = logging.getLogger(__name__)
+
+class PlaylistProgress:
+    """Merges the progress of concurrently downloading items into one stream
+
+    Item downloads call their own hook from several threads; this keeps the
+    bytes of every item (and every file of a merged format) under a lock and
+    forwards a single yt-dlp style 'downloading' event for the whole playlist
+    to the job's progress hook, along with the playlist_* item counts. The job
+    hook (normally a ProgressReporter) is only ever called under the lock, so
+    it still sees a single writer.
+    """
+
+    def __init__(self, total, progress_hook=None, item_hook=None):
+        self.total = total
+        self.progress_hook = progress_hook
+        self.item_hook = item_hook
+        self.lock = threading.Lock()
+        self.active = {}  # index -> {filename: (downloaded_bytes, total_bytes)}
+        self.done_bytes = 0
+        self.done = 0
+        self.failed = 0
+        self.cancelled = False
+
+    def hook_for(self, index):
+        """Return the progress hook for one item"""
+        def hook(d):
+            with self.lock:
+                if self.cancelled:
+                    raise DownloadCancelled("Playlist download was cancelled")
+                if d.get('status') == 'downloading':
+                    total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+                    files = self.active.setdefault(index, {})
+                    files[d.get('filename')] = (d.get('downloaded_bytes') or 0, total)
+                    self._report()
+        return hook
+
+    def _report(self):
+        """Forward the aggregate progress (caller holds the lock)"""
+        if not self.progress_hook:
+            return
+
+        active_files = [size for files in self.active.values() for size in files.values()]
+        downloaded = self.done_bytes + sum(done for done, _ in active_files)
+        known_total = self.done_bytes + sum(total for _, total in active_files)
+
+        # Items that haven't reported a size yet are assumed to be average-sized
+        sized = self.done + len(self.active)
+        waiting = max(self.total - self.done - self.failed - len(self.active), 0)
+        total_estimate = known_total + (known_total / sized * waiting if sized else 0)
+
+        try:
+            self.progress_hook({
+                'status': 'downloading',
+                'downloaded_bytes': downloaded,
+                'total_bytes': total_estimate,
+                'playlist_count': self.total,
+                'playlist_done': self.done,
+                'playlist_failed': self.failed
+            })
+        except DownloadCancelled:
+            self.cancelled = True
+            raise
+
+    def item_done(self, index, filepath):
+        """Record a finished item and report it to the item hook"""
+        with self.lock:
+            files = self.active.pop(index, {})
+            item_bytes = sum(done for done, _ in files.values())
+            if not item_bytes and filepath and os.path.exists(filepath):
+                item_bytes = os.path.getsize(filepath)
+            self.done_bytes += item_bytes
+            self.done += 1
+            if self.item_hook and filepath:
+                self.item_hook(filepath)
+            self._report()
+
+    def item_retry(self, index):
+        """Forget the partial bytes of an item that is about to be retried"""
+        with self.lock:
+            self.active.pop(index, None)
+
+    def item_failed(self, index):
+        """Record an item that failed for good"""
+        with self.lock:
+            self.active.pop(index, None)
+            self.failed += 1
+            self._report()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+
+class PlaylistExecutor:
+    """Downloads the items of an expanded playlist N at a time
+
+    download_item(entry, progress_hook) downloads one entry and returns the
+    path of the finished file. Each item gets up to retries extra attempts;
+    items that still fail are reported in the result instead of failing the
+    whole playlist. Cancellation (DownloadCancelled from the job's progress
+    hook) stops the running items at their next progress update, skips the
+    ones not started yet and is re-raised to the caller.
+
+    With a PlaylistManifest, item states are recorded as they change and items
+    the manifest already has as done are reported right away instead of being
+    downloaded again.
+    """
+
+    def __init__(self, concurrency=3, retries=1):
+        self.concurrency = max(int(concurrency), 1)
+        self.retries = retries
+
+    def run(self, entries, download_item, progress_hook=None, item_hook=None, manifest=None):
+        """Download all entries and return {'completed': [...], 'failed': [...]}
+
+        completed holds the file paths in playlist order; failed holds a dict
+        with the index, title, url and error of each item that failed.
+        """
+        progress = PlaylistProgress(len(entries), progress_hook, item_hook)
+        results = [None] * len(entries)
+        failures = []
+
+        # Items finished by an earlier run of this job
+        if manifest:
+            for index, filepath in manifest.done_items():
+                progress.item_done(index, filepath)
+                results[index] = filepath
+            if any(results):
+                logger.info(f"Resuming playlist: {sum(1 for filepath in results if filepath)} of {len(entries)} items already done")
+
+        def run_item(index, entry):
+            last_error = None
+            for attempt in range(self.retries + 1):
+                if progress.cancelled:
+                    raise DownloadCancelled("Playlist download was cancelled")
+                try:
+                    if manifest:
+                        manifest.mark_downloading(index)
+                    filepath = download_item(entry, progress.hook_for(index))
+                    if manifest:
+                        manifest.mark_done(index, filepath)
+                    progress.item_done(index, filepath)
+                    results[index] = filepath
+                    return
+                except DownloadCancelled:
+                    progress.cancel()
+                    raise
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"Playlist item {index + 1} attempt {attempt + 1} failed: {str(e)}")
+                    progress.item_retry(index)
+
+            if manifest:
+                manifest.mark_failed(index, last_error)
+            progress.item_failed(index)
+            failures.append({
+                'index': index,
+                'title': entry.get('title'),
+                'url': entry.get('url'),
+                'error': str(last_error)
+            })
+
+        cancelled = None
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='playlist-item') as pool:
+            futures = [
+                pool.submit(run_item, index, entry)
+                for index, entry in enumerate(entries) if results[index] is None
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except DownloadCancelled as e:
+                    cancelled = cancelled or e
+                    # Items that haven't started yet won't start
+                    for pending in futures:
+                        pending.cancel()
+                except Exception as e:
+                    if not future.cancelled():
+                        logger.error(f"Unexpected error in playlist item: {str(e)}")
+
+        if cancelled:
+            raise cancelled
+
+        failures.sort(key=lambda failure: failure['index'])
+        return {
+            'completed': [filepath for filepath in results if filepath],
+            'failed': failures
+        }
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class PlaylistManifest:
+    """Durable record of a playlist job's items, kept in the job's work directory
+
+    Each item has a state ('pending', 'downloading', 'done' or 'failed'), its
+    output path, byte count, attempts and last error. The manifest is
+    rewritten atomically (temp file + rename) on every change, so if the job
+    dies midway a later job for the same playlist and format finds it, skips
+    the finished items and lets yt-dlp continue the .part files of the rest.
+
+    A job owns the directory while it holds an exclusive flock() on its lock
+    file, so two concurrent jobs never share one.
+    """
+
+    FILENAME = '.manifest.json'
+    LOCK_FILENAME = '.lock'
+
+    def __init__(self, work_dir, lock_fd):
+        self.work_dir = work_dir
+        self.path = os.path.join(work_dir, self.FILENAME)
+        self.lock_fd = lock_fd
+        self.lock = threading.Lock()
+        self.data = {'url': None, 'title': None, 'state': 'new', 'entries': []}
+
+    @classmethod
+    def claim(cls, work_dir):
+        """Take ownership of a work directory and load its manifest
+
+        Returns None if another job is using the directory, or if it holds
+        the finished output of an earlier job (which may still be delivered).
+        """
+        os.makedirs(work_dir, exist_ok=True)
+        lock_fd = os.open(os.path.join(work_dir, cls.LOCK_FILENAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(lock_fd)
+            return None
+
+        manifest = cls(work_dir, lock_fd)
+        try:
+            with open(manifest.path) as manifest_file:
+                manifest.data = json.load(manifest_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable playlist manifest {manifest.path}: {str(e)}")
+
+        if manifest.data.get('state') == 'complete':
+            manifest.release()
+            return None
+        return manifest
+
+    @classmethod
+    def is_locked(cls, work_dir):
+        """Check whether a job currently owns a work directory"""
+        try:
+            lock_fd = os.open(os.path.join(work_dir, cls.LOCK_FILENAME), os.O_RDWR)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        finally:
+            os.close(lock_fd)  # Also drops our probe lock, if we got it
+        return False
+
+    @property
+    def entries(self):
+        return self.data['entries']
+
+    def start(self, url, title, entries):
+        """Record a freshly expanded playlist"""
+        with self.lock:
+            self.data = {
+                'url': url,
+                'title': title,
+                'state': 'running',
+                'entries': [
+                    dict(entry, state='pending', filepath=None, bytes=0, attempts=0, error=None)
+                    for entry in entries
+                ]
+            }
+            self._save()
+
+    def resume(self):
+        """Prepare a loaded manifest for another run
+
+        Items whose output has gone missing are downloaded again, and items
+        that were interrupted or failed get a new chance.
+        """
+        with self.lock:
+            for entry in self.entries:
+                if entry['state'] == 'done' and not (entry['filepath'] and os.path.exists(entry['filepath'])):
+                    entry['state'] = 'pending'
+                elif entry['state'] in ('downloading', 'failed'):
+                    entry['state'] = 'pending'
+            self.data['state'] = 'running'
+            self._save()
+
+    def done_items(self):
+        """Return (index, filepath) of the items that are already finished"""
+        return [(index, entry['filepath']) for index, entry in enumerate(self.entries) if entry['state'] == 'done']
+
+    def mark_downloading(self, index):
+        self._update(index, state='downloading', increment_attempts=True)
+
+    def mark_done(self, index, filepath):
+        size = os.path.getsize(filepath) if filepath and os.path.exists(filepath) else 0
+        self._update(index, state='done', filepath=filepath, bytes=size, error=None)
+
+    def mark_failed(self, index, error):
+        self._update(index, state='failed', error=str(error))
+
+    def finish(self):
+        """Mark the job complete and give up the directory"""
+        with self.lock:
+            self.data['state'] = 'complete'
+            self._save()
+        self.release()
+
+    def release(self):
+        """Give up the directory, keeping the manifest for a later job to resume"""
+        if self.lock_fd is not None:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def _update(self, index, increment_attempts=False, **fields):
+        with self.lock:
+            entry = self.entries[index]
+            entry.update(fields)
+            if increment_attempts:
+                entry['attempts'] = entry.get('attempts', 0) + 1
+            self._save()
+
+    def _save(self):
+        """Atomically replace the manifest file (caller holds the lock)"""
+        self.data['updated_at'] = time.time()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(self.data, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temp_path, self.path)
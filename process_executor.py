@@ -0,0 +1,166 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from progress_reporter import ProgressReporter
+from rate_limiter import create_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Per-process state of the worker processes, set up by _init_worker
+_worker_downloader = None
+_worker_events = None
+_worker_cancelled = None
+_worker_reporter_options = None
+
+def _init_worker(events, cancelled, reporter_options, rate_limiter_options, downloader_options):
+    """Set up a worker process with its own downloader instance"""
+    global _worker_downloader, _worker_events, _worker_cancelled, _worker_reporter_options
+    from downloader import YoutubeDownloader
+    rate_limiter = create_rate_limiter(**rate_limiter_options) if rate_limiter_options else None
+    _worker_downloader = YoutubeDownloader(rate_limiter=rate_limiter, **downloader_options)
+    _worker_events = events
+    _worker_cancelled = cancelled
+    _worker_reporter_options = reporter_options
+
+def _run_download(job_id, download_type, url, format_id, output_path, playlist, info=None, stream_items=False):
+    """Run one download inside a worker process, streaming progress to the parent"""
+    # Coalesce progress here so only the occasional update crosses the process boundary
+    progress_hook = ProgressReporter(
+        lambda fields: _worker_events.put((job_id, fields)),
+        should_stop=lambda: _worker_cancelled.get(job_id, False),
+        **_worker_reporter_options
+    )
+    
+    # Finished playlist items are forwarded to the parent's item hook
+    item_hook = None
+    if stream_items:
+        item_hook = lambda filepath: _worker_events.put((job_id, {'item': filepath}))
+
+    try:
+        if download_type == 'audio':
+            return _worker_downloader.download_audio(
+                url,
+                format_id=format_id,
+                output_path=output_path,
+                progress_hook=progress_hook,
+                playlist=playlist,
+                info=info,
+                item_hook=item_hook
+            )
+        return _worker_downloader.download_video(
+            url,
+            format_id=format_id,
+            output_path=output_path,
+            progress_hook=progress_hook,
+            playlist=playlist,
+            info=info,
+            item_hook=item_hook
+        )
+    finally:
+        # End-of-stream marker so the parent knows every progress event was delivered
+        _worker_events.put((job_id, None))
+
+class ProcessDownloadExecutor:
+    """Runs YoutubeDownloader jobs in a pool of worker processes
+
+    yt-dlp's format selection, extraction and the playlist archive step are
+    CPU-bound Python, so running them in the web process competes with request
+    handling for the GIL. Jobs submitted here run in separate processes. Each
+    job's progress is coalesced by a ProgressReporter in the worker, and the
+    resulting updates come back over a multiprocessing queue to be published
+    on a pump thread in this process.
+    """
+
+    def __init__(self, max_workers=None, reporter_options=None, rate_limiter_options=None, downloader_options=None):
+        """Start the process pool and the progress pump thread
+
+        rate_limiter_options are create_rate_limiter() arguments for the
+        workers' downloaders; give a path so they share the parent's bucket.
+        downloader_options are extra YoutubeDownloader arguments.
+        """
+        context = multiprocessing.get_context('spawn')
+        self.manager = context.Manager()
+        self.cancelled = self.manager.dict()  # job_id -> True when cancelled
+        self.events = context.Queue()
+        self.hooks = {}  # job_id -> (publish, should_stop, item_hook, drained event)
+        self.lock = threading.Lock()
+
+        self.pool = ProcessPoolExecutor(
+            max_workers=max_workers or os.cpu_count(),
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.events, self.cancelled, reporter_options or {}, rate_limiter_options, downloader_options or {})
+        )
+
+        self.pump_thread = threading.Thread(target=self._pump_events, daemon=True)
+        self.pump_thread.start()
+
+    def _pump_events(self):
+        """Publish progress updates from worker processes"""
+        while True:
+            try:
+                job_id, fields = self.events.get()
+            except (EOFError, OSError):
+                return
+
+            with self.lock:
+                publish, should_stop, item_hook, drained = self.hooks.get(job_id, (None, None, None, None))
+
+            if fields is None:
+                if drained:
+                    drained.set()
+                continue
+
+            try:
+                if 'item' in fields:
+                    if item_hook:
+                        item_hook(fields['item'])
+                elif publish:
+                    publish(fields)
+                # Cancellation requested through the parent (e.g. another web
+                # worker) is only visible here
+                if should_stop and should_stop():
+                    self.cancel(job_id)
+            except Exception as e:
+                logger.error(f"Error handling progress for job {job_id}: {str(e)}")
+
+    def run(self, job_id, download_type, url, format_id, output_path, playlist, publish=None, should_stop=None, info=None, item_hook=None):
+        """Run a download in the process pool and block until it finishes
+
+        publish receives the job's coalesced progress fields; should_stop is
+        polled with each update and stops the job when it returns True. info is
+        previously extracted video info, passed through to the downloader, and
+        item_hook receives the path of each finished playlist item.
+        Returns the same result dict as YoutubeDownloader.download_video and
+        re-raises any error raised in the worker process.
+        """
+        drained = threading.Event()
+        with self.lock:
+            self.hooks[job_id] = (publish, should_stop, item_hook, drained)
+
+        try:
+            future = self.pool.submit(
+                _run_download, job_id, download_type, url, format_id, output_path, playlist, info,
+                item_hook is not None
+            )
+            result = future.result()
+            # Make sure the last progress events are applied before the caller
+            # records the final state
+            drained.wait(timeout=5)
+            return result
+        finally:
+            with self.lock:
+                self.hooks.pop(job_id, None)
+            self.cancelled.pop(job_id, None)
+
+    def cancel(self, job_id):
+        """Ask the worker process running a job to stop"""
+        self.cancelled[job_id] = True
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
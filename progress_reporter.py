@@ -0,0 +1,126 @@
+import time
+import logging
+
+from yt_dlp.utils import DownloadCancelled
+
+logger = logging.getLogger(__name__)
+
+class ProgressReporter:
+    """Coalesces yt-dlp style progress callbacks into occasional progress updates
+
+    yt-dlp calls its progress hooks for every chunk or fragment, which can be
+    thousands of times a second for DASH downloads. A reporter is used as the
+    progress hook of a single job: it keeps the latest numbers in plain
+    attributes (only the job's download thread writes them, so no lock is
+    needed) and only calls publish() when the status changes, or when at least
+    min_interval seconds have passed and the percentage moved by min_percent
+    (or max_interval passed, so speed and ETA stay fresh).
+
+    publish receives a dict of progress fields: 'progress' (percent), 'status'
+    on status changes, and 'speed' (bytes/s) and 'eta' (seconds) once they can
+    be estimated from downloaded_bytes deltas. Playlist item counts sent by
+    the playlist executor are published whenever they change.
+    """
+
+    SPEED_SAMPLE_INTERVAL = 0.25  # Minimum seconds between speed samples
+    SPEED_SMOOTHING = 0.3         # Weight of the newest sample in the moving average
+    PLAYLIST_FIELDS = ('playlist_count', 'playlist_done', 'playlist_failed')
+
+    def __init__(self, publish, should_stop=None, min_interval=0.5, min_percent=1.0, max_interval=2.0):
+        """Create a reporter that forwards coalesced progress to publish"""
+        self.publish = publish
+        self.should_stop = should_stop
+        self.min_interval = min_interval
+        self.min_percent = min_percent
+        self.max_interval = max_interval
+
+        # Single-writer slot for this job
+        self.status = None
+        self.percent = 0.0
+        self.speed = None
+        self.eta = None
+        self.last_publish_time = 0.0
+        self.last_published_percent = None
+        self.last_stop_check = time.monotonic()
+        self.sample_bytes = None
+        self.sample_time = None
+        self.playlist_counts = {}
+
+    def __call__(self, d):
+        """Progress hook entry point, accepts yt-dlp's progress dicts"""
+        now = time.monotonic()
+
+        # Cancellation checks may hit a shared store, so rate limit them too
+        if self.should_stop and now - self.last_stop_check >= self.min_interval:
+            self.last_stop_check = now
+            if self.should_stop():
+                raise DownloadCancelled("Download was cancelled")
+
+        status = d.get('status')
+        if status == 'downloading':
+            self._record_bytes(d, now)
+            counts = self._changed_playlist_counts(d)
+            if self.status != 'downloading':
+                self.status = 'downloading'
+                self._publish(now, status='downloading', **counts)
+            elif counts or self._due(now):
+                self._publish(now, **counts)
+
+        elif status == 'finished':
+            self.status = 'processing'
+            self.sample_bytes = None  # A merged format starts a fresh file next
+            self._publish(now, status='processing')
+
+        elif status == 'error':
+            self.status = 'error'
+
+    def _record_bytes(self, d, now):
+        """Update percent, speed and ETA from the latest byte counts"""
+        downloaded = d.get('downloaded_bytes') or 0
+        total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+        self.percent = downloaded / total * 100 if total > 0 else 0
+
+        if self.sample_bytes is None or downloaded < self.sample_bytes:
+            # First sample, or a new file started (e.g. the audio stream of a merge)
+            self.sample_bytes, self.sample_time = downloaded, now
+        elif now - self.sample_time >= self.SPEED_SAMPLE_INTERVAL:
+            instant_speed = (downloaded - self.sample_bytes) / (now - self.sample_time)
+            if self.speed is None:
+                self.speed = instant_speed
+            else:
+                self.speed += self.SPEED_SMOOTHING * (instant_speed - self.speed)
+            self.sample_bytes, self.sample_time = downloaded, now
+
+        if self.speed and total > 0:
+            self.eta = max(total - downloaded, 0) / self.speed
+
+    def _changed_playlist_counts(self, d):
+        """Return the playlist item counts in d if they differ from the last ones"""
+        counts = {key: d[key] for key in self.PLAYLIST_FIELDS if key in d}
+        if not counts or counts == self.playlist_counts:
+            return {}
+        self.playlist_counts = counts
+        return counts
+
+    def _due(self, now):
+        """Check whether enough has changed to publish again"""
+        elapsed = now - self.last_publish_time
+        if elapsed >= self.max_interval:
+            return True
+        if elapsed < self.min_interval:
+            return False
+        return (self.last_published_percent is None
+                or abs(self.percent - self.last_published_percent) >= self.min_percent)
+
+    def _publish(self, now, **fields):
+        fields['progress'] = self.percent
+        if self.speed is not None:
+            fields['speed'] = round(self.speed)
+        if self.eta is not None:
+            fields['eta'] = round(self.eta)
+        self.last_publish_time = now
+        self.last_published_percent = self.percent
+        try:
+            self.publish(fields)
+        except Exception as e:
+            logger.error(f"Error publishing progress: {str(e)}")
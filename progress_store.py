@@ -0,0 +1,424 @@
+import os
+import json
+import time
+import zlib
+import mmap
+import fcntl
+import struct
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from sqlite_local import LocalConnections
+
+logger = logging.getLogger(__name__)
+
+class ProgressStore(ABC):
+    """Interface for download progress backends
+
+    Entries are plain JSON-serializable dicts keyed by download ID. Every write
+    bumps the entry's 'version' and sets 'updated_at', so readers can cheaply
+    tell whether anything changed since they last looked.
+    """
+
+    @abstractmethod
+    def add(self, key, data):
+        """Create an entry if it doesn't exist yet; return True if it was created"""
+
+    @abstractmethod
+    def set(self, key, data):
+        """Create or replace an entry"""
+
+    @abstractmethod
+    def update(self, key, **fields):
+        """Merge fields into an existing entry; return False if it doesn't exist"""
+
+    @abstractmethod
+    def increment(self, key, field, amount=1):
+        """Atomically add amount to a numeric field; return the new value, or None if the entry doesn't exist"""
+
+    @abstractmethod
+    def get(self, key):
+        """Return a copy of an entry, or None if it doesn't exist"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Remove an entry and return its last value, or None if it didn't exist"""
+
+    @abstractmethod
+    def keys(self):
+        """Return a list of all entry keys"""
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    POLL_INTERVAL = 0.25  # Seconds between checks in the default wait_for_change
+
+    def wait_for_change(self, key, version, timeout):
+        """Wait until an entry's version differs from version, or timeout expires
+
+        Returns the current entry (None if it doesn't exist). Shared backends
+        have no cross-process notification, so this default polls.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            entry = self.get(key)
+            if entry is None or entry['version'] != version or time.monotonic() >= deadline:
+                return entry
+            time.sleep(self.POLL_INTERVAL)
+
+    @staticmethod
+    def _stamp(data, version):
+        """Attach version and timestamp to an entry before it is stored"""
+        data['version'] = version
+        data['updated_at'] = time.time()
+        return data
+
+class MemoryProgressStore(ProgressStore):
+    """Progress store backed by a dict, local to one process"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # Notified on every write
+
+    def add(self, key, data):
+        with self.lock:
+            if key in self.entries:
+                return False
+            self.entries[key] = self._stamp(dict(data), 1)
+            self.changed.notify_all()
+            return True
+
+    def set(self, key, data):
+        with self.lock:
+            previous = self.entries.get(key)
+            version = previous['version'] + 1 if previous else 1
+            self.entries[key] = self._stamp(dict(data), version)
+            self.changed.notify_all()
+
+    def update(self, key, **fields):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            entry.update(fields)
+            self._stamp(entry, entry['version'] + 1)
+            self.changed.notify_all()
+            return True
+
+    def increment(self, key, field, amount=1):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry[field] = entry.get(field, 0) + amount
+            self._stamp(entry, entry['version'] + 1)
+            self.changed.notify_all()
+            return entry[field]
+
+    def wait_for_change(self, key, version, timeout):
+        with self.lock:
+            self.changed.wait_for(
+                lambda: self.entries.get(key, {}).get('version') != version,
+                timeout=timeout
+            )
+            entry = self.entries.get(key)
+            return dict(entry) if entry is not None else None
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return dict(entry) if entry is not None else None
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            self.changed.notify_all()
+            return entry
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+class SQLiteProgressStore(ProgressStore):
+    """Progress store in a SQLite database shared by all worker processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.connections = LocalConnections(self.path)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS progress ('
+                'key TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL)'
+            )
+
+    def _connect(self):
+        return self.connections.get()
+
+    def _write(self, key, merge, data, only_if_absent=False):
+        """Read-modify-write an entry inside a single IMMEDIATE transaction
+
+        When merging, data may be a function of the current entry that
+        returns the fields to merge.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data, version FROM progress WHERE key = ?', (key,)).fetchone()
+            if row is not None and only_if_absent:
+                conn.execute('ROLLBACK')
+                return False
+            if row is None and merge:
+                conn.execute('ROLLBACK')
+                return False
+
+            if row is not None and merge:
+                entry = json.loads(row[0])
+                entry.update(data(entry) if callable(data) else data)
+            else:
+                entry = dict(data)
+            version = row[1] + 1 if row is not None else 1
+            self._stamp(entry, version)
+
+            conn.execute(
+                'INSERT OR REPLACE INTO progress (key, data, version) VALUES (?, ?, ?)',
+                (key, json.dumps(entry), version)
+            )
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def add(self, key, data):
+        return self._write(key, False, data, only_if_absent=True)
+
+    def set(self, key, data):
+        self._write(key, False, data)
+
+    def update(self, key, **fields):
+        return self._write(key, True, fields)
+
+    def increment(self, key, field, amount=1):
+        values = []
+
+        def add(entry):
+            values.append(entry.get(field, 0) + amount)
+            return {field: values[-1]}
+
+        return values[-1] if self._write(key, True, add) else None
+
+    def get(self, key):
+        row = self._connect().execute('SELECT data FROM progress WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, key):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM progress WHERE key = ?', (key,)).fetchone()
+            conn.execute('DELETE FROM progress WHERE key = ?', (key,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return json.loads(row[0]) if row else None
+
+    def keys(self):
+        return [row[0] for row in self._connect().execute('SELECT key FROM progress')]
+
+class MmapProgressStore(ProgressStore):
+    """Progress store in a memory-mapped file shared by all worker processes
+
+    The file is a fixed-size hash table of slots, located by CRC32 of the key
+    with linear probing, so lookups and updates are O(1). Writers serialize
+    with a thread lock plus an flock on the file. Each slot carries a sequence
+    number that is odd while a write is in progress, which lets readers copy a
+    slot without taking any lock and retry if it changed underneath them.
+    """
+
+    # Slot header: state, sequence number, entry version, key length, data length
+    HEADER = struct.Struct('<BIIHH')
+    KEY_SIZE = 64
+    EMPTY, USED, DELETED = 0, 1, 2
+    MAX_STRING = 512  # Longest string value; callers shorten messages themselves
+    READ_TIMEOUT = 1.0  # Seconds a reader waits for a slot that is being written
+
+    def __init__(self, path, slots=4096, slot_size=2048):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.data_size = slot_size - self.HEADER.size - self.KEY_SIZE
+        self.lock = threading.Lock()
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * slot_size
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, size)
+
+    def _read_slot(self, index):
+        """Return a consistent (state, version, key, data bytes) snapshot of a slot"""
+        offset = index * self.slot_size
+        deadline = None
+        while True:
+            state, seq, version, key_len, data_len = self.HEADER.unpack_from(self.map, offset)
+            if not seq % 2:
+                start = offset + self.HEADER.size
+                key = bytes(self.map[start:start + key_len])
+                data = bytes(self.map[start + self.KEY_SIZE:start + self.KEY_SIZE + data_len])
+                if self.HEADER.unpack_from(self.map, offset)[1] == seq:
+                    return state, version, key, data
+            # A writer is mid-update, try again, but not forever: a writer
+            # that died mid-update leaves the sequence odd
+            if deadline is None:
+                deadline = time.monotonic() + self.READ_TIMEOUT
+            elif time.monotonic() >= deadline:
+                raise RuntimeError(f"Progress store slot {index} is stuck mid-write")
+            time.sleep(0)
+
+    def _write_slot(self, index, state, version, key, data):
+        """Write a slot, bracketing the update with odd/even sequence numbers"""
+        offset = index * self.slot_size
+        old_state, seq = self.HEADER.unpack_from(self.map, offset)[:2]
+        # Mark the slot as being written (odd sequence) before touching it; the
+        # sequence is already odd if a writer died mid-update
+        seq |= 1
+        self.HEADER.pack_into(self.map, offset, old_state, seq, version, 0, 0)
+        start = offset + self.HEADER.size
+        self.map[start:start + len(key)] = key
+        self.map[start + self.KEY_SIZE:start + self.KEY_SIZE + len(data)] = data
+        self.HEADER.pack_into(self.map, offset, state, (seq + 1) & 0xFFFFFFFF, version, len(key), len(data))
+
+    def _find(self, key):
+        """Return (slot index of key or None, first free slot index or None)"""
+        start = zlib.crc32(key) % self.slots
+        free = None
+        for probe in range(self.slots):
+            index = (start + probe) % self.slots
+            state, _, slot_key, _ = self._read_slot(index)
+            if state == self.EMPTY:
+                return None, free if free is not None else index
+            if state == self.DELETED:
+                if free is None:
+                    free = index
+            elif slot_key == key:
+                return index, free
+        return None, free
+
+    def _encode_key(self, key):
+        encoded = key.encode('utf-8')
+        if len(encoded) > self.KEY_SIZE:
+            raise ValueError(f"Progress key too long: {key}")
+        return encoded
+
+    def _encode_data(self, entry):
+        for field, value in entry.items():
+            if isinstance(value, str) and len(value) > self.MAX_STRING:
+                # Cutting it short could silently corrupt a file path
+                raise ValueError(f"Progress field '{field}' too long ({len(value)} characters)")
+        data = json.dumps(entry, separators=(',', ':')).encode('utf-8')
+        if len(data) > self.data_size:
+            raise ValueError(f"Progress entry too large ({len(data)} bytes)")
+        return data
+
+    def _write(self, key, merge, fields, only_if_absent=False):
+        encoded_key = self._encode_key(key)
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                index, free = self._find(encoded_key)
+                if index is not None and only_if_absent:
+                    return False
+                if index is None and merge:
+                    return False
+
+                if index is not None:
+                    _, version, _, data = self._read_slot(index)
+                    entry = json.loads(data) if merge else {}
+                    version += 1
+                else:
+                    if free is None:
+                        raise RuntimeError("Progress store is full")
+                    index, entry, version = free, {}, 1
+
+                entry.update(fields(entry) if callable(fields) else fields)
+                self._stamp(entry, version)
+                self._write_slot(index, self.USED, version, encoded_key, self._encode_data(entry))
+                return True
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def add(self, key, data):
+        return self._write(key, False, data, only_if_absent=True)
+
+    def set(self, key, data):
+        self._write(key, False, data)
+
+    def update(self, key, **fields):
+        return self._write(key, True, fields)
+
+    def increment(self, key, field, amount=1):
+        values = []
+
+        def add(entry):
+            values.append(entry.get(field, 0) + amount)
+            return {field: values[-1]}
+
+        return values[-1] if self._write(key, True, add) else None
+
+    def get(self, key):
+        index, _ = self._find(self._encode_key(key))
+        if index is None:
+            return None
+        state, _, slot_key, data = self._read_slot(index)
+        if state != self.USED or slot_key != key.encode('utf-8'):
+            return None  # Deleted or reused between lookup and read
+        return json.loads(data)
+
+    def delete(self, key):
+        encoded_key = self._encode_key(key)
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                index, _ = self._find(encoded_key)
+                if index is None:
+                    return None
+                _, version, _, data = self._read_slot(index)
+                next_state = self._read_slot((index + 1) % self.slots)[0]
+                if next_state == self.EMPTY:
+                    # End of a probe chain: free this slot and any tombstones before it
+                    while True:
+                        self._write_slot(index, self.EMPTY, 0, b'', b'')
+                        index = (index - 1) % self.slots
+                        if self._read_slot(index)[0] != self.DELETED:
+                            break
+                else:
+                    # Leave a tombstone so probe chains through this slot stay intact
+                    self._write_slot(index, self.DELETED, version, b'', b'')
+                return json.loads(data)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def keys(self):
+        keys = []
+        for index in range(self.slots):
+            state, _, slot_key, _ = self._read_slot(index)
+            if state == self.USED:
+                keys.append(slot_key.decode('utf-8'))
+        return keys
+
+def create_progress_store(backend='memory', path=None):
+    """Create a progress store for the named backend (memory, mmap or sqlite)"""
+    if backend == 'memory':
+        return MemoryProgressStore()
+    if backend == 'sqlite':
+        return SQLiteProgressStore(path)
+    if backend == 'mmap':
+        return MmapProgressStore(path)
+    raise ValueError(f"Unknown progress backend: {backend}")
@@ -0,0 +1,134 @@
+import os
+import time
+import fcntl
+import struct
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class RateLimited(Exception):
+    """Raised when a request would have to wait for the rate limiter"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after  # Seconds until a token is available
+        super().__init__(f"Too many requests to YouTube right now, retry in {retry_after:.1f}s")
+
+class TokenBucket:
+    """Thread-safe token-bucket rate limiter
+
+    Tokens refill at rate per second up to burst. Nothing here sleeps while
+    holding the lock: try_acquire() takes a token only if one is available and
+    otherwise tells the caller how long to wait, and reserve() always takes a
+    token, going into debt if needed, and returns the wait that reserves the
+    caller a place in line. Only acquire() sleeps, and it is meant for
+    background workers rather than request threads.
+    """
+
+    def __init__(self, rate, burst=1):
+        """Create a bucket that starts full"""
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.updated = time.time()
+
+    def _load(self):
+        """Return the stored (tokens, updated) state"""
+        return self.tokens, self.updated
+
+    def _save(self, tokens, updated):
+        self.tokens, self.updated = tokens, updated
+
+    def _locked(self):
+        """Context manager guarding the bucket state"""
+        return self.lock
+
+    def _take(self, tokens, allow_debt):
+        """Refill, then take tokens if allowed; return the seconds to wait"""
+        with self._locked():
+            now = time.time()
+            available, updated = self._load()
+            available = min(self.burst, available + max(now - updated, 0) * self.rate)
+
+            if available >= tokens:
+                self._save(available - tokens, now)
+                return 0.0
+
+            wait = (tokens - available) / self.rate
+            if allow_debt:
+                self._save(available - tokens, now)
+            else:
+                self._save(available, now)
+            return wait
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available; return 0, or the seconds until they would be"""
+        return self._take(tokens, allow_debt=False)
+
+    def reserve(self, tokens=1):
+        """Take tokens now and return how long the caller must wait before using them"""
+        return self._take(tokens, allow_debt=True)
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available (background workers only)"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            logger.debug(f"Rate limiting applied, waiting {wait:.2f} seconds")
+            time.sleep(wait)
+        return wait
+
+class _FileLock:
+    """flock() on an open file, plus a thread lock for threads of this process"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket whose state lives in a small file shared by all processes
+
+    Gunicorn workers and download worker processes each have their own
+    downloader, so a per-process bucket would let N processes make N times the
+    configured rate. The state (tokens, last update time) is stored in path and
+    updated under an exclusive flock().
+    """
+
+    STATE_FORMAT = struct.Struct('<dd')
+
+    def __init__(self, path, rate, burst=1):
+        """Open (or create) the shared state file"""
+        super().__init__(rate, burst)
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.file_lock = _FileLock(self.fd)
+
+    def _locked(self):
+        return self.file_lock
+
+    def _load(self):
+        data = os.pread(self.fd, self.STATE_FORMAT.size, 0)
+        if len(data) < self.STATE_FORMAT.size:
+            # New file: start with a full bucket
+            return self.burst, time.time()
+        return self.STATE_FORMAT.unpack(data)
+
+    def _save(self, tokens, updated):
+        os.pwrite(self.fd, self.STATE_FORMAT.pack(tokens, updated), 0)
+
+def create_rate_limiter(rate, burst=1, path=None):
+    """Create a token bucket, shared across processes through path if given"""
+    if path:
+        try:
+            return FileTokenBucket(path, rate, burst)
+        except OSError as e:
+            logger.error(f"Could not open rate limiter state at {path}, limiting per process: {str(e)}")
+    return TokenBucket(rate, burst)
@@ -0,0 +1,116 @@
+import os
+import csv
+import json
+import gzip
+import time
+import logging
+from datetime import datetime, timedelta
+
+from models import db, Download, DownloadDailyAggregate
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+class ArchiveWriter:
+    """Appends raw Download records to a gzip-compressed JSONL or CSV file"""
+
+    def __init__(self, path, export_format='jsonl'):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{export_format}'")
+        self.path = path
+        self.file = gzip.open(path, 'wt', encoding='utf-8', newline='')
+        self.csv = None
+        if export_format == 'csv':
+            self.csv = csv.DictWriter(self.file, fieldnames=[column.name for column in Download.__table__.columns])
+            self.csv.writeheader()
+
+    def write(self, rows):
+        """Write a batch of rows (dicts) and push it out to the file"""
+        for row in rows:
+            values = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+            if self.csv:
+                self.csv.writerow(values)
+            else:
+                self.file.write(json.dumps(values) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def prune_downloads(older_than_days, batch_size=1000, export_dir=None, export_format='jsonl', pause=0.1):
+    """Compact Download records older than older_than_days into daily aggregates
+
+    Records are processed oldest first, batch_size at a time. Each batch is
+    added to DownloadDailyAggregate and deleted in one short transaction, so
+    the table is never locked for long and an interrupted run double-counts
+    nothing; pause seconds between batches leave room for other writers.
+    With export_dir, each batch is first written to a compressed JSONL or CSV
+    archive there (a batch whose transaction fails may be exported again on
+    the next run, but no record is deleted without being archived).
+
+    Returns a summary dict with the cutoff, the records deleted, the
+    aggregate rows touched and the archive path.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    table = Download.__table__
+    archive = None
+    if export_dir:
+        os.makedirs(export_dir, exist_ok=True)
+        name = f"downloads-before-{cutoff:%Y%m%d}-{int(time.time())}.{export_format}.gz"
+        archive = ArchiveWriter(os.path.join(export_dir, name), export_format)
+
+    deleted, aggregates = 0, set()
+    try:
+        while True:
+            rows = [
+                dict(row._mapping) for row in db.session.execute(
+                    db.select(table).where(table.c.created_at < cutoff)
+                    .order_by(table.c.created_at, table.c.id).limit(batch_size)
+                )
+            ]
+            if not rows:
+                break
+
+            counts = {}
+            for row in rows:
+                key = (
+                    row['created_at'].date(), row['video_id'] or '', row['format_type'] or '',
+                    row['quality'] or '', row['status'] or ''
+                )
+                count = counts.setdefault(key, [0, 0, 0.0])
+                count[0] += 1
+                count[1] += row['file_size'] or 0
+                count[2] += row['download_time'] or 0.0
+
+            if archive:
+                archive.write(rows)
+            try:
+                DownloadDailyAggregate.add(counts)
+                db.session.execute(table.delete().where(table.c.id.in_([row['id'] for row in rows])))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+            deleted += len(rows)
+            aggregates.update(counts)
+            logger.debug(f"Compacted {deleted} download records so far")
+            if len(rows) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    finally:
+        if archive:
+            archive.close()
+            if not deleted:
+                os.remove(archive.path)
+                archive = None
+
+    logger.info(f"Compacted {deleted} download records older than {cutoff:%Y-%m-%d} into {len(aggregates)} daily aggregates")
+    return {
+        'cutoff': cutoff,
+        'deleted': deleted,
+        'aggregates': len(aggregates),
+        'archive': archive.path if archive else None
+    }
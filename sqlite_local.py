@@ -0,0 +1,26 @@
+import sqlite3
+import threading
+
+class LocalConnections:
+    """One connection per thread to a SQLite database shared across processes
+
+    sqlite3 connections can't be used from several threads, so each thread
+    opens its own on first use. Connections use WAL, so readers don't block
+    the writer, wait up to timeout seconds for locks, and are in autocommit
+    mode: callers open their own transactions with BEGIN.
+    """
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get(self):
+        """Return the calling thread's connection"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
@@ -20,6 +20,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const progressBar = document.getElementById('progress-bar');
     const progressText = document.getElementById('progress-text');
     const downloadCompleteAlert = document.getElementById('download-complete');
+    const playlistItemLinks = document.getElementById('playlist-item-links');
+    const playlistPackagingSelect = document.getElementById('playlist-packaging');
     const downloadLink = document.getElementById('download-link');
     const videoTabButton = document.getElementById('video-tab-button');
     const audioTabButton = document.getElementById('audio-tab-button');
@@ -36,6 +38,8 @@ document.addEventListener('DOMContentLoaded', function() {
     let downloadType = 'video'; // Default download type
     let isDownloading = false;
     let downloadCheckInterval = null;
+    let downloadEventSource = null;
+    let streamedDownloadUrl = null;
     let isPlaylist = false;
     
     // Initialize tooltips if Bootstrap is loaded
@@ -119,10 +123,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const formData = new FormData();
         formData.append('url', youtubeUrl);
         
-        fetch('/video_info', {
-            method: 'POST',
-            body: formData
-        })
+        fetchVideoInfo(formData, loaderText)
         .then(response => {
             if (!response.ok) {
                 return response.json().then(data => {
@@ -176,6 +177,25 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    function fetchVideoInfo(formData, loaderText, attempt = 0) {
+        // The server answers 429 with Retry-After instead of making us wait on
+        // its rate limiter, so wait here and try again a few times
+        return fetch('/video_info', {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => {
+            if (response.status !== 429 || attempt >= 3) {
+                return response;
+            }
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 2;
+            // Only swap the text node so the animated dots keep going
+            loaderText.firstChild.nodeValue = `Server is busy, retrying in ${retryAfter}s `;
+            return new Promise(resolve => setTimeout(resolve, retryAfter * 1000))
+                .then(() => fetchVideoInfo(formData, loaderText, attempt + 1));
+        });
+    }
+    
     function displayVideoInfo(videoInfo) {
         // Show video info container with a fade-in effect
         videoInfoContainer.style.opacity = '0';
@@ -507,6 +527,10 @@ document.addEventListener('DOMContentLoaded', function() {
         formData.append('format', selectedFormat);
         formData.append('type', downloadType);
         formData.append('playlist', isPlaylist.toString());
+        formData.append('title', currentVideoInfo.title || '');
+        if (isPlaylist && playlistPackagingSelect) {
+            formData.append('packaging', playlistPackagingSelect.value);
+        }
         
         // Start download request
         fetch('/download', {
@@ -516,6 +540,10 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(response => {
             if (!response.ok) {
                 return response.json().then(data => {
+                    // Queue is full: tell the user roughly how long to wait
+                    if (response.status === 429 && data.eta) {
+                        throw new Error(`${data.error} (estimated wait: ${data.eta} seconds)`);
+                    }
                     throw new Error(data.error || 'Error starting download');
                 });
             }
@@ -538,11 +566,38 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     function checkDownloadProgress(downloadId) {
-        // Clear any existing interval
-        if (downloadCheckInterval) {
-            clearInterval(downloadCheckInterval);
+        // Stop tracking any previous download
+        stopProgressChecks();
+        
+        // Prefer a Server-Sent Events stream, which only sends changed progress
+        if (typeof EventSource !== 'undefined') {
+            downloadEventSource = new EventSource(`/download_events/${downloadId}`);
+            
+            downloadEventSource.onmessage = function(event) {
+                handleDownloadStatus(JSON.parse(event.data));
+            };
+            
+            downloadEventSource.addEventListener('gone', function() {
+                stopProgressChecks();
+                isDownloading = false;
+                updateDownloadButton();
+                showError('Download not found');
+            });
+            
+            downloadEventSource.onerror = function() {
+                // EventSource reconnects by itself unless the stream was refused
+                if (downloadEventSource && downloadEventSource.readyState === EventSource.CLOSED) {
+                    stopProgressChecks();
+                    pollDownloadProgress(downloadId);
+                }
+            };
+            return;
         }
         
+        pollDownloadProgress(downloadId);
+    }
+    
+    function pollDownloadProgress(downloadId) {
         // Check progress every 1 second
         downloadCheckInterval = setInterval(() => {
             fetch(`/download_status/${downloadId}`)
@@ -553,46 +608,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     return response.json();
                 })
                 .then(status => {
-                    updateProgressUI(status);
-                    
-                    // If download is complete or failed, stop checking
-                    if (status.status === 'complete' || status.status === 'error') {
-                        clearInterval(downloadCheckInterval);
-                        downloadCheckInterval = null;
-                        isDownloading = false;
-                        updateDownloadButton();
-                        
-                        if (status.status === 'complete' && status.download_url) {
-                            // Show download complete message with link
-                            downloadCompleteAlert.style.display = 'block';
-                            downloadLink.href = status.download_url;
-                            downloadLink.download = status.filename ? status.filename.split('/').pop() : 'youtube_download';
-                            
-                            // Check if quality was downgraded and display message
-                            if (status.quality_downgraded && status.quality_message) {
-                                // Create or update the quality message element
-                                let qualityAlertElement = document.getElementById('quality-downgrade-alert');
-                                if (!qualityAlertElement) {
-                                    qualityAlertElement = document.createElement('div');
-                                    qualityAlertElement.id = 'quality-downgrade-alert';
-                                    qualityAlertElement.className = 'alert alert-info mt-3';
-                                    qualityAlertElement.role = 'alert';
-                                    // Insert the quality alert before the download link alert
-                                    downloadCompleteAlert.parentNode.insertBefore(qualityAlertElement, downloadCompleteAlert);
-                                }
-                                // Update the message
-                                qualityAlertElement.innerHTML = `
-                                    <i class="bi bi-info-circle-fill me-2"></i>
-                                    <strong>Quality Notification:</strong> ${status.quality_message}
-                                `;
-                                qualityAlertElement.style.display = 'block';
-                            }
-                        }
-                        
-                        if (status.status === 'error') {
-                            showError(`Download failed: ${status.error || 'Unknown error'}`);
-                        }
-                    }
+                    handleDownloadStatus(status);
                 })
                 .catch(error => {
                     console.error('Error checking download status:', error);
@@ -600,8 +616,131 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 1000);
     }
     
+    function renderItemLinks(itemUrls) {
+        // Playlists delivered as separate files list each video once it is ready
+        const list = playlistItemLinks.querySelector('ul');
+        if (list.children.length === itemUrls.length) {
+            return;
+        }
+        list.innerHTML = '';
+        itemUrls.forEach(item => {
+            const listItem = document.createElement('li');
+            const link = document.createElement('a');
+            link.href = item.url;
+            link.download = item.name;
+            link.innerHTML = '<i class="bi bi-download me-2"></i>';
+            link.appendChild(document.createTextNode(item.name));
+            listItem.appendChild(link);
+            list.appendChild(listItem);
+        });
+        playlistItemLinks.style.display = 'block';
+    }
+    
+    function startFileDownload(url) {
+        // A temporary download link saves the file without navigating away from the progress view
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = '';
+        link.style.display = 'none';
+        document.body.appendChild(link);
+        link.click();
+        document.body.removeChild(link);
+    }
+    
+    function stopProgressChecks() {
+        if (downloadCheckInterval) {
+            clearInterval(downloadCheckInterval);
+            downloadCheckInterval = null;
+        }
+        if (downloadEventSource) {
+            downloadEventSource.close();
+            downloadEventSource = null;
+        }
+    }
+    
+    function handleDownloadStatus(status) {
+        updateProgressUI(status);
+        
+        if (status.item_urls) {
+            renderItemLinks(status.item_urls);
+        }
+        
+        // Streamed playlist archives can be saved while the items are still downloading
+        if (status.stream && status.download_url && status.status !== 'complete' && streamedDownloadUrl !== status.download_url) {
+            streamedDownloadUrl = status.download_url;
+            startFileDownload(status.download_url);
+        }
+        
+        // If download is complete, failed or cancelled, stop checking
+        if (status.status === 'complete' || status.status === 'error' || status.status === 'cancelled') {
+            stopProgressChecks();
+            isDownloading = false;
+            updateDownloadButton();
+            
+            if (status.status === 'complete' && status.download_url) {
+                // Show download complete message with link
+                downloadCompleteAlert.style.display = 'block';
+                downloadLink.href = status.download_url;
+                downloadLink.download = status.filename ? status.filename.split('/').pop() : 'youtube_download';
+                
+                // Check if quality was downgraded and display message
+                if (status.quality_downgraded && status.quality_message) {
+                    // Create or update the quality message element
+                    let qualityAlertElement = document.getElementById('quality-downgrade-alert');
+                    if (!qualityAlertElement) {
+                        qualityAlertElement = document.createElement('div');
+                        qualityAlertElement.id = 'quality-downgrade-alert';
+                        qualityAlertElement.className = 'alert alert-info mt-3';
+                        qualityAlertElement.role = 'alert';
+                        // Insert the quality alert before the download link alert
+                        downloadCompleteAlert.parentNode.insertBefore(qualityAlertElement, downloadCompleteAlert);
+                    }
+                    // Update the message
+                    qualityAlertElement.innerHTML = `
+                        <i class="bi bi-info-circle-fill me-2"></i>
+                        <strong>Quality Notification:</strong> ${status.quality_message}
+                    `;
+                    qualityAlertElement.style.display = 'block';
+                }
+                
+                // Let the user know if some playlist items are missing
+                if (status.items_message) {
+                    let itemsAlertElement = document.getElementById('playlist-items-alert');
+                    if (!itemsAlertElement) {
+                        itemsAlertElement = document.createElement('div');
+                        itemsAlertElement.id = 'playlist-items-alert';
+                        itemsAlertElement.className = 'alert alert-warning mt-3';
+                        itemsAlertElement.role = 'alert';
+                        downloadCompleteAlert.parentNode.insertBefore(itemsAlertElement, downloadCompleteAlert);
+                    }
+                    itemsAlertElement.innerHTML = `
+                        <i class="bi bi-exclamation-triangle-fill me-2"></i>
+                        <strong>Some items were skipped:</strong> ${status.items_message}
+                    `;
+                    itemsAlertElement.style.display = 'block';
+                }
+            }
+            
+            if (status.status === 'error') {
+                showError(`Download failed: ${status.error || 'Unknown error'}`);
+            }
+        }
+    }
+    
     function updateProgressUI(status) {
-        if (status.status === 'starting') {
+        if (status.status === 'queued') {
+            // Waiting for a free download slot
+            progressBar.style.width = '0%';
+            progressBar.setAttribute('aria-valuenow', '0');
+            progressText.textContent = status.queue_position
+                ? `Waiting in queue (position ${status.queue_position})...`
+                : 'Waiting in queue...';
+            
+            loaderProgressBar.style.width = '0%';
+            loaderText.textContent = status.eta
+                ? `Your ${downloadType} is queued, starting in about ${status.eta} seconds...`
+                : `Your ${downloadType} is queued...`;
+        } else if (status.status === 'starting') {
             // Update standard progress bar
             progressBar.style.width = '0%';
             progressBar.setAttribute('aria-valuenow', '0');
@@ -616,7 +755,9 @@ document.addEventListener('DOMContentLoaded', function() {
             // Update standard progress bar
             progressBar.style.width = `${progress}%`;
             progressBar.setAttribute('aria-valuenow', progress);
-            progressText.textContent = `Downloading: ${progress}%`;
+            progressText.textContent = status.playlist_count
+                ? `Downloading: ${progress}% (${status.playlist_done || 0} of ${status.playlist_count} items done)`
+                : `Downloading: ${progress}%`;
             
             // Update cool loader
             loaderProgressBar.style.width = `${progress}%`;
@@ -650,6 +791,13 @@ document.addEventListener('DOMContentLoaded', function() {
             loaderText.textContent = 'Download complete!';
             
             // Hide cool loader after a brief delay
+            setTimeout(() => {
+                coolLoaderContainer.style.display = 'none';
+            }, 1000);
+        } else if (status.status === 'cancelled') {
+            progressText.textContent = 'Download cancelled';
+            loaderText.textContent = 'Download cancelled';
+            
             setTimeout(() => {
                 coolLoaderContainer.style.display = 'none';
             }, 1000);
@@ -760,6 +908,12 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Hide download complete alert
         downloadCompleteAlert.style.display = 'none';
+        playlistItemLinks.style.display = 'none';
+        playlistItemLinks.querySelector('ul').innerHTML = '';
+        const itemsAlertElement = document.getElementById('playlist-items-alert');
+        if (itemsAlertElement) {
+            itemsAlertElement.style.display = 'none';
+        }
         
         // Hide cool loader
         coolLoaderContainer.style.display = 'none';
@@ -769,11 +923,8 @@ document.addEventListener('DOMContentLoaded', function() {
         isDownloading = false;
         isPlaylist = false;
         
-        // Clear any running interval
-        if (downloadCheckInterval) {
-            clearInterval(downloadCheckInterval);
-            downloadCheckInterval = null;
-        }
+        // Stop any running progress stream or polling
+        stopProgressChecks();
     }
     
     // Utility Functions
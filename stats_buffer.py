@@ -0,0 +1,97 @@
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+class CounterBuffer:
+    """Aggregates counter increments in memory and writes them out in batches
+
+    Counters are keyed by (key, field), e.g. (date, 'visits'). add() only
+    touches a dict under a lock; a background thread hands the accumulated
+    deltas to flush() every interval seconds, or as soon as threshold
+    increments are pending. flush({key: {field: n}}) must apply them
+    atomically on the database side (UPDATE ... SET field = field + n), so
+    any number of worker processes can flush concurrently without losing
+    updates. Deltas of a failed flush are put back and retried on the next
+    round; whatever is still pending at exit is lost unless close() runs.
+    """
+
+    def __init__(self, flush, interval=5.0, threshold=100):
+        self._flush = flush
+        self.interval = interval
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.flush_lock = threading.Lock()  # One flush at a time
+        self.pending = defaultdict(lambda: defaultdict(int))
+        self.pending_count = 0
+        self.closed = False
+        self.counters = {'increments': 0, 'flushes': 0, 'rows_written': 0, 'errors': 0}
+        self.thread = threading.Thread(target=self._run, name='counter-buffer', daemon=True)
+        self.thread.start()
+
+    def add(self, key, **deltas):
+        """Add deltas (field=n) to the counters of key"""
+        with self.lock:
+            for field, amount in deltas.items():
+                self.pending[key][field] += amount
+            self.pending_count += 1
+            self.counters['increments'] += 1
+            if self.pending_count >= self.threshold:
+                self.wakeup.notify()
+
+    def _take(self):
+        """Swap out the pending deltas (caller holds the lock)"""
+        batch = {key: dict(fields) for key, fields in self.pending.items()}
+        self.pending.clear()
+        self.pending_count = 0
+        return batch
+
+    def flush(self):
+        """Write out the pending deltas now; return False if that failed"""
+        with self.flush_lock:
+            with self.lock:
+                batch = self._take()
+            if not batch:
+                return True
+            try:
+                self._flush(batch)
+            except Exception as e:
+                logger.error(f"Error flushing counters, will retry: {str(e)}")
+                with self.lock:
+                    for key, fields in batch.items():
+                        for field, amount in fields.items():
+                            self.pending[key][field] += amount
+                    self.pending_count += len(batch)
+                    self.counters['errors'] += 1
+                return False
+            with self.lock:
+                self.counters['flushes'] += 1
+                self.counters['rows_written'] += len(batch)
+            logger.debug(f"Flushed counters for {len(batch)} keys")
+            return True
+
+    def _run(self):
+        failed = False
+        while True:
+            with self.lock:
+                # After a failed flush, wait out the interval even if over the threshold
+                if not self.closed and (failed or self.pending_count < self.threshold):
+                    self.wakeup.wait(self.interval)
+                if self.closed:
+                    return
+            failed = not self.flush()
+
+    def close(self):
+        """Stop the background thread and flush what is left"""
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        self.thread.join(timeout=self.interval)
+        self.flush()
+
+    def stats(self):
+        """Return increment/flush counters and the number of pending keys"""
+        with self.lock:
+            return dict(self.counters, pending_keys=len(self.pending))
@@ -0,0 +1,78 @@
+import os
+
+import yt_dlp
+
+from downloader import YoutubeDownloader
+
+def _format(format_id, ext, vcodec, acodec, height=None, abr=None):
+    return {
+        'format_id': format_id, 'ext': ext, 'vcodec': vcodec, 'acodec': acodec,
+        'height': height, 'abr': abr, 'protocol': 'https',
+        'url': f"https://example.com/{format_id}.{ext}",
+    }
+
+def _extracted_info():
+    """Info as /video_info leaves it: processed, with a merged 137+140 selection"""
+    formats = [
+        _format('18', 'mp4', 'avc1', 'mp4a.40.2', height=360, abr=96),
+        _format('137', 'mp4', 'avc1', 'none', height=1080),
+        _format('140', 'm4a', 'none', 'mp4a.40.2', abr=128),
+    ]
+    info = {
+        'id': 'dQw4w9WgXcQ', 'title': 'Test video', 'extractor': 'youtube', 'extractor_key': 'Youtube',
+        'webpage_url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'formats': formats,
+    }
+    selected = {'format_id': '137+140', 'ext': 'mp4', 'requested_formats': [formats[1], formats[2]]}
+    info.update(selected)
+    info['requested_downloads'] = [dict(selected, filepath='/tmp/old.mp4')]
+    return info
+
+def _requested_formats(format_spec):
+    """Return the format IDs yt-dlp would download for reused info"""
+    downloads = []
+
+    class RecordingYoutubeDL(yt_dlp.YoutubeDL):
+        def process_info(self, info_dict):
+            # What process_info downloads: the merged formats, or the single format
+            downloads.append([f['format_id'] for f in info_dict.get('requested_formats') or [info_dict]])
+
+    info = YoutubeDownloader._reusable_info(_extracted_info())
+    with RecordingYoutubeDL({'format': format_spec, 'simulate': True, 'quiet': True}) as ydl:
+        ydl.process_ie_result(info, download=True)
+    assert len(downloads) == 1
+    return downloads[0]
+
+def test_reused_info_with_merged_selection_downloads_single_audio_format():
+    assert _requested_formats('bestaudio') == ['140']
+
+def test_reused_info_with_merged_selection_downloads_requested_format():
+    assert _requested_formats('best') == ['18']
+    assert _requested_formats('18') == ['18']
+
+def test_reused_info_can_still_be_merged():
+    assert _requested_formats('bestvideo+bestaudio') == ['137', '140']
+
+class SameTitlePlaylistDownloader(YoutubeDownloader):
+    """Expands every playlist to three items that share a title"""
+
+    def _expand_playlist(self, url):
+        return 'Playlist', [{'url': f"https://www.youtube.com/watch?v=item{index}", 'id': f"item{index}", 'title': 'Same'} for index in range(3)]
+
+def test_playlist_items_with_the_same_title_do_not_collide(tmp_path):
+    def download_item(item_url, item_dir, hook):
+        # Every item gets the name yt-dlp's '%(title)s.%(ext)s' template gives it
+        filepath = os.path.join(item_dir, 'Same.mp4')
+        with open(filepath, 'w') as item_file:
+            item_file.write(item_url)
+        return {'filepath': filepath}
+
+    downloader = SameTitlePlaylistDownloader(playlist_concurrency=3, playlist_work_dir=str(tmp_path / 'work'))
+    items = []
+    result = downloader._download_playlist('https://www.youtube.com/playlist?list=PLsame', download_item, str(tmp_path), None, items.append, 'video-best')
+
+    names = ['001 - Same.mp4', '002 - Same.mp4', '003 - Same.mp4']
+    assert sorted(os.path.basename(path) for path in items) == names
+    assert sorted(name for name in os.listdir(result['filepath']) if not name.startswith('.')) == names
+    for index, name in enumerate(names):
+        with open(os.path.join(result['filepath'], name)) as item_file:
+            assert item_file.read() == f"https://www.youtube.com/watch?v=item{index}"
@@ -0,0 +1,119 @@
+import builtins
+
+import pytest
+from flask import Flask, request
+from werkzeug.test import create_environ
+from werkzeug.wsgi import FileWrapper
+
+import file_server
+
+CONTENT = bytes(range(100))
+
+@pytest.fixture
+def served(tmp_path, monkeypatch):
+    """Return (client, files opened) for an app serving CONTENT at /file"""
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(CONTENT)
+    server = file_server.FileServer()
+    app = Flask(__name__)
+
+    @app.route('/file', methods=['GET', 'HEAD'])
+    def serve():
+        return server.send(request, str(path), 'video.mp4')
+
+    opened = []
+
+    def tracking_open(*args, **kwargs):
+        file = builtins.open(*args, **kwargs)
+        opened.append(file)
+        return file
+
+    monkeypatch.setattr(file_server, 'open', tracking_open, raising=False)
+    return app.test_client(), opened
+
+def test_full_file(served):
+    client, opened = served
+    response = client.get('/file')
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['Content-Length'] == '100'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    response.close()
+    assert all(file.closed for file in opened)
+
+def test_single_range(served):
+    client, _ = served
+    response = client.get('/file', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[10:20]
+    assert response.headers['Content-Range'] == 'bytes 10-19/100'
+    assert response.headers['Content-Length'] == '10'
+
+    # The end is clamped to the file
+    response = client.get('/file', headers={'Range': 'bytes=90-500'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[90:]
+    assert response.headers['Content-Range'] == 'bytes 90-99/100'
+
+def test_suffix_range(served):
+    client, _ = served
+    response = client.get('/file', headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[-10:]
+    assert response.headers['Content-Range'] == 'bytes 90-99/100'
+
+    # A suffix longer than the file asks for all of it
+    response = client.get('/file', headers={'Range': 'bytes=-500'})
+    assert response.status_code == 206
+    assert response.data == CONTENT
+    assert response.headers['Content-Range'] == 'bytes 0-99/100'
+
+def test_multi_range_gets_the_whole_file(served):
+    client, _ = served
+    response = client.get('/file', headers={'Range': 'bytes=0-9,20-29'})
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert 'Content-Range' not in response.headers
+
+def test_range_past_the_end(served):
+    client, opened = served
+    response = client.get('/file', headers={'Range': 'bytes=100-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */100'
+    assert not opened
+
+def test_if_range(served):
+    client, _ = served
+    etag = client.head('/file').headers['ETag'].strip('"')
+
+    response = client.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': f'"{etag}"'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[:10]
+
+    # A stale validator gets the whole file
+    response = client.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+    response = client.get('/file', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+
+@pytest.mark.parametrize('file_wrapper', [None, FileWrapper])
+def test_file_closed_without_iterating(served, file_wrapper):
+    client, opened = served
+    environ = create_environ('/file', headers={'Range': 'bytes=10-19'})
+    if file_wrapper:
+        environ['wsgi.file_wrapper'] = file_wrapper
+    # The server closes the body without sending any of it, as when the client goes away
+    body = client.application(environ, lambda status, headers: None)
+    assert len(opened) == 1
+    assert not opened[0].closed
+    body.close()
+    assert opened[0].closed
+
+def test_head_opens_no_file(served):
+    client, opened = served
+    response = client.head('/file')
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == '100'
+    assert not opened
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from job_queue import JobScheduler, QueueFullError
+
+class StubDownload:
+    """Job callable that blocks until released, standing in for a download"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.ran = False
+
+    def __call__(self, scheduler, job_id):
+        self.ran = True
+        self.started.set()
+        # A real download polls is_cancelled() from its progress hook
+        while not self.release.wait(0.01):
+            if scheduler.is_cancelled(job_id):
+                return
+
+def run_blocking(scheduler, job_id, job_type='video'):
+    """Submit a stub job and wait until a worker has started it"""
+    stub = StubDownload()
+    scheduler.submit(job_id, job_type, stub, args=(scheduler, job_id))
+    assert stub.started.wait(2)
+    return stub
+
+def test_rejects_jobs_beyond_queue_depth():
+    scheduler = JobScheduler(concurrency={'video': 1}, max_queue_size=2, default_duration=30)
+    running = run_blocking(scheduler, 'running')
+    assert scheduler.submit('queued-1', 'video', StubDownload(), args=(scheduler, 'queued-1')) == 1
+    assert scheduler.submit('queued-2', 'video', StubDownload(), args=(scheduler, 'queued-2')) == 2
+
+    with pytest.raises(QueueFullError) as error:
+        scheduler.submit('rejected', 'video', StubDownload(), args=(scheduler, 'rejected'))
+    assert error.value.position == 3
+    assert error.value.eta == 90
+    with pytest.raises(QueueFullError):
+        scheduler.check_capacity('video')
+    assert scheduler.position('rejected') == 0
+    running.release.set()
+
+def test_reports_position_and_eta():
+    scheduler = JobScheduler(concurrency={'video': 2}, max_queue_size=10, default_duration=60)
+    running = [run_blocking(scheduler, f"running-{index}") for index in range(2)]
+    for index in range(3):
+        scheduler.submit(f"queued-{index}", 'video', StubDownload(), args=(scheduler, f"queued-{index}"))
+
+    assert [scheduler.position(f"queued-{index}") for index in range(3)] == [1, 2, 3]
+    # Two slots: positions 1 and 2 wait for one round of jobs, position 3 for two
+    assert [scheduler.eta(f"queued-{index}") for index in range(3)] == [60, 60, 120]
+    assert scheduler.position('running-0') == 0
+    assert scheduler.eta('running-0') == 0
+    assert scheduler.stats()['video']['queued'] == 3
+    assert scheduler.stats()['video']['running'] == 2
+
+    # Higher priority (lower number) jobs go to the front
+    scheduler.submit('urgent', 'video', StubDownload(), args=(scheduler, 'urgent'), priority=-1)
+    assert scheduler.position('urgent') == 1
+    assert scheduler.position('queued-0') == 2
+    for stub in running:
+        stub.release.set()
+
+def test_cancel_queued_and_running_jobs():
+    scheduler = JobScheduler(concurrency={'video': 1}, max_queue_size=1, default_duration=30)
+    running = run_blocking(scheduler, 'running')
+    queued = StubDownload()
+    scheduler.submit('queued', 'video', queued, args=(scheduler, 'queued'))
+
+    # A queued job is dropped and frees its queue slot at once
+    assert scheduler.cancel('queued') == 'cancelled'
+    assert scheduler.position('queued') == 0
+    scheduler.check_capacity('video')
+
+    # A running job is only asked to stop
+    assert scheduler.cancel('running') == 'cancelling'
+    assert scheduler.is_cancelled('running')
+    assert scheduler.cancel('unknown') is None
+
+    # The worker moves on once the running job stops, skipping the cancelled one
+    follow_up = run_blocking(scheduler, 'follow-up')
+    assert not queued.ran
+    follow_up.release.set()
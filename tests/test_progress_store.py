@@ -0,0 +1,120 @@
+import zlib
+import threading
+
+import pytest
+
+from progress_store import ProgressStore, MemoryProgressStore, MmapProgressStore
+
+SLOTS = 8
+
+@pytest.fixture
+def store(tmp_path):
+    return MmapProgressStore(str(tmp_path / 'progress.map'), slots=SLOTS, slot_size=512)
+
+def colliding_keys(count, start=0):
+    """Return count keys that all hash to slot start"""
+    keys = []
+    candidate = 0
+    while len(keys) < count:
+        key = f"key-{candidate}"
+        if zlib.crc32(key.encode('utf-8')) % SLOTS == start:
+            keys.append(key)
+        candidate += 1
+    return keys
+
+def slot_states(store):
+    return [store._read_slot(index)[0] for index in range(SLOTS)]
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        ProgressStore()
+    assert isinstance(MemoryProgressStore(), ProgressStore)
+
+def test_colliding_keys_probe_to_the_next_slots(store):
+    first, second, third = colliding_keys(3)
+    for number, key in enumerate((first, second, third)):
+        assert store.add(key, {'number': number})
+    assert not store.add(second, {'number': 5})
+
+    assert [store.get(key)['number'] for key in (first, second, third)] == [0, 1, 2]
+    assert slot_states(store)[:3] == [MmapProgressStore.USED] * 3
+    assert store.update(third, status='done')
+    assert store.get(third)['status'] == 'done'
+    assert store.get(third)['version'] == 2
+    assert sorted(store.keys()) == sorted([first, second, third])
+
+def test_tombstones_keep_chains_intact_and_are_reused(store):
+    first, second, third, fourth = colliding_keys(4)
+    for key in (first, second, third):
+        store.set(key, {'key': key})
+
+    # Deleting from the middle of a chain leaves a tombstone, so later keys are still found
+    assert store.delete(second)['key'] == second
+    assert slot_states(store)[:3] == [MmapProgressStore.USED, MmapProgressStore.DELETED, MmapProgressStore.USED]
+    assert store.get(second) is None
+    assert store.get(third)['key'] == third
+
+    # A new key takes the tombstone's slot
+    store.set(fourth, {'key': fourth})
+    assert slot_states(store)[:3] == [MmapProgressStore.USED] * 3
+    assert store.get(fourth)['key'] == fourth
+
+    # Deleting the end of a chain frees it along with the tombstones before it
+    store.delete(fourth)
+    store.delete(third)
+    assert slot_states(store)[:3] == [MmapProgressStore.USED, MmapProgressStore.EMPTY, MmapProgressStore.EMPTY]
+    assert store.get(first)['key'] == first
+
+def test_full_table(store):
+    keys = [f"key-{index}" for index in range(SLOTS)]
+    for key in keys:
+        store.set(key, {})
+    with pytest.raises(RuntimeError):
+        store.set('one-too-many', {})
+    # Existing entries can still be written, and a delete makes room
+    assert store.update(keys[0], status='done')
+    store.delete(keys[1])
+    store.set('one-too-many', {})
+    assert store.get('one-too-many') is not None
+
+def test_oversized_values_are_rejected_not_truncated(store):
+    with pytest.raises(ValueError):
+        store.set('key', {'filename': '/tmp/' + 'x' * MmapProgressStore.MAX_STRING})
+    with pytest.raises(ValueError):
+        store.set('key', {'items': ['x' * 100] * 10})
+    assert store.get('key') is None
+
+def test_reader_gives_up_on_a_slot_left_mid_write(store):
+    key, = colliding_keys(1, start=3)
+    store.set(key, {'status': 'downloading'})
+    # A writer that died between the two header writes leaves the sequence odd
+    state, seq, version, key_len, data_len = MmapProgressStore.HEADER.unpack_from(store.map, 3 * store.slot_size)
+    MmapProgressStore.HEADER.pack_into(store.map, 3 * store.slot_size, state, seq + 1, version, key_len, data_len)
+    store.READ_TIMEOUT = 0.05
+    with pytest.raises(RuntimeError):
+        store.get(key)
+
+    # The next write repairs the slot
+    store._write_slot(3, state, version, key.encode('utf-8'), b'{"version":1}')
+    assert store.get(key) == {'version': 1}
+
+def test_readers_never_see_partial_writes(store):
+    store.set('key', {'value': 'a' * 300})
+    stop = threading.Event()
+    seen = set()
+
+    def write():
+        while not stop.is_set():
+            for value in ('a' * 300, 'b' * 10):
+                store.set('key', {'value': value})
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(2000):
+            # A torn read would fail to parse or mix the two values
+            seen.add(store.get('key')['value'])
+    finally:
+        stop.set()
+        writer.join()
+    assert seen <= {'a' * 300, 'b' * 10}
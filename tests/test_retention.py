@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from models import db, Download, DownloadDailyAggregate, DownloadPopularity
+from retention import prune_downloads
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'test.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+def add_downloads(video_id, count, age_days, status='completed', title='Title'):
+    created_at = datetime.utcnow() - timedelta(days=age_days)
+    db.session.add_all([
+        Download(
+            url=f"https://www.youtube.com/watch?v={video_id}", video_id=f"video:{video_id}", video_title=title,
+            format_type='video', quality='best', status=status, created_at=created_at
+        )
+        for _ in range(count)
+    ])
+    db.session.commit()
+
+def popularity():
+    return {row.video_id: (row.downloads, row.video_title) for row in DownloadPopularity.query.all()}
+
+def test_rebuild_after_prune_keeps_compacted_downloads(app):
+    add_downloads('old', 3, age_days=100, title='Old title')
+    add_downloads('old', 2, age_days=100, status='failed')
+    add_downloads('both', 4, age_days=100)
+    add_downloads('both', 1, age_days=1, title='New title')
+    add_downloads('new', 2, age_days=1)
+    DownloadPopularity.rebuild()
+    before = popularity()
+
+    summary = prune_downloads(30, batch_size=2, pause=0)
+    assert summary['deleted'] == 9
+    assert Download.query.count() == 3
+    assert DownloadDailyAggregate.query.filter_by(status='completed').count() == 2
+
+    assert DownloadPopularity.rebuild() == 3
+    after = popularity()
+    assert {video_id: downloads for video_id, (downloads, _) in after.items()} == {
+        video_id: downloads for video_id, (downloads, _) in before.items()
+    } == {'video:old': 3, 'video:both': 5, 'video:new': 2}
+    # Titles only survive on records that weren't compacted
+    assert after['video:both'][1] == 'New title'
+    assert after['video:old'][1] is None
+    last_download = DownloadPopularity.query.filter_by(video_id='video:old').one().last_download_at
+    assert last_download.date() == (datetime.utcnow() - timedelta(days=100)).date()
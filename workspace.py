@@ -0,0 +1,61 @@
+import os
+import shutil
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Workspaces:
+    """Job-scoped scratch directories and the directories finished files move to
+
+    Every job downloads into a directory of its own under jobs/, so jobs never
+    see each other's partial, intermediate (separate video and audio formats
+    before merging) or finished files, however many run at once and whatever
+    their titles. When a job finishes, only its exact output file leaves the
+    workspace, with a single rename into files/<job id>/, and the rest of the
+    workspace is discarded. Finished files go into the output cache instead
+    when there is one (see OutputCache.store).
+    """
+
+    def __init__(self, root):
+        self.jobs_root = os.path.join(root, 'jobs')
+        self.files_root = os.path.join(root, 'files')
+        os.makedirs(self.jobs_root, exist_ok=True)
+        os.makedirs(self.files_root, exist_ok=True)
+
+    def path(self, job_id):
+        return os.path.join(self.jobs_root, job_id)
+
+    def output_dir(self, job_id):
+        """Directory a job's published file lives in"""
+        return os.path.join(self.files_root, job_id)
+
+    def create(self, job_id):
+        """Create the job's workspace and return its path"""
+        path = self.path(job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def contains(self, job_id, path):
+        """Check whether path is inside the job's workspace"""
+        workspace = os.path.abspath(self.path(job_id))
+        return os.path.commonpath([workspace, os.path.abspath(path)]) == workspace
+
+    def publish(self, job_id, filepath):
+        """Move a finished file out of the job's workspace and return its new path
+
+        Files are published with one rename on the same filesystem, so no one
+        ever sees a partially written file at the published path. Paths
+        outside the workspace are returned unchanged.
+        """
+        if not self.contains(job_id, filepath) or not os.path.isfile(filepath):
+            return filepath
+        output_dir = self.output_dir(job_id)
+        os.makedirs(output_dir, exist_ok=True)
+        published = os.path.join(output_dir, os.path.basename(filepath))
+        os.replace(filepath, published)
+        logger.debug(f"Published {published}")
+        return published
+
+    def discard(self, job_id):
+        """Remove the job's workspace and everything left in it"""
+        shutil.rmtree(self.path(job_id), ignore_errors=True)